@@ -1,24 +1,146 @@
+import json
+from datetime import date, timedelta
+
+from django.conf import settings
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
 from .models import Listing, Reservation
+from .search import search_listings, search_terms
+
+DEFAULT_ADMIN_PERFORMANCE = {
+    'ESTIMATED_COUNT_THRESHOLD': 100000,
+    'INLINE_DAYS': 90,
+    'INLINE_PAGE_SIZE': 20,
+}
+
+
+def admin_performance_settings():
+    return {**DEFAULT_ADMIN_PERFORMANCE, **getattr(settings, 'ADMIN_PERFORMANCE', {})}
+
+
+def estimated_count(queryset):
+    """
+    Planner estimate of the queryset's row count on Postgres, None when an exact COUNT(*) is cheap enough
+    Tables the statistics put below ESTIMATED_COUNT_THRESHOLD rows are counted exactly.
+    """
+    threshold = admin_performance_settings()['ESTIMATED_COUNT_THRESHOLD']
+    connection = connections[queryset.db]
+    if threshold is None or connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+                       [connection.ops.quote_name(queryset.model._meta.db_table)])
+        row = cursor.fetchone()
+    if row is None or row[0] < threshold:
+        return None
+    if not queryset.query.where:
+        return int(row[0])
+    plan = json.loads(queryset.explain(format='json'))
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Changelist paginator that trusts the planner's estimate instead of COUNT(*) on large tables
+    """
+
+    @cached_property
+    def count(self):
+        estimate = estimated_count(self.object_list)
+        if estimate is None:
+            return super().count
+        return estimate
 
 
 class ReservationInline(admin.TabularInline):
+    """
+    Reservations ending in the last INLINE_DAYS days or later, INLINE_PAGE_SIZE per page
+    The page is picked with the reservations_page query parameter of the listing change page.
+    """
     model = Reservation
     extra = 1
+    template = 'admin/reservation/reservation_inline.html'
+    page_parameter = 'reservations_page'
+    page_number = 1
+    has_next_page = False
+
+    def bounded_queryset(self, request, listing):
+        options = admin_performance_settings()
+        page_size = options['INLINE_PAGE_SIZE']
+        try:
+            self.page_number = max(int(request.GET.get(self.page_parameter, 1)), 1)
+        except ValueError:
+            self.page_number = 1
+        offset = (self.page_number - 1) * page_size
+
+        # Each row's label is Reservation.__str__, which reads the listing
+        reservations = self.get_queryset(request).select_related('listing')
+        if listing is None or listing.pk is None:
+            return reservations.none()
+        page_ids = list(reservations.filter(listing=listing,
+                                            end_date__gte=date.today() - timedelta(days=options['INLINE_DAYS']))
+                        .order_by('start_date', 'pk').values_list('pk', flat=True)[offset:offset + page_size + 1])
+        self.has_next_page = len(page_ids) > page_size
+        return reservations.filter(pk__in=page_ids[:page_size]).order_by('start_date', 'pk')
 
 
 class ListingAdmin(admin.ModelAdmin):
     list_display = ('name', 'owner', 'address', 'description')
+    list_select_related = ('owner',)
+    ordering = ('id',)
+    # Full-text search of name, address and description plus an exact owner username match,
+    # see get_search_results
     search_fields = ('name', 'owner__username', 'address')
-    list_filter = ('name', 'address')
+    raw_id_fields = ('owner',)
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
     inlines = [ReservationInline, ]
 
+    def get_search_results(self, request, queryset, search_term):
+        terms = search_terms(search_term)
+        if not terms:
+            return queryset, False
+        matches = search_listings(Listing.objects.all(), terms).values('pk')
+        return queryset.filter(Q(pk__in=matches) | Q(owner__username=search_term.strip())), False
+
+    def get_formset_kwargs(self, request, obj, inline, prefix):
+        kwargs = super().get_formset_kwargs(request, obj, inline, prefix)
+        if isinstance(inline, ReservationInline):
+            kwargs['queryset'] = inline.bounded_queryset(request, obj)
+        return kwargs
+
 
 class ReservationAdmin(admin.ModelAdmin):
     list_display = ('name', 'listing', 'start_date', 'end_date', 'duration')
+    list_select_related = ('listing',)
+    # Indexed lookups only, see get_search_results
     search_fields = ('name', 'listing__name', 'listing__owner__username')
     list_filter = ('start_date', 'end_date')
     date_hierarchy = 'start_date'
+    autocomplete_fields = ('listing',)
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
+
+    def get_queryset(self, request):
+        # Reservation.__str__ reads the listing, the delete and history pages list reservations by it
+        return super().get_queryset(request).select_related('listing')
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        # Guest name prefix (an UPPER(name) index on Postgres), listing name full-text, exact username and ids
+        lookups = Q(name__istartswith=term) | Q(listing__owner__username=term)
+        terms = search_terms(term)
+        if terms:
+            lookups |= Q(listing__in=search_listings(Listing.objects.all(), terms).values('pk'))
+        if term.isdigit():
+            lookups |= Q(pk=int(term)) | Q(listing_id=int(term))
+        return queryset.filter(lookups), False
 
 
 admin.site.register(Listing, ListingAdmin)
@@ -0,0 +1,246 @@
+import logging
+import math
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import JsonResponse
+
+from .metrics import registry
+
+try:
+    from django_redis import get_redis_connection
+    from redis.exceptions import RedisError
+except ImportError:  # Without django-redis the buckets are always kept in process
+    get_redis_connection = None
+    RedisError = Exception
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ADMISSION_CONTROL = {
+    'ENABLED': True,
+    'KEY_PREFIX': 'reservation:admission',
+    # Header holding the client address behind a trusted proxy, e.g. HTTP_X_FORWARDED_FOR
+    'CLIENT_IP_HEADER': None,
+    # Proxies in front of the app that append to CLIENT_IP_HEADER, the client is that many entries from the right
+    'TRUSTED_PROXY_COUNT': 1,
+    'VIEWS': {},
+}
+
+# Both buckets are refilled and only charged when both have a token, in one round trip
+TOKEN_BUCKET_SCRIPT = """
+local now = tonumber(ARGV[1])
+local tokens = {}
+local retry_after = 0
+for index, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[index * 2])
+    local burst = tonumber(ARGV[index * 2 + 1])
+    local state = redis.call('HMGET', key, 'tokens', 'at')
+    local available = tonumber(state[1]) or burst
+    local at = tonumber(state[2]) or now
+    available = math.min(burst, available + math.max(0, now - at) * rate)
+    tokens[index] = available
+    if available < 1 then
+        retry_after = math.max(retry_after, (1 - available) / rate)
+    end
+end
+for index, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[index * 2])
+    local burst = tonumber(ARGV[index * 2 + 1])
+    local available = tokens[index]
+    if retry_after == 0 then
+        available = available - 1
+    end
+    redis.call('HSET', key, 'tokens', tostring(available), 'at', tostring(now))
+    redis.call('EXPIRE', key, math.ceil(burst / rate) + 1)
+end
+return tostring(retry_after)
+"""
+
+
+def admission_control_settings():
+    return {**DEFAULT_ADMISSION_CONTROL, **getattr(settings, 'ADMISSION_CONTROL', {})}
+
+
+def uses_redis():
+    backend = settings.CACHES.get('default', {}).get('BACKEND', '')
+    return get_redis_connection is not None and backend.startswith('django_redis')
+
+
+class LocalTokenBuckets:
+    """
+    In-process token buckets, used when the cache isn't Redis or Redis can't be reached
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def reset(self):
+        with self._lock:
+            self._buckets = {}
+
+    def take(self, buckets, now):
+        with self._lock:
+            refilled = []
+            retry_after = 0.0
+            for key, rate, burst in buckets:
+                available, at = self._buckets.get(key, (burst, now))
+                available = min(burst, available + max(0.0, now - at) * rate)
+                refilled.append((key, available))
+                if available < 1:
+                    retry_after = max(retry_after, (1 - available) / rate)
+            for key, available in refilled:
+                self._buckets[key] = (available - 1 if retry_after == 0 else available, now)
+            return retry_after
+
+
+class TokenBucketLimiter:
+    """
+    Client and global token buckets shared by all processes through Redis
+    take() returns 0 when the request is admitted, otherwise the seconds until a token is back.
+    """
+
+    def __init__(self):
+        self.local = LocalTokenBuckets()
+        self._script = None
+
+    def reset(self):
+        self.local.reset()
+
+    def _redis_take(self, buckets, now):
+        if self._script is None:
+            self._script = get_redis_connection('default').register_script(TOKEN_BUCKET_SCRIPT)
+        args = [now]
+        for _, rate, burst in buckets:
+            args.extend([rate, burst])
+        # Lua numbers come back truncated to integers, the script returns a string
+        return float(self._script(keys=[key for key, _, _ in buckets], args=args))
+
+    def take(self, buckets):
+        now = time.time()
+        if uses_redis():
+            try:
+                return self._redis_take(buckets, now)
+            except RedisError:
+                logger.warning('Rate limiter falling back to in-process buckets', exc_info=True)
+        return self.local.take(buckets, now)
+
+
+class ConcurrencyLimiter:
+    """
+    Per-process count of in-flight requests per limit group, never blocks
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._in_flight = {}
+
+    def try_acquire(self, group, limit):
+        with self._lock:
+            in_flight = self._in_flight.get(group, 0)
+            if in_flight >= limit:
+                return False
+            self._in_flight[group] = in_flight + 1
+            return True
+
+    def release(self, group):
+        with self._lock:
+            self._in_flight[group] -= 1
+
+    def in_flight(self, group):
+        with self._lock:
+            return self._in_flight.get(group, 0)
+
+
+rate_limiter = TokenBucketLimiter()
+concurrency_limiter = ConcurrencyLimiter()
+
+
+def client_id(request, options):
+    # The address only, looking up the session user would already query the database
+    address = None
+    if options['CLIENT_IP_HEADER']:
+        # Entries left of the ones our proxies appended come from the client and can be anything
+        entries = [entry.strip() for entry in request.META.get(options['CLIENT_IP_HEADER'], '').split(',')]
+        entries = [entry for entry in entries if entry]
+        if len(entries) >= options['TRUSTED_PROXY_COUNT']:
+            address = entries[-options['TRUSTED_PROXY_COUNT']]
+    return f"ip:{address or request.META.get('REMOTE_ADDR', 'unknown')}"
+
+
+def token_buckets(request, group, limits, options):
+    buckets = []
+    if limits.get('CLIENT_RATE'):
+        buckets.append((f"{options['KEY_PREFIX']}:{group}:{client_id(request, options)}",
+                        limits['CLIENT_RATE'], limits.get('CLIENT_BURST', limits['CLIENT_RATE'])))
+    if limits.get('GLOBAL_RATE'):
+        buckets.append((f"{options['KEY_PREFIX']}:{group}:global",
+                        limits['GLOBAL_RATE'], limits.get('GLOBAL_BURST', limits['GLOBAL_RATE'])))
+    return buckets
+
+
+def too_many_requests(retry_after):
+    response = JsonResponse({'error': 'Too many requests, please retry later.'}, status=429)
+    response['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+class AdmissionControlMiddleware:
+    """
+    Sheds requests to the views of ADMISSION_CONTROL['VIEWS'] with 429 before they reach the database
+    A view's limits are CLIENT_RATE/CLIENT_BURST (per client address), GLOBAL_RATE/GLOBAL_BURST
+    (tokens per second and bucket size) and MAX_CONCURRENT in-flight requests per process.
+    Views with the same GROUP share their buckets and concurrency slots.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        try:
+            return self.get_response(request)
+        finally:
+            self.release(request)
+
+    async def __acall__(self, request):
+        try:
+            return await self.get_response(request)
+        finally:
+            self.release(request)
+
+    def release(self, request):
+        group = getattr(request, '_admission_group', None)
+        if group is not None:
+            concurrency_limiter.release(group)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        options = admission_control_settings()
+        view = request.resolver_match.view_name
+        limits = options['VIEWS'].get(view)
+        if not options['ENABLED'] or limits is None:
+            return None
+        group = limits.get('GROUP', view)
+
+        buckets = token_buckets(request, group, limits, options)
+        if buckets:
+            retry_after = rate_limiter.take(buckets)
+            if retry_after:
+                registry.observe_shed(view, 'rate')
+                logger.info('Rate limit reached for %s', view)
+                return too_many_requests(retry_after)
+
+        if limits.get('MAX_CONCURRENT'):
+            if not concurrency_limiter.try_acquire(group, limits['MAX_CONCURRENT']):
+                registry.observe_shed(view, 'concurrency')
+                logger.info('Concurrency limit reached for %s', view)
+                return too_many_requests(1)
+            request._admission_group = group
+        return None
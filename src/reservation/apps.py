@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class ReservationConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'reservation'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,81 @@
+import logging
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from .models import ArchivedReservation, Reservation
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RESERVATION_ARCHIVE = {
+    'KEEP_DAYS': 30,
+    # Below the 999 bound parameters of older SQLite builds, larger batches are deleted in chunks
+    'BATCH_SIZE': 900,
+}
+
+HISTORY_TRUE_VALUES = ('1', 'true', 'yes')
+
+
+def reservation_archive_settings():
+    return {**DEFAULT_RESERVATION_ARCHIVE, **getattr(settings, 'RESERVATION_ARCHIVE', {})}
+
+
+def archive_cutoff():
+    """
+    Reservations ending before this date are archived by default
+    """
+    return date.today() - timedelta(days=reservation_archive_settings()['KEEP_DAYS'])
+
+
+def is_history_requested(request):
+    return request.query_params.get('history', '').lower() in HISTORY_TRUE_VALUES
+
+
+def reads_history(start_date):
+    """
+    Whether a window starting on start_date may need archived reservations
+    Nothing ending today or later is ever archived, so current and future windows never do.
+    """
+    return start_date < date.today()
+
+
+def _delete_sql(rows):
+    quote_name = connection.ops.quote_name
+    return (f'DELETE FROM {quote_name(Reservation._meta.db_table)} '
+            f'WHERE {quote_name("id")} IN ({", ".join(["%s"] * rows)})')
+
+
+def archive_reservations(before=None, batch_size=None, stdout=None):
+    """
+    Move the reservations that ended before `before` to ArchivedReservation, returns how many were moved
+    Each batch is copied and deleted in its own transaction with the rows locked, so bookings keep
+    going while a large backlog is archived. The delete is plain SQL: the occupancy rollup and the
+    calendars still count archived stays, so the Reservation delete signals must not run.
+    """
+    before = before or archive_cutoff()
+    if before > date.today():
+        raise ValueError('Reservations ending today or later are still used by availability checks.')
+    batch_size = batch_size or reservation_archive_settings()['BATCH_SIZE']
+
+    archived = 0
+    while True:
+        with transaction.atomic():
+            rows = list(Reservation.objects.select_for_update().filter(end_date__lt=before).order_by('pk')
+                        .values_list('pk', 'listing_id', 'name', 'start_date', 'end_date')[:batch_size])
+            if not rows:
+                break
+            ArchivedReservation.objects.bulk_create(
+                [ArchivedReservation(id=pk, listing_id=listing_id, name=name, start_date=start_date, end_date=end_date)
+                 for pk, listing_id, name, start_date, end_date in rows])
+            pks = [row[0] for row in rows]
+            chunk_size = connection.features.max_query_params or len(pks)
+            with connection.cursor() as cursor:
+                for offset in range(0, len(pks), chunk_size):
+                    chunk = pks[offset:offset + chunk_size]
+                    cursor.execute(_delete_sql(len(chunk)), chunk)
+        archived += len(rows)
+        if stdout:
+            stdout.write(f'{archived} reservations archived')
+    logger.info('Archived %s reservations ending before %s.', archived, before)
+    return archived
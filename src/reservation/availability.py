@@ -0,0 +1,173 @@
+import logging
+import threading
+import time
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+from .models import Reservation
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_AVAILABILITY_ENGINE = {
+    'ENABLED': False,
+    'HORIZON_DAYS': 365,
+    'REFRESH_SECONDS': 300,
+    # Above this many booked listings the search falls back to the SQL anti-join
+    'MAX_EXCLUDED_LISTINGS': 500,
+}
+
+
+def availability_engine_settings():
+    return {**DEFAULT_AVAILABILITY_ENGINE, **getattr(settings, 'AVAILABILITY_ENGINE', {})}
+
+
+class AvailabilityIndex:
+    """
+    In-process bitset of booked nights per listing
+    Bit i of a listing's bitmap is set when night `base_date + i` is reserved, for
+    a rolling horizon of HORIZON_DAYS nights starting today. Python ints are used as
+    the bitsets so a date-range search is a single AND per listing.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        # One build at a time, requests keep reading the current bitmaps meanwhile
+        self._build_lock = threading.Lock()
+        self._bitmaps = {}
+        self._base_date = None
+        self._horizon_days = 0
+        self._built_at = None
+        # Updates arriving while a build scans the table, replayed onto its bitmaps
+        self._pending = None
+
+    def reset(self):
+        with self._lock:
+            self._bitmaps = {}
+            self._base_date = None
+            self._built_at = None
+            self._pending = None
+
+    def build(self):
+        with self._build_lock:
+            self._build()
+
+    def _scan(self, base_date, horizon_days):
+        bitmaps = {}
+        # Shared by every request of the process, never read from a replica that may lag
+        reservations = (Reservation.objects.using(DEFAULT_DB_ALIAS)
+                        .filter(end_date__gte=base_date, start_date__lt=base_date + timedelta(days=horizon_days))
+                        .values_list('listing_id', 'start_date', 'end_date'))
+        for listing_id, start_date, end_date in reservations.iterator(chunk_size=2000):
+            mask = self._range_mask(base_date, horizon_days, start_date, end_date)
+            bitmaps[listing_id] = bitmaps.get(listing_id, 0) | mask
+        return bitmaps
+
+    def _build(self):
+        horizon_days = availability_engine_settings()['HORIZON_DAYS']
+        base_date = date.today()
+        with self._lock:
+            self._pending = []
+        try:
+            bitmaps = self._scan(base_date, horizon_days)
+        except BaseException:
+            with self._lock:
+                self._pending = None
+            raise
+
+        with self._lock:
+            pending, self._pending = self._pending or [], None
+            self._bitmaps = bitmaps
+            self._base_date = base_date
+            self._horizon_days = horizon_days
+            self._built_at = time.monotonic()
+            for update in pending:
+                if update[0] == 'add':
+                    self.add_reservation(*update[1:])
+        # Recomputed from the database, so outside the lock
+        for listing_id in {update[1] for update in pending if update[0] == 'rebuild'}:
+            self.rebuild_listing(listing_id)
+        logger.info('Availability index built for %s listings', len(bitmaps))
+
+    def _is_fresh(self, check_age=True):
+        # Called with self._lock held
+        if self._built_at is None or self._base_date != date.today():
+            return False
+        return (not check_age
+                or time.monotonic() - self._built_at <= availability_engine_settings()['REFRESH_SECONDS'])
+
+    def _ensure_fresh(self):
+        with self._lock:
+            if self._is_fresh():
+                return
+            usable = self._is_fresh(check_age=False)
+        if usable:
+            # Only refreshing, when another request already does that the current bitmaps are good enough
+            if self._build_lock.acquire(blocking=False):
+                try:
+                    self._build()
+                finally:
+                    self._build_lock.release()
+            return
+        with self._build_lock:
+            with self._lock:
+                # Built by another request while this one waited
+                built = self._is_fresh()
+            if not built:
+                self._build()
+
+    @staticmethod
+    def _range_mask(base_date, horizon_days, start_date, end_date):
+        first = max((start_date - base_date).days, 0)
+        last = min((end_date - base_date).days, horizon_days - 1)
+        if last < first:
+            return 0
+        return ((1 << (last - first + 1)) - 1) << first
+
+    def covers(self, start_date, end_date):
+        horizon_days = availability_engine_settings()['HORIZON_DAYS']
+        today = date.today()
+        return start_date >= today and end_date < today + timedelta(days=horizon_days)
+
+    def booked_listing_ids(self, start_date, end_date):
+        self._ensure_fresh()
+        with self._lock:
+            mask = self._range_mask(self._base_date, self._horizon_days, start_date, end_date)
+            return [listing_id for listing_id, bitmap in self._bitmaps.items() if bitmap & mask]
+
+    def add_reservation(self, listing_id, start_date, end_date):
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append(('add', listing_id, start_date, end_date))
+            if self._base_date is None:
+                return
+            mask = self._range_mask(self._base_date, self._horizon_days, start_date, end_date)
+            if mask:
+                self._bitmaps[listing_id] = self._bitmaps.get(listing_id, 0) | mask
+
+    def rebuild_listing(self, listing_id):
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append(('rebuild', listing_id))
+            if self._base_date is None:
+                return
+            base_date, horizon_days = self._base_date, self._horizon_days
+        bitmap = 0
+        reservations = (Reservation.objects.using(DEFAULT_DB_ALIAS)
+                        .filter(listing_id=listing_id, end_date__gte=base_date)
+                        .values_list('start_date', 'end_date'))
+        for start_date, end_date in reservations:
+            bitmap |= self._range_mask(base_date, horizon_days, start_date, end_date)
+        with self._lock:
+            if (self._base_date, self._horizon_days) != (base_date, horizon_days):
+                # Computed against bitmaps a build has since replaced, the build replays this listing
+                return
+            if bitmap:
+                self._bitmaps[listing_id] = bitmap
+            else:
+                self._bitmaps.pop(listing_id, None)
+
+
+availability_index = AvailabilityIndex()
+
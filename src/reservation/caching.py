@@ -0,0 +1,369 @@
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+import uuid
+import weakref
+from collections import OrderedDict
+from datetime import timedelta
+from zlib import crc32
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import status
+from rest_framework.response import Response
+
+from .metrics import record_cache_event
+from .routers import primary_reads
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LISTING_CACHE = {
+    'VERSION': 1,
+    'TIMEOUT': 300,
+    'L1_MAX_ENTRIES': 1024,
+    'L1_TIMEOUT': 5,
+    'LOCK_TIMEOUT': 5,
+}
+
+
+# Single-flight loads lock one of these stripes instead of one lock per key, which would pile up forever
+KEY_LOCK_STRIPES = 64
+
+
+def listing_cache_settings():
+    return {**DEFAULT_LISTING_CACHE, **getattr(settings, 'LISTING_CACHE', {})}
+
+
+class LRUCache:
+    """
+    Small thread-safe in-process LRU with a per-entry time to live
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout, max_entries):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + timeout)
+            self._entries.move_to_end(key)
+            while len(self._entries) > max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class ListingCache:
+    """
+    Two-tier cache for Listing objects
+    L1 is a per-process LRU kept only for a few seconds, L2 is the shared Django cache (Redis).
+    Keys are namespaced and versioned, a miss is recomputed by one caller only (an in-process
+    lock stripe per key plus a cache.add lock across processes) while the others wait for its result.
+    """
+    namespace = 'reservation:listing'
+
+    def __init__(self):
+        self.local = LRUCache()
+        self._counters_lock = threading.Lock()
+        self._counters = {'l1_hits': 0, 'l2_hits': 0, 'misses': 0}
+        self._key_locks_lock = threading.Lock()
+        self._key_locks = [threading.Lock() for _ in range(KEY_LOCK_STRIPES)]
+        self._async_key_locks = weakref.WeakKeyDictionary()
+
+    def make_key(self, pk):
+        return f"{self.namespace}:v{listing_cache_settings()['VERSION']}:{pk}"
+
+    def _count(self, counter):
+        with self._counters_lock:
+            self._counters[counter] += 1
+        record_cache_event(hit=counter != 'misses')
+
+    def stats(self):
+        with self._counters_lock:
+            return dict(self._counters)
+
+    def reset_stats(self):
+        with self._counters_lock:
+            self._counters = {counter: 0 for counter in self._counters}
+
+    @staticmethod
+    def _key_stripe(key):
+        return crc32(key.encode()) % KEY_LOCK_STRIPES
+
+    def _key_lock(self, key):
+        return self._key_locks[self._key_stripe(key)]
+
+    def _get_cached(self, key, options):
+        value = self.local.get(key)
+        if value is not None:
+            self._count('l1_hits')
+            return value
+        value = cache.get(key)
+        if value is not None:
+            self._count('l2_hits')
+            self.local.set(key, value, options['L1_TIMEOUT'], options['L1_MAX_ENTRIES'])
+        return value
+
+    def get_or_load(self, pk, loader):
+        options = listing_cache_settings()
+        key = self.make_key(pk)
+        value = self._get_cached(key, options)
+        if value is not None:
+            return value
+
+        with self._key_lock(key):
+            # Another thread may have loaded the key while this one was waiting
+            value = self._get_cached(key, options)
+            if value is not None:
+                return value
+            self._count('misses')
+            with primary_reads():
+                value = self._load_once(key, loader, options)
+
+        self.local.set(key, value, options['L1_TIMEOUT'], options['L1_MAX_ENTRIES'])
+        return value
+
+    async def aget_or_load(self, pk, loader):
+        """
+        Async counterpart of get_or_load for the async views, loader is a coroutine function
+        Concurrent misses on one key inside the event loop wait on an asyncio lock
+        instead of each querying the database.
+        """
+        options = listing_cache_settings()
+        key = self.make_key(pk)
+        value = await self._aget_cached(key, options)
+        if value is not None:
+            return value
+
+        async with self._async_key_lock(key):
+            value = await self._aget_cached(key, options)
+            if value is not None:
+                return value
+            self._count('misses')
+            with primary_reads():
+                value = await loader()
+            await cache.aset(key, value, options['TIMEOUT'])
+
+        self.local.set(key, value, options['L1_TIMEOUT'], options['L1_MAX_ENTRIES'])
+        return value
+
+    async def _aget_cached(self, key, options):
+        value = self.local.get(key)
+        if value is not None:
+            self._count('l1_hits')
+            return value
+        value = await cache.aget(key)
+        if value is not None:
+            self._count('l2_hits')
+            self.local.set(key, value, options['L1_TIMEOUT'], options['L1_MAX_ENTRIES'])
+        return value
+
+    def _async_key_lock(self, key):
+        # asyncio locks belong to one event loop, each loop gets its stripes, dropped with the loop
+        loop = asyncio.get_running_loop()
+        with self._key_locks_lock:
+            stripes = self._async_key_locks.get(loop)
+            if stripes is None:
+                stripes = self._async_key_locks[loop] = [asyncio.Lock() for _ in range(KEY_LOCK_STRIPES)]
+        return stripes[self._key_stripe(key)]
+
+    def _load_once(self, key, loader, options):
+        lock_key = f'{key}:lock'
+        if cache.add(lock_key, 1, options['LOCK_TIMEOUT']):
+            try:
+                value = loader()
+                cache.set(key, value, options['TIMEOUT'])
+                return value
+            finally:
+                cache.delete(lock_key)
+
+        # Another process is loading the key, wait for it instead of hitting the database too
+        deadline = time.monotonic() + options['LOCK_TIMEOUT']
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            value = cache.get(key)
+            if value is not None:
+                return value
+        logger.info('Timed out waiting for %s, loading it from db', key)
+        return loader()
+
+    def invalidate(self, pk):
+        key = self.make_key(pk)
+        self.local.delete(key)
+        cache.delete(key)
+
+
+listing_cache = ListingCache()
+
+
+DEFAULT_AVAILABILITY_RESULT_CACHE = {
+    'ENABLED': False,
+    'TIMEOUT': 60,
+    'MAX_RANGE_DAYS': 90,
+}
+
+
+def availability_result_cache_settings():
+    return {**DEFAULT_AVAILABILITY_RESULT_CACHE, **getattr(settings, 'AVAILABILITY_RESULT_CACHE', {})}
+
+
+class AvailabilityResultCache:
+    """
+    Cache of paginated availability search responses keyed by date range and page
+    Every night has a token in the shared cache and a result key embeds the tokens of
+    all nights it covers. A reservation for D1..D2 replaces the tokens of D1..D2 only,
+    so exactly the cached ranges overlapping it stop being reachable. A generation
+    token covers changes that affect every range (listings added or removed).
+    """
+    namespace = 'reservation:available'
+
+    def __init__(self):
+        self._counters_lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0}
+
+    def _count(self, counter):
+        with self._counters_lock:
+            self._counters[counter] += 1
+        record_cache_event(hit=counter != 'misses')
+
+    def stats(self):
+        with self._counters_lock:
+            return dict(self._counters)
+
+    def reset_stats(self):
+        with self._counters_lock:
+            self._counters = {counter: 0 for counter in self._counters}
+
+    def _night_token_key(self, night):
+        return f'{self.namespace}:night:{night.isoformat()}'
+
+    @property
+    def _generation_key(self):
+        return f'{self.namespace}:generation'
+
+    def _tokens(self, start_date, end_date):
+        nights = [start_date + timedelta(days=offset) for offset in range((end_date - start_date).days + 1)]
+        token_keys = [self._generation_key] + [self._night_token_key(night) for night in nights]
+        tokens = cache.get_many(token_keys)
+        missing = {key: uuid.uuid4().hex for key in token_keys if key not in tokens}
+        if missing:
+            # A fresh token, never a default, so an evicted token can't revive an old entry
+            cache.set_many(missing, None)
+            tokens.update(missing)
+        return [tokens[key] for key in token_keys]
+
+    def make_key(self, request, start_date, end_date):
+        params = sorted((name, value) for name, value in request.query_params.items()
+                        if name not in ('start_date', 'end_date'))
+        tokens = self._tokens(start_date, end_date)
+        digest = hashlib.md5(repr((request.get_host(), params, tokens)).encode()).hexdigest()
+        return f'{self.namespace}:{start_date.isoformat()}:{end_date.isoformat()}:{digest}'
+
+    def get_or_compute(self, request, start_date, end_date, compute):
+        options = availability_result_cache_settings()
+        if not options['ENABLED'] or (end_date - start_date).days >= options['MAX_RANGE_DAYS']:
+            return compute()
+
+        key = self.make_key(request, start_date, end_date)
+        data = cache.get(key)
+        if data is not None:
+            self._count('hits')
+            return Response(data)
+
+        self._count('misses')
+        with primary_reads():
+            response = compute()
+        if response.status_code == status.HTTP_200_OK:
+            cache.set(key, response.data, options['TIMEOUT'])
+        return response
+
+    def invalidate_range(self, start_date, end_date):
+        nights = [start_date + timedelta(days=offset) for offset in range((end_date - start_date).days + 1)]
+        cache.set_many({self._night_token_key(night): uuid.uuid4().hex for night in nights}, None)
+
+    def invalidate_all(self):
+        cache.set(self._generation_key, uuid.uuid4().hex, None)
+
+
+availability_result_cache = AvailabilityResultCache()
+
+
+DEFAULT_LISTING_CALENDAR_CACHE = {
+    'TIMEOUT': 300,
+}
+
+
+def listing_calendar_cache_settings():
+    return {**DEFAULT_LISTING_CALENDAR_CACHE, **getattr(settings, 'LISTING_CALENDAR_CACHE', {})}
+
+
+class ListingCalendarCache:
+    """
+    Booked-night bitmasks of listings per date window
+    Every listing has a token in the shared cache that is part of its calendar keys,
+    invalidating a listing drops its token so all of its cached windows become unreachable
+    at once while other listings keep theirs.
+    """
+    namespace = 'reservation:calendar'
+
+    def _token_key(self, listing_id):
+        return f'{self.namespace}:token:{listing_id}'
+
+    def _tokens(self, listing_ids):
+        token_keys = {listing_id: self._token_key(listing_id) for listing_id in listing_ids}
+        tokens = cache.get_many(token_keys.values())
+        missing = {key: uuid.uuid4().hex for key in token_keys.values() if key not in tokens}
+        if missing:
+            cache.set_many(missing, None)
+            tokens.update(missing)
+        return {listing_id: tokens[key] for listing_id, key in token_keys.items()}
+
+    def get_many(self, listing_ids, start_date, end_date, compute):
+        """
+        {listing_id: bitmask} for listing_ids, compute(missing listing ids) is called once for the uncached ones
+        """
+        tokens = self._tokens(listing_ids)
+        keys = {listing_id: f'{self.namespace}:{listing_id}:{tokens[listing_id]}:'
+                            f'{start_date.isoformat()}:{end_date.isoformat()}'
+                for listing_id in listing_ids}
+        cached = cache.get_many(keys.values())
+        calendars = {listing_id: cached[key] for listing_id, key in keys.items() if key in cached}
+        for _ in calendars:
+            record_cache_event(hit=True)
+
+        missing = [listing_id for listing_id in listing_ids if listing_id not in calendars]
+        if missing:
+            for _ in missing:
+                record_cache_event(hit=False)
+            with primary_reads():
+                computed = compute(missing)
+            cache.set_many({keys[listing_id]: mask for listing_id, mask in computed.items()},
+                           listing_calendar_cache_settings()['TIMEOUT'])
+            calendars.update(computed)
+        return calendars
+
+    def invalidate(self, listing_ids):
+        cache.delete_many([self._token_key(listing_id) for listing_id in listing_ids])
+
+
+listing_calendar_cache = ListingCalendarCache()
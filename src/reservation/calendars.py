@@ -0,0 +1,168 @@
+import base64
+from itertools import groupby
+
+from django.db.models import FilteredRelation, Q
+from rest_framework import status
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+
+from .archive import reads_history
+from .caching import listing_calendar_cache
+from .models import ArchivedReservation, Listing
+from .utils import parse_input_dates
+
+CALENDAR_ENCODINGS = ('rle', 'bitmask', 'packed')
+CALENDAR_MAX_DAYS = 366
+CALENDAR_MAX_LISTINGS = 100
+MATRIX_MAX_DAYS = 90
+
+
+def parse_window(start_date, end_date, max_days):
+    try:
+        start_date, end_date = parse_input_dates(start_date, end_date, allow_past=True)
+    except ValueError:
+        raise ValidationError('Dates must be in YYYY-MM-DD format.')
+    if (end_date - start_date).days >= max_days:
+        raise ValidationError(f'The window is limited to {max_days} nights.')
+    return start_date, end_date
+
+
+def parse_calendar_window(start_date, end_date, encoding):
+    """
+    Validated (start_date, end_date, encoding) of a calendar request, past windows are allowed
+    """
+    start_date, end_date = parse_window(start_date, end_date, CALENDAR_MAX_DAYS)
+    encoding = encoding or 'rle'
+    if encoding not in CALENDAR_ENCODINGS:
+        raise ValidationError(f'encoding must be one of {", ".join(CALENDAR_ENCODINGS)}.')
+    return start_date, end_date, encoding
+
+
+def parse_listing_ids(value):
+    try:
+        listing_ids = sorted({int(listing_id) for listing_id in (value or '').split(',') if listing_id.strip()})
+    except ValueError:
+        raise ValidationError('listings must be a comma separated list of listing ids.')
+    if not listing_ids:
+        raise ValidationError('listings is required.')
+    if len(listing_ids) > CALENDAR_MAX_LISTINGS:
+        raise ValidationError(f'At most {CALENDAR_MAX_LISTINGS} listings per request.')
+    return listing_ids
+
+
+def _mark_nights(mask, reservation_start, reservation_end, start_date, end_date):
+    first = (max(reservation_start, start_date) - start_date).days
+    last = (min(reservation_end, end_date) - start_date).days
+    return mask | (((1 << (last - first + 1)) - 1) << first)
+
+
+def booked_masks(listing_ids, start_date, end_date):
+    """
+    {listing_id: bitmask} of existing listings, bit i is set when night start_date + i is booked
+    One query: the listings LEFT JOINed to their reservations inside the window, so listings
+    without any booking still come back and unknown ids don't. Windows starting in the past
+    read the archived reservations with a second query.
+    """
+    rows = (Listing.objects.filter(pk__in=listing_ids)
+            .annotate(window=FilteredRelation('reservations', condition=Q(reservations__start_date__lte=end_date,
+                                                                           reservations__end_date__gte=start_date)))
+            .order_by('pk', 'window__start_date')
+            .values_list('pk', 'window__start_date', 'window__end_date'))
+
+    masks = {}
+    for listing_id, reservations in groupby(rows, key=lambda row: row[0]):
+        mask = 0
+        for _, reservation_start, reservation_end in reservations:
+            if reservation_start is not None:
+                mask = _mark_nights(mask, reservation_start, reservation_end, start_date, end_date)
+        masks[listing_id] = mask
+
+    if masks and reads_history(start_date):
+        archived = (ArchivedReservation.objects.filter(listing_id__in=masks).overlapping(start_date, end_date)
+                    .values_list('listing_id', 'start_date', 'end_date'))
+        for listing_id, reservation_start, reservation_end in archived:
+            masks[listing_id] = _mark_nights(masks[listing_id], reservation_start, reservation_end,
+                                             start_date, end_date)
+    return masks
+
+
+def encode_bitmask(mask, nights):
+    # '1' for a booked night, first night first
+    return format(mask, f'0{nights}b')[::-1] if nights else ''
+
+
+def encode_rle(mask, nights):
+    """
+    Runs of free (F) and booked (B) nights, e.g. F3B5F22
+    """
+    return ''.join(f"{'B' if state == '1' else 'F'}{len(list(run))}"
+                   for state, run in groupby(encode_bitmask(mask, nights)))
+
+
+def encode_packed(mask, nights):
+    """
+    Base64 of the little-endian bitset, bit i of byte i // 8 (least significant first) is night i
+    """
+    return base64.b64encode(mask.to_bytes((nights + 7) // 8, 'little')).decode()
+
+
+CALENDAR_ENCODERS = {
+    'rle': encode_rle,
+    'bitmask': encode_bitmask,
+    'packed': encode_packed,
+}
+
+
+def listing_calendars(listing_ids, start_date, end_date, encoding):
+    """
+    {listing_id: encoded calendar}, cached per listing and window
+    Listing ids that don't exist are left out.
+    """
+    masks = listing_calendar_cache.get_many(listing_ids, start_date, end_date,
+                                            lambda missing: booked_masks(missing, start_date, end_date))
+    nights = (end_date - start_date).days + 1
+    encode = CALENDAR_ENCODERS[encoding]
+    return {listing_id: encode(masks[listing_id], nights) for listing_id in listing_ids if listing_id in masks}
+
+
+def availability_matrix(listing_ids, start_date, end_date):
+    """
+    Matrix rows in listing_ids order, each a packed bitset of booked nights
+    The bitsets come from the shared per-listing calendar cache, the uncached listings are
+    computed together from one range query, so the cost follows listings x nights.
+    """
+    bitsets = listing_calendars(listing_ids, start_date, end_date, 'packed')
+    return [{'id': listing_id, 'booked': bitsets[listing_id]} for listing_id in listing_ids if listing_id in bitsets]
+
+
+def availability_matrix_response(request):
+    """
+    Matrix of the listings given in `listings`, or of a page of all listings ordered by id
+    """
+    try:
+        start_date, end_date = parse_window(request.query_params.get('start_date'),
+                                            request.query_params.get('end_date'), MATRIX_MAX_DAYS)
+        listing_ids = parse_listing_ids(request.query_params['listings']) if 'listings' in request.query_params else None
+    except ValidationError as e:
+        return Response({"error": e.detail}, status=status.HTTP_400_BAD_REQUEST)
+    window = {'start_date': start_date, 'end_date': end_date, 'nights': (end_date - start_date).days + 1,
+              'encoding': 'packed'}
+
+    if listing_ids is not None:
+        rows = availability_matrix(listing_ids, start_date, end_date)
+        if len(rows) < len(listing_ids):
+            found = {row['id'] for row in rows}
+            missing = ', '.join(str(listing_id) for listing_id in listing_ids if listing_id not in found)
+            return Response({'error': f'Listings not found: {missing}.'}, status=status.HTTP_404_NOT_FOUND)
+        return Response({**window, 'results': rows})
+
+    paginator = PageNumberPagination()
+    try:
+        listing_ids = list(paginator.paginate_queryset(Listing.objects.order_by('id').values_list('id', flat=True),
+                                                       request))
+    except NotFound:
+        return Response({'error': 'Invalid page number.'}, status=status.HTTP_400_BAD_REQUEST)
+    response = paginator.get_paginated_response(availability_matrix(listing_ids, start_date, end_date))
+    response.data.update(window)
+    return response
@@ -0,0 +1,145 @@
+import csv
+import heapq
+import json
+from operator import itemgetter
+
+from django.http import StreamingHttpResponse
+from rest_framework.exceptions import ValidationError
+
+from .models import ArchivedReservation, Reservation
+from .utils import parse_input_dates
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, the stdlib encoder is used without it
+    orjson = None
+
+EXPORT_FORMATS = ('csv', 'ndjson')
+EXPORT_CHUNK_SIZE = 2000
+
+# Output column and the values_list lookup it's read from, listing and owner come from the same query
+EXPORT_FIELDS = (
+    ('id', 'id'),
+    ('listing_id', 'listing_id'),
+    ('listing_name', 'listing__name'),
+    ('owner', 'listing__owner__username'),
+    ('name', 'name'),
+    ('start_date', 'start_date'),
+    ('end_date', 'end_date'),
+)
+EXPORT_COLUMNS = tuple(column for column, _ in EXPORT_FIELDS)
+
+# Spreadsheet apps evaluate cells starting with these as formulas
+CSV_FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def parse_export_filters(listing_id=None, start_date=None, end_date=None):
+    """
+    Validated keyword arguments for reservation_export_query
+    Dates are optional but come as a pair, past dates are allowed.
+    """
+    filters = {}
+    if listing_id not in (None, ''):
+        try:
+            filters['listing_id'] = int(listing_id)
+        except (TypeError, ValueError):
+            raise ValidationError('listing must be an integer.')
+    if start_date or end_date:
+        try:
+            filters['start_date'], filters['end_date'] = parse_input_dates(start_date, end_date, allow_past=True)
+        except ValueError:
+            raise ValidationError('Dates must be in YYYY-MM-DD format.')
+    return filters
+
+
+def reservation_export_query(listing_id=None, start_date=None, end_date=None, model=Reservation):
+    """
+    Export rows as tuples in EXPORT_FIELDS order, reservations overlapping the date range if one is given
+    """
+    reservations = model.objects.all()
+    if listing_id is not None:
+        reservations = reservations.filter(listing_id=listing_id)
+    if start_date is not None and end_date is not None:
+        reservations = reservations.overlapping(start_date, end_date)
+    return reservations.order_by('id').values_list(*(lookup for _, lookup in EXPORT_FIELDS))
+
+
+def export_rows(queryset):
+    # Server-side cursor on Postgres, so memory stays flat whatever the table size
+    return queryset.iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+
+def reservation_export_rows(filters, history=False):
+    """
+    Rows of reservation_export_query, merged by id with the archived reservations when history is set
+    Both tables are read in id order and archived rows keep their id, so the merge streams too.
+    """
+    querysets = [reservation_export_query(**filters)]
+    if history:
+        querysets.append(reservation_export_query(**filters, model=ArchivedReservation))
+    # Rows are read after the view returned, pin the database chosen for this request now
+    rows = [export_rows(queryset.using(queryset.db)) for queryset in querysets]
+    return heapq.merge(*rows, key=itemgetter(0)) if history else rows[0]
+
+
+class _Echo:
+    """
+    File-like object whose write returns the value, lets csv.writer produce strings
+    """
+
+    def write(self, value):
+        return value
+
+
+def _csv_cell(value):
+    if isinstance(value, str) and value.startswith(CSV_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def iter_csv(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(EXPORT_COLUMNS)
+    batch = []
+    for row in rows:
+        batch.append(writer.writerow([_csv_cell(value) for value in row]))
+        if len(batch) == EXPORT_CHUNK_SIZE:
+            yield ''.join(batch)
+            batch = []
+    if batch:
+        yield ''.join(batch)
+
+
+def _ndjson_line(row):
+    entry = dict(zip(EXPORT_COLUMNS, row))
+    if orjson is not None:
+        return orjson.dumps(entry, option=orjson.OPT_APPEND_NEWLINE).decode()
+    return json.dumps(entry, ensure_ascii=False, default=str) + '\n'
+
+
+def iter_ndjson(rows):
+    batch = []
+    for row in rows:
+        batch.append(_ndjson_line(row))
+        if len(batch) == EXPORT_CHUNK_SIZE:
+            yield ''.join(batch)
+            batch = []
+    if batch:
+        yield ''.join(batch)
+
+
+EXPORT_WRITERS = {
+    'csv': (iter_csv, 'text/csv; charset=utf-8'),
+    'ndjson': (iter_ndjson, 'application/x-ndjson; charset=utf-8'),
+}
+
+
+def reservation_export_response(export_format, filters, history=False):
+    """
+    StreamingHttpResponse with the reservations matching filters, rows are read while the response is sent
+    """
+    write, content_type = EXPORT_WRITERS[export_format]
+    response = StreamingHttpResponse(write(reservation_export_rows(filters, history)),
+                                     content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="reservations.{export_format}"'
+    return response
@@ -0,0 +1,319 @@
+import csv
+import io
+import json
+import logging
+import os
+from bisect import bisect_right
+from collections import defaultdict
+
+from django.contrib.auth.models import User
+from django.core.management.color import no_style
+from django.db import IntegrityError, connection, transaction
+from rest_framework.exceptions import ValidationError
+
+from .availability import availability_index
+from .caching import availability_result_cache, listing_cache, listing_calendar_cache
+from .models import Listing, Reservation
+from .occupancy import add_reservations
+from .utils import parse_input_dates
+
+logger = logging.getLogger(__name__)
+
+IMPORT_FORMATS = ('csv', 'ndjson')
+IMPORT_METHODS = ('auto', 'bulk_create', 'copy')
+IMPORT_CHUNK_SIZE = 1000
+
+REJECT_COLUMNS = ('kind', 'line', 'error', 'row')
+
+
+def detect_format(path):
+    extension = os.path.splitext(path)[1].lower()
+    return 'ndjson' if extension in ('.ndjson', '.jsonl', '.json') else 'csv'
+
+
+def read_rows(path, file_format):
+    """
+    Yields (line number, row dict, error) without loading the whole file
+    """
+    with open(path, newline='', encoding='utf-8') as input_file:
+        if file_format == 'csv':
+            reader = csv.DictReader(input_file)
+            for row in reader:
+                yield reader.line_num, row, None
+            return
+
+        for line_number, line in enumerate(input_file, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                yield line_number, {'raw': line.rstrip('\n')}, 'Invalid JSON.'
+                continue
+            if not isinstance(row, dict):
+                yield line_number, {'raw': row}, 'Each line must be a JSON object.'
+                continue
+            yield line_number, row, None
+
+
+def chunked(rows, chunk_size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class BookedIntervals:
+    """
+    Non-overlapping [start, end] intervals of one listing kept sorted by start, each with the file line that booked it
+    """
+
+    def __init__(self):
+        self.starts = []
+        self.ends = []
+        self.lines = []
+
+    def conflict(self, start_date, end_date):
+        # Intervals never overlap each other, so only the last one starting on or before end_date can overlap
+        position = bisect_right(self.starts, end_date) - 1
+        if position >= 0 and self.ends[position] >= start_date:
+            return self.lines[position]
+        return None
+
+    def add(self, start_date, end_date, line):
+        position = bisect_right(self.starts, start_date)
+        self.starts.insert(position, start_date)
+        self.ends.insert(position, end_date)
+        self.lines.insert(position, line)
+
+
+def _text(row, field, max_length=None, required=True):
+    value = row.get(field)
+    value = '' if value is None else str(value).strip()
+    if required and not value:
+        raise ValidationError(f'{field} is required.')
+    if max_length is not None and len(value) > max_length:
+        raise ValidationError(f'{field} must have at most {max_length} characters.')
+    return value
+
+
+def _optional_int(row, field):
+    value = row.get(field)
+    if value in (None, ''):
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValidationError(f'{field} must be an integer.')
+
+
+class BulkImporter:
+    """
+    Streams listing and reservation rows into the database in chunks
+    Rows are validated a chunk at a time with one lookup query per chunk, reservations get the
+    Reservation.clean/parse_input_dates rules without the past date rule (historic data is expected)
+    and must not overlap each other or stored reservations. Accepted rows are loaded with
+    bulk_create, or COPY on Postgres; rejected rows go to the reject file with the reason.
+    """
+
+    def __init__(self, rejects_file=None, chunk_size=IMPORT_CHUNK_SIZE, method='auto', dry_run=False):
+        if method == 'auto':
+            method = 'copy' if connection.vendor == 'postgresql' else 'bulk_create'
+        if method == 'copy' and connection.vendor != 'postgresql':
+            raise ValueError('COPY is only available on PostgreSQL.')
+        self.method = method
+        self.chunk_size = chunk_size
+        self.dry_run = dry_run
+        self.rejects = csv.writer(rejects_file) if rejects_file is not None else None
+        if self.rejects is not None:
+            self.rejects.writerow(REJECT_COLUMNS)
+        self.counts = {'listings': {'imported': 0, 'rejected': 0}, 'reservations': {'imported': 0, 'rejected': 0}}
+        self.owner_ids = {}
+        self.file_listing_ids = set()
+        self.booked = defaultdict(BookedIntervals)
+        self.touched_listing_ids = set()
+
+    def reject(self, kind, line, error, row):
+        self.counts[kind]['rejected'] += 1
+        if isinstance(error, ValidationError):
+            error = ' '.join(str(message) for message in error.detail)
+        if self.rejects is not None:
+            self.rejects.writerow((kind, line, error, json.dumps(row, default=str)))
+
+    def import_listings(self, rows):
+        for chunk in chunked(rows, self.chunk_size):
+            self._import_listing_chunk(chunk)
+        if not self.dry_run and self.file_listing_ids:
+            # Explicit ids don't advance the Postgres sequence
+            with connection.cursor() as cursor:
+                for sql in connection.ops.sequence_reset_sql(no_style(), [Listing]):
+                    cursor.execute(sql)
+        return self.counts['listings']
+
+    def _import_listing_chunk(self, chunk):
+        candidates = []
+        for line, row, error in chunk:
+            if error:
+                self.reject('listings', line, error, row)
+                continue
+            try:
+                candidates.append((line, row, {
+                    'id': _optional_int(row, 'id'),
+                    'owner': _text(row, 'owner', 150),
+                    'name': _text(row, 'name', 100, required=False) or None,
+                    'address': _text(row, 'address', 255),
+                    'description': _text(row, 'description'),
+                }))
+            except ValidationError as e:
+                self.reject('listings', line, e, row)
+
+        usernames = {data['owner'] for _, _, data in candidates} - self.owner_ids.keys()
+        if usernames:
+            self.owner_ids.update(User.objects.filter(username__in=usernames).values_list('username', 'id'))
+        ids = [data['id'] for _, _, data in candidates if data['id'] is not None]
+        stored_ids = set(Listing.objects.filter(pk__in=ids).values_list('pk', flat=True)) if ids else set()
+
+        accepted = []
+        for line, row, data in candidates:
+            if data['owner'] not in self.owner_ids:
+                self.reject('listings', line, f"Unknown owner {data['owner']}.", row)
+            elif data['id'] is not None and (data['id'] in stored_ids or data['id'] in self.file_listing_ids):
+                self.reject('listings', line, f"Listing {data['id']} already exists.", row)
+            else:
+                if data['id'] is not None:
+                    self.file_listing_ids.add(data['id'])
+                accepted.append((line, row, Listing(id=data['id'], owner_id=self.owner_ids[data['owner']],
+                                                    name=data['name'], address=data['address'],
+                                                    description=data['description'])))
+
+        self._load('listings', Listing, accepted)
+
+    def import_reservations(self, rows):
+        for chunk in chunked(rows, self.chunk_size):
+            self._import_reservation_chunk(chunk)
+        return self.counts['reservations']
+
+    def _import_reservation_chunk(self, chunk):
+        candidates = []
+        for line, row, error in chunk:
+            if error:
+                self.reject('reservations', line, error, row)
+                continue
+            try:
+                listing_id = _optional_int(row, 'listing')
+                if listing_id is None:
+                    raise ValidationError('listing is required.')
+                name = _text(row, 'name', 100)
+                start_date, end_date = parse_input_dates(row.get('start_date'), row.get('end_date'), allow_past=True)
+            except (TypeError, ValueError):
+                self.reject('reservations', line, 'Dates must be in YYYY-MM-DD format.', row)
+                continue
+            except ValidationError as e:
+                self.reject('reservations', line, e, row)
+                continue
+            candidates.append((line, row, listing_id, name, start_date, end_date))
+        if not candidates:
+            return
+
+        listing_ids = {candidate[2] for candidate in candidates}
+        with transaction.atomic():
+            existing_listing_ids = set(Listing.objects.select_for_update().filter(pk__in=listing_ids)
+                                       .order_by('pk').values_list('pk', flat=True))
+            if self.dry_run:
+                existing_listing_ids |= listing_ids & self.file_listing_ids
+            stored = defaultdict(list)
+            min_start_date = min(candidate[4] for candidate in candidates)
+            max_end_date = max(candidate[5] for candidate in candidates)
+            for listing_id, start_date, end_date in (Reservation.objects.filter(listing_id__in=existing_listing_ids)
+                                                     .overlapping(min_start_date, max_end_date)
+                                                     .values_list('listing_id', 'start_date', 'end_date')):
+                stored[listing_id].append((start_date, end_date))
+
+            accepted = []
+            for line, row, listing_id, name, start_date, end_date in candidates:
+                booked = self.booked[listing_id]
+                conflicting_line = booked.conflict(start_date, end_date)
+                if listing_id not in existing_listing_ids:
+                    self.reject('reservations', line, f'Listing {listing_id} does not exist.', row)
+                elif conflicting_line is not None:
+                    self.reject('reservations', line, f'Overlaps the reservation on line {conflicting_line}.', row)
+                elif any(stored_start <= end_date and stored_end >= start_date
+                         for stored_start, stored_end in stored[listing_id]):
+                    self.reject('reservations', line, 'Overlaps a stored reservation.', row)
+                else:
+                    booked.add(start_date, end_date, line)
+                    accepted.append((line, row, Reservation(listing_id=listing_id, name=name,
+                                                            start_date=start_date, end_date=end_date)))
+
+            self._load('reservations', Reservation, accepted)
+        self.touched_listing_ids.update(reservation.listing_id for _, _, reservation in accepted)
+
+    def _load(self, kind, model, accepted):
+        if not accepted:
+            return
+        if self.dry_run:
+            self.counts[kind]['imported'] += len(accepted)
+            return
+        objs = [obj for _, _, obj in accepted]
+        try:
+            with transaction.atomic():
+                if self.method == 'copy':
+                    self._copy(model, objs)
+                else:
+                    model.objects.bulk_create(objs)
+                self._update_rollups(model, objs)
+            self.counts[kind]['imported'] += len(objs)
+        except IntegrityError:
+            # Something was written concurrently, fall back to one savepoint per row
+            logger.info('Bulk import: %s chunk rejected by a constraint, loading row by row.', kind)
+            for line, row, obj in accepted:
+                try:
+                    with transaction.atomic():
+                        model.objects.bulk_create([obj])
+                        self._update_rollups(model, [obj])
+                    self.counts[kind]['imported'] += 1
+                except IntegrityError as e:
+                    self.reject(kind, line, str(e).strip(), row)
+
+    @staticmethod
+    def _update_rollups(model, objs):
+        if model is Reservation:
+            add_reservations([(obj.listing_id, obj.start_date, obj.end_date) for obj in objs])
+
+    def _copy(self, model, objs):
+        with_pk = [obj for obj in objs if obj.pk is not None]
+        without_pk = [obj for obj in objs if obj.pk is None]
+        for group, fields in ((with_pk, model._meta.concrete_fields),
+                              (without_pk, [field for field in model._meta.concrete_fields if not field.primary_key])):
+            if group:
+                self._copy_rows(model, fields, group)
+
+    def _copy_rows(self, model, fields, objs):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for obj in objs:
+            writer.writerow([field.get_db_prep_value(getattr(obj, field.attname), connection) for field in fields])
+        buffer.seek(0)
+
+        quote_name = connection.ops.quote_name
+        columns = ', '.join(quote_name(field.column) for field in fields)
+        with connection.cursor() as cursor:
+            cursor.copy_expert(f'COPY {quote_name(model._meta.db_table)} ({columns}) FROM STDIN WITH (FORMAT csv)',
+                               buffer)
+
+    def finish(self):
+        """
+        bulk_create and COPY send no signals, refresh the availability index and caches once at the end
+        """
+        if self.dry_run:
+            return
+        availability_index.reset()
+        availability_result_cache.invalidate_all()
+        for listing_id in self.touched_listing_ids:
+            listing_cache.invalidate(listing_id)
+        listing_calendar_cache.invalidate(self.touched_listing_ids)
+        logger.info('Bulk import finished: %s', self.counts)
@@ -0,0 +1,210 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from rest_framework import status
+from rest_framework.exceptions import APIException, NotFound, ValidationError
+
+from .utils import ListingNotAvailable, bulk_save_reservations, listing_locks, save_reservation_with_listing_lock
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_GROUP_COMMIT = {
+    'ENABLED': False,
+    'WRITERS': 4,
+    'MAX_BATCH': 100,
+    'MAX_WAIT_MS': 5,
+    'TIMEOUT': 10,
+}
+
+_STOP = object()
+
+
+def group_commit_settings():
+    return {**DEFAULT_GROUP_COMMIT, **getattr(settings, 'GROUP_COMMIT', {})}
+
+
+class BookingTimeout(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'The booking queue is full, please retry later.'
+    default_code = 'booking_timeout'
+
+
+class GroupCommitWriter:
+    """
+    Writer threads that commit queued bookings in batches, one transaction per batch
+    Bookings are partitioned by listing id, so bookings of one listing are committed in
+    arrival order by a single writer. A batch goes through bulk_save_reservations, whose
+    set-based conflict check gives the same outcome as booking them one by one in that order.
+    A booking whose request gave up waiting is left out of the batch, until only the commit is left.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queues = []
+        self._threads = []
+        self._futures_lock = threading.Lock()
+        self._abandoned = set()
+        self._sealed = set()
+
+    def start(self):
+        options = group_commit_settings()
+        with self._lock:
+            if self._threads:
+                return
+            self._queues = [queue.Queue() for _ in range(options['WRITERS'])]
+            for index, partition in enumerate(self._queues):
+                thread = threading.Thread(target=self._run, args=(partition, options),
+                                          name=f'reservation-writer-{index}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self):
+        with self._lock:
+            queues, threads = self._queues, self._threads
+            self._queues, self._threads = [], []
+        for partition in queues:
+            partition.put(_STOP)
+        for thread in threads:
+            thread.join()
+
+    def submit(self, payload):
+        """
+        Queue a bulk_save_reservations payload, the Future resolves to its result dict
+        """
+        future = Future()
+        while True:
+            self.start()
+            # Queued under the lock, so a concurrent stop() still commits it before its writer exits
+            with self._lock:
+                if self._queues:
+                    self._queues[payload['listing'] % len(self._queues)].put((payload, future))
+                    return future
+
+    def abandon(self, future):
+        """
+        Drop a booking whose batch is being saved, False when only its commit is left and it will be saved
+        """
+        with self._futures_lock:
+            if future.done() or future in self._sealed:
+                return False
+            self._abandoned.add(future)
+            return True
+
+    def _seal(self, futures):
+        # Returns the abandoned futures, when there are none the batch can no longer be abandoned
+        with self._futures_lock:
+            abandoned = {future for future in futures if future in self._abandoned}
+            if not abandoned:
+                self._sealed.update(futures)
+            return abandoned
+
+    def _run(self, partition, options):
+        max_wait = options['MAX_WAIT_MS'] / 1000
+        stopping = False
+        while not stopping:
+            item = partition.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            deadline = time.monotonic() + max_wait
+            # Whatever arrives within MAX_WAIT_MS joins the batch, a full batch is committed right away
+            while len(batch) < options['MAX_BATCH']:
+                try:
+                    item = partition.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._commit(batch)
+        close_old_connections()
+
+    def _save(self, batch):
+        """
+        Save the bookings of batch that are still awaited in one transaction, returns (item, result) pairs
+        """
+        # On SQLite the listing locks must outlive bulk_save_reservations' savepoint, until the commit
+        with listing_locks({payload['listing'] for payload, _ in batch}), transaction.atomic():
+            while batch:
+                with transaction.atomic():
+                    results = bulk_save_reservations([payload for payload, _ in batch])
+                    abandoned = self._seal([future for _, future in batch])
+                    if not abandoned:
+                        return list(zip(batch, results))
+                    # Back to the savepoint, along with the commit callbacks of the abandoned bookings
+                    transaction.set_rollback(True)
+                batch = [(payload, future) for payload, future in batch if future not in abandoned]
+        return []
+
+    def _commit(self, batch):
+        # Callers that gave up waiting cancelled their future, those bookings are dropped
+        batch = [(payload, future) for payload, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        close_old_connections()
+        try:
+            try:
+                saved = self._save(batch)
+            except Exception:
+                logger.exception('Group commit of %s bookings failed, committing them one by one', len(batch))
+                saved = []
+                for item in batch:
+                    try:
+                        saved += self._save([item])
+                    except Exception as e:
+                        item[1].set_exception(e)
+            for (_, future), result in saved:
+                future.set_result(result)
+            for _, future in batch:
+                if not future.done():
+                    # Abandoned, its request already answered 503
+                    future.set_exception(BookingTimeout())
+            logger.debug('Group commit of %s bookings', len(saved))
+        finally:
+            with self._futures_lock:
+                for _, future in batch:
+                    self._abandoned.discard(future)
+                    self._sealed.discard(future)
+
+
+group_commit_writer = GroupCommitWriter()
+
+
+def book_reservation(serializer):
+    """
+    Save a validated ReservationSerializer and return its response data
+    With GROUP_COMMIT['ENABLED'] the booking is committed by a writer thread together with
+    other bookings, the outcome and response are the same as the direct path.
+    Raises ListingNotAvailable when it overlaps an existing reservation.
+    """
+    options = group_commit_settings()
+    if not options['ENABLED']:
+        save_reservation_with_listing_lock(serializer)
+        return serializer.data
+
+    data = serializer.validated_data
+    future = group_commit_writer.submit({'listing': data['listing'].pk, 'name': data['name'],
+                                         'start_date': data['start_date'], 'end_date': data['end_date']})
+    try:
+        result = future.result(timeout=options['TIMEOUT'])
+    except FutureTimeoutError:
+        # Still queued or still being saved, the writer leaves it out and nothing is booked
+        if future.cancel() or group_commit_writer.abandon(future):
+            logger.warning('Gave up waiting for the group commit of a booking on listing %s', data['listing'].pk)
+            raise BookingTimeout()
+        # Only the commit of its batch is left, the answer has to match what gets committed
+        result = future.result()
+
+    if result['status'] == status.HTTP_201_CREATED:
+        return result['reservation']
+    if result['status'] == status.HTTP_404_NOT_FOUND:
+        if 'error' in result['errors']:
+            raise ListingNotAvailable()
+        raise NotFound()
+    raise ValidationError(result['errors'])
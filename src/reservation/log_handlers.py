@@ -0,0 +1,94 @@
+import atexit
+import json
+import logging
+import queue
+import random
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+SQL_LOGGER = 'django.db.backends'
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    One JSON object per line, SQL records also carry their duration and statement
+    """
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'file': record.filename,
+            'function': record.funcName,
+            'message': record.getMessage(),
+        }
+        duration = getattr(record, 'duration', None)
+        if duration is not None:
+            entry['duration'] = duration
+            entry['sql'] = getattr(record, 'sql', None)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps a sample_rate fraction of SQL and DEBUG records
+    Queries slower than slow_query_seconds and records at INFO or above always pass.
+    """
+
+    def __init__(self, sample_rate=1.0, slow_query_seconds=None):
+        super().__init__()
+        self.sample_rate = float(sample_rate)
+        self.slow_query_seconds = None if slow_query_seconds is None else float(slow_query_seconds)
+
+    def filter(self, record):
+        duration = getattr(record, 'duration', None)
+        if duration is not None and self.slow_query_seconds is not None and duration >= self.slow_query_seconds:
+            return True
+        if record.levelno >= logging.INFO and not record.name.startswith(SQL_LOGGER):
+            return True
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+
+class QueueFileHandler(QueueHandler):
+    """
+    Hands records to a background QueueListener that formats and writes them to `filename`
+    The request thread only filters and enqueues; when the queue is full records are
+    dropped and counted instead of blocking the request.
+    """
+
+    def __init__(self, filename, queue_size=10000):
+        super().__init__(queue.Queue(maxsize=queue_size))
+        self.dropped = 0
+        self.target = logging.FileHandler(filename, delay=True)
+        self.listener = QueueListener(self.queue, self.target, respect_handler_level=False)
+        self.listener.start()
+        atexit.register(self.stop_listener)
+
+    def stop_listener(self):
+        # Flushes the queue, safe to call more than once
+        if self.listener._thread is not None:
+            self.listener.stop()
+
+    def setFormatter(self, fmt):
+        # Formatting happens on the listener thread
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        # Resolve the message now, the arguments may change before the listener formats it
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        self.stop_listener()
+        self.target.close()
+        super().close()
@@ -0,0 +1,27 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from reservation.archive import archive_reservations
+
+
+class Command(BaseCommand):
+    help = 'Move reservations that ended before the cutoff to the archive table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--before', help='Archive reservations ending before this YYYY-MM-DD date, '
+                                             'RESERVATION_ARCHIVE KEEP_DAYS ago by default')
+        parser.add_argument('--batch-size', type=int, help='Reservations moved per transaction')
+
+    def handle(self, *args, **options):
+        before = None
+        if options['before']:
+            try:
+                before = datetime.strptime(options['before'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError('--before must be in YYYY-MM-DD format.')
+        try:
+            archived = archive_reservations(before, options['batch_size'], stdout=self.stdout)
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(f'{archived} reservations archived'))
@@ -0,0 +1,200 @@
+import json
+import time
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from reservation.availability import availability_index
+from reservation.caching import listing_cache
+from reservation.models import Listing
+from reservation.synthetic import generate_dataset
+
+BULK_ITEMS = 20
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def find_regressions(results, baseline, threshold, min_delta_ms=1.0):
+    """
+    Compare two benchmark outputs, a p95 slower than the baseline by more than threshold
+    (and min_delta_ms) or any extra query per request is a regression
+    """
+    regressions = []
+    for size, endpoints in results['sizes'].items():
+        for endpoint, current in endpoints.items():
+            previous = baseline.get('sizes', {}).get(size, {}).get(endpoint)
+            if previous is None:
+                continue
+            limit = previous['p95_ms'] * (1 + threshold)
+            if current['p95_ms'] > limit and current['p95_ms'] - previous['p95_ms'] >= min_delta_ms:
+                regressions.append(f"{endpoint} at {size} listings: p95 {current['p95_ms']:.2f} ms, "
+                                   f"baseline {previous['p95_ms']:.2f} ms")
+            if current['queries'] > previous['queries']:
+                regressions.append(f"{endpoint} at {size} listings: {current['queries']} queries, "
+                                   f"baseline {previous['queries']}")
+    return regressions
+
+
+class Command(BaseCommand):
+    help = ('Load synthetic datasets of several sizes into a throwaway test database and measure p50/p95 '
+            'latency and query counts of every v1/v2 endpoint through the Django test client')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='100,1000', help='Comma separated listing counts')
+        parser.add_argument('--users-per-listing', type=float, default=0.1)
+        parser.add_argument('--reservations-per-listing', type=int, default=5)
+        parser.add_argument('--requests', type=int, default=20, help='Timed requests per endpoint and size')
+        parser.add_argument('--warmup', type=int, default=2, help='Untimed requests per endpoint and size')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Write the JSON results to this file instead of stdout')
+        parser.add_argument('--baseline', help='JSON results of an earlier run to compare against')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='Allowed p95 slowdown over the baseline, 0.2 is 20%%')
+        parser.add_argument('--min-delta-ms', type=float, default=1.0,
+                            help='Ignore p95 slowdowns smaller than this many milliseconds')
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(size) for size in options['sizes'].split(',')]
+        except ValueError:
+            raise CommandError('--sizes must be a comma separated list of integers.')
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as baseline_file:
+                baseline = json.load(baseline_file)
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        # One client sends every request, the rate limits would shed most of them
+        admission_control = {**getattr(settings, 'ADMISSION_CONTROL', {}), 'ENABLED': False}
+        try:
+            results = {'vendor': connection.vendor, 'requests': options['requests'], 'sizes': {}}
+            with override_settings(ADMISSION_CONTROL=admission_control):
+                for size in sizes:
+                    self.load_dataset(size, options)
+                    results['sizes'][str(size)] = self.run_endpoints(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        output = json.dumps(results, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as output_file:
+                output_file.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+        if baseline is not None:
+            regressions = find_regressions(results, baseline, options['threshold'], options['min_delta_ms'])
+            if regressions:
+                raise CommandError('Performance regressions:\n' + '\n'.join(regressions))
+            self.stdout.write(self.style.SUCCESS('No regressions against the baseline.'))
+
+    def load_dataset(self, size, options):
+        call_command('flush', interactive=False, verbosity=0)
+        cache.clear()
+        listing_cache.local.clear()
+        availability_index.reset()
+        generate_dataset(max(1, int(size * options['users_per_listing'])), size,
+                         size * options['reservations_per_listing'], seed=options['seed'])
+        self.stderr.write(f'Loaded dataset with {size} listings')
+
+    def endpoint_requests(self):
+        """
+        (result name, method, request builder, result cache) for every v1/v2 endpoint, the builder
+        gets the iteration number and returns the path and the JSON body
+        Availability is measured twice: with a new window per request and the result cache off,
+        and with one window served from the result cache.
+        """
+        listing_ids = list(Listing.objects.order_by('id').values_list('id', flat=True))
+        today = date.today()
+
+        def booking_day(iteration, offset=0):
+            # Far beyond the synthetic data and never reused, so every booking succeeds
+            return today + timedelta(days=3000 + iteration * BULK_ITEMS * 2 + offset * 2)
+
+        def listing_list(url_name):
+            return lambda iteration: (reverse(url_name), None)
+
+        def available_listings(url_name, vary=True):
+            def build(iteration):
+                start_date = today + timedelta(days=10 + (iteration % 300 if vary else 0))
+                return (f'{reverse(url_name)}?start_date={start_date}&end_date={start_date + timedelta(days=5)}',
+                        None)
+            return build
+
+        def add_reservation(url_name):
+            def build(iteration):
+                day = booking_day(iteration)
+                return reverse(url_name), {'listing': listing_ids[iteration % len(listing_ids)],
+                                           'name': 'Benchmark', 'start_date': str(day), 'end_date': str(day)}
+            return build
+
+        def bulk_add_reservation(url_name):
+            def build(iteration):
+                payloads = []
+                for offset in range(BULK_ITEMS):
+                    day = booking_day(iteration, offset) + timedelta(days=1)
+                    payloads.append({'listing': listing_ids[(iteration + offset) % len(listing_ids)],
+                                     'name': 'Benchmark', 'start_date': str(day), 'end_date': str(day)})
+                return reverse(url_name), payloads
+            return build
+
+        def listing_details(url_name):
+            return lambda iteration: (reverse(url_name, args=[listing_ids[iteration % len(listing_ids)]]), None)
+
+        requests = []
+        for prefix in ('', 'class-'):
+            available_listing_list = f'{prefix}available-listing-list'
+            requests += [
+                (f'{prefix}listing-list', 'get', listing_list(f'{prefix}listing-list'), True),
+                (available_listing_list, 'get', available_listings(available_listing_list), False),
+                (f'{available_listing_list}-cached', 'get', available_listings(available_listing_list, vary=False),
+                 True),
+                (f'{prefix}add-reservation', 'post', add_reservation(f'{prefix}add-reservation'), True),
+                (f'{prefix}bulk-add-reservation', 'post', bulk_add_reservation(f'{prefix}bulk-add-reservation'),
+                 True),
+                (f'{prefix}overview-reports', 'get', listing_list(f'{prefix}overview-reports'), True),
+                (f'{prefix}listing-details', 'get', listing_details(f'{prefix}listing-details'), True),
+            ]
+        return requests
+
+    def run_endpoints(self, options):
+        client = Client()
+        results = {}
+        iteration = 0
+        uncached = {**getattr(settings, 'AVAILABILITY_RESULT_CACHE', {}), 'ENABLED': False}
+        for url_name, method, build, result_cache in self.endpoint_requests():
+            timings, queries = [], []
+            for run in range(options['warmup'] + options['requests']):
+                iteration += 1
+                path, body = build(iteration)
+                with override_settings(**({} if result_cache else {'AVAILABILITY_RESULT_CACHE': uncached})), \
+                        CaptureQueriesContext(connection) as captured:
+                    started = time.perf_counter()
+                    if method == 'post':
+                        response = client.post(path, data=json.dumps(body), content_type='application/json')
+                    else:
+                        response = client.get(path)
+                    elapsed = time.perf_counter() - started
+                if response.status_code >= 400:
+                    raise CommandError(f'{method.upper()} {path} answered {response.status_code}.')
+                if run >= options['warmup']:
+                    timings.append(elapsed * 1000)
+                    queries.append(len(captured))
+            results[url_name] = {
+                'p50_ms': round(percentile(timings, 0.5), 3),
+                'p95_ms': round(percentile(timings, 0.95), 3),
+                'queries': max(queries),
+            }
+        return results
@@ -0,0 +1,131 @@
+import json
+import random
+import threading
+import time
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from reservation.availability import availability_index
+from reservation.caching import listing_cache
+from reservation.ingestion import group_commit_writer
+from reservation.management.commands.benchmark_endpoints import percentile
+from reservation.models import Listing
+from reservation.synthetic import generate_dataset
+
+
+class Command(BaseCommand):
+    help = ('Book the same synthetic requests through add_reservation from concurrent clients, once with '
+            'one transaction per booking and once with the group commit pipeline, and compare bookings per second. '
+            'Meant for PostgreSQL, SQLite serializes every writer')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--listings', type=int, default=200)
+        parser.add_argument('--bookings', type=int, default=2000)
+        parser.add_argument('--clients', type=int, default=16, help='Concurrent client threads')
+        parser.add_argument('--horizon-days', type=int, default=365,
+                            help='Bookings start within this many days, fewer days means more conflicts')
+        parser.add_argument('--writers', type=int, default=4, help='Group commit writer threads')
+        parser.add_argument('--max-batch', type=int, default=100)
+        parser.add_argument('--max-wait-ms', type=float, default=5)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Write the JSON results to this file instead of stdout')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        # The clients share one address, the rate limits would shed most bookings
+        admission_control = {**getattr(settings, 'ADMISSION_CONTROL', {}), 'ENABLED': False}
+        try:
+            results = {'vendor': connection.vendor, 'bookings': options['bookings'], 'clients': options['clients'],
+                       'modes': {}}
+            with override_settings(ADMISSION_CONTROL=admission_control):
+                for mode, enabled in (('direct', False), ('group_commit', True)):
+                    payloads = self.load_dataset(options)
+                    group_commit = {'ENABLED': enabled, 'WRITERS': options['writers'],
+                                    'MAX_BATCH': options['max_batch'], 'MAX_WAIT_MS': options['max_wait_ms'],
+                                    'TIMEOUT': 60}
+                    with override_settings(GROUP_COMMIT=group_commit):
+                        results['modes'][mode] = self.run_bookings(payloads, options['clients'])
+                    group_commit_writer.stop()
+                    self.stderr.write(f"{mode}: {results['modes'][mode]['bookings_per_second']} bookings/s")
+            results['speedup'] = round(results['modes']['group_commit']['bookings_per_second'] /
+                                       results['modes']['direct']['bookings_per_second'], 2)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        output = json.dumps(results, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as output_file:
+                output_file.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+    def load_dataset(self, options):
+        """
+        Fresh listings without reservations and the booking payloads, the same for every mode
+        """
+        call_command('flush', interactive=False, verbosity=0)
+        cache.clear()
+        listing_cache.local.clear()
+        availability_index.reset()
+        generate_dataset(max(1, options['listings'] // 10), options['listings'], 0, seed=options['seed'])
+
+        rng = random.Random(options['seed'])
+        listing_ids = list(Listing.objects.order_by('id').values_list('id', flat=True))
+        first_day = date.today() + timedelta(days=1)
+        payloads = []
+        for _ in range(options['bookings']):
+            start_date = first_day + timedelta(days=rng.randrange(options['horizon_days']))
+            payloads.append({'listing': rng.choice(listing_ids), 'name': 'Benchmark', 'start_date': str(start_date),
+                             'end_date': str(start_date + timedelta(days=rng.randint(0, 3)))})
+        return payloads
+
+    def run_bookings(self, payloads, clients):
+        url = reverse('add-reservation')
+        latencies, statuses = [], {}
+        lock = threading.Lock()
+
+        def client_thread(share):
+            client = Client()
+            try:
+                for payload in share:
+                    started = time.perf_counter()
+                    try:
+                        outcome = str(client.post(url, data=json.dumps(payload),
+                                                  content_type='application/json').status_code)
+                    except Exception as e:
+                        # SQLite's shared in-memory test database rejects concurrent writers
+                        outcome = type(e).__name__
+                    elapsed = time.perf_counter() - started
+                    with lock:
+                        latencies.append(elapsed * 1000)
+                        statuses[outcome] = statuses.get(outcome, 0) + 1
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=client_thread, args=(payloads[index::clients],))
+                   for index in range(clients)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        answered = sum(count for outcome, count in statuses.items() if outcome.isdigit())
+        return {
+            'seconds': round(elapsed, 3),
+            'bookings_per_second': round(answered / elapsed, 1),
+            'p50_ms': round(percentile(latencies, 0.5), 3),
+            'p95_ms': round(percentile(latencies, 0.95), 3),
+            'statuses': dict(sorted(statuses.items())),
+        }
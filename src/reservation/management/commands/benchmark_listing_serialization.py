@@ -0,0 +1,46 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+
+from reservation.models import Listing
+from reservation.renderers import FastJSONRenderer
+from reservation.serializers import ListingSerializer
+from reservation.utils import LISTING_FAST_FIELDS, listing_fast_representation
+
+
+class Command(BaseCommand):
+    help = 'Compare ListingSerializer + JSONRenderer with the values() fast path on the stored listings'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=1000, help='Number of listings per run')
+        parser.add_argument('--repeat', type=int, default=20, help='Number of timed runs per path')
+
+    def handle(self, *args, **options):
+        limit, repeat = options['limit'], options['repeat']
+        if not Listing.objects.exists():
+            raise CommandError('No listings to serialize, load some data first.')
+
+        def serializer_path():
+            listings = Listing.objects.select_related('owner').order_by('id')[:limit]
+            return JSONRenderer().render(ListingSerializer(listings, many=True).data)
+
+        def fast_path():
+            rows = Listing.objects.order_by('id').values(*LISTING_FAST_FIELDS)[:limit]
+            return FastJSONRenderer().render(listing_fast_representation(rows))
+
+        if serializer_path() != fast_path():
+            raise CommandError('Fast path output differs from ListingSerializer output.')
+
+        results = {}
+        for name, path in (('serializer', serializer_path), ('fast', fast_path)):
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                path()
+                timings.append(time.perf_counter() - started)
+            timings.sort()
+            results[name] = timings[len(timings) // 2] * 1000
+            self.stdout.write(f'{name:>10}: median {results[name]:.2f} ms for {limit} listings')
+
+        self.stdout.write(self.style.SUCCESS(f"Speedup: {results['serializer'] / results['fast']:.1f}x"))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.exceptions import ValidationError
+
+from reservation.exports import EXPORT_FORMATS, EXPORT_WRITERS, parse_export_filters, reservation_export_rows
+
+
+class Command(BaseCommand):
+    help = 'Stream reservations with their listing and owner as CSV or NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=EXPORT_FORMATS, default='csv')
+        parser.add_argument('--listing', help='Only reservations of this listing id')
+        parser.add_argument('--start-date', help='Only reservations overlapping start-date..end-date')
+        parser.add_argument('--end-date')
+        parser.add_argument('--history', action='store_true', help='Include archived reservations')
+        parser.add_argument('--output', help='File to write, stdout by default')
+
+    def handle(self, *args, **options):
+        try:
+            filters = parse_export_filters(options['listing'], options['start_date'], options['end_date'])
+        except ValidationError as e:
+            raise CommandError(' '.join(str(message) for message in e.detail))
+
+        write = EXPORT_WRITERS[options['format']][0]
+        chunks = write(reservation_export_rows(filters, options['history']))
+        if options['output']:
+            with open(options['output'], 'w', newline='', encoding='utf-8') as output_file:
+                output_file.writelines(chunks)
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from reservation.synthetic import generate_dataset
+
+
+class Command(BaseCommand):
+    help = 'Generate synthetic users, listings and reservations with bulk_create'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--listings', type=int, default=1000)
+        parser.add_argument('--reservations', type=int, default=10000)
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--history-days', type=int, default=365,
+                            help='How far in the past the first reservations start')
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        counts = generate_dataset(options['users'], options['listings'], options['reservations'],
+                                  chunk_size=options['chunk_size'], seed=options['seed'],
+                                  history_days=options['history_days'], stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(f'Generated {counts}'))
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from reservation.imports import (IMPORT_CHUNK_SIZE, IMPORT_FORMATS, IMPORT_METHODS, BulkImporter, detect_format,
+                                 read_rows)
+
+
+class Command(BaseCommand):
+    help = ('Bulk import listings and reservations from CSV or NDJSON files, '
+            'rows that fail validation are written to a reject file')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--listings', help='Listings file with owner (username), name, address, description '
+                                               'and an optional id that reservations can refer to')
+        parser.add_argument('--reservations', help='Reservations file with listing, name, start_date, end_date')
+        parser.add_argument('--format', choices=IMPORT_FORMATS,
+                            help='Input format, guessed from the file extension by default')
+        parser.add_argument('--rejects', default='import_rejects.csv', help='Where rejected rows are written')
+        parser.add_argument('--chunk-size', type=int, default=IMPORT_CHUNK_SIZE)
+        parser.add_argument('--method', choices=IMPORT_METHODS, default='auto',
+                            help='auto uses COPY on PostgreSQL and bulk_create elsewhere')
+        parser.add_argument('--dry-run', action='store_true', help='Validate only, nothing is written')
+
+    def handle(self, *args, **options):
+        if not options['listings'] and not options['reservations']:
+            raise CommandError('Pass --listings and/or --reservations.')
+
+        with open(options['rejects'], 'w', newline='', encoding='utf-8') as rejects_file:
+            try:
+                importer = BulkImporter(rejects_file, chunk_size=options['chunk_size'], method=options['method'],
+                                        dry_run=options['dry_run'])
+            except ValueError as e:
+                raise CommandError(str(e))
+
+            for kind, path in (('listings', options['listings']), ('reservations', options['reservations'])):
+                if not path:
+                    continue
+                rows = read_rows(path, options['format'] or detect_format(path))
+                if kind == 'listings':
+                    counts = importer.import_listings(rows)
+                else:
+                    counts = importer.import_reservations(rows)
+                self.stdout.write(f"{kind}: {counts['imported']} imported, {counts['rejected']} rejected")
+            importer.finish()
+
+        if importer.counts['listings']['rejected'] or importer.counts['reservations']['rejected']:
+            self.stdout.write(self.style.WARNING(f"Rejected rows written to {options['rejects']}"))
+        else:
+            self.stdout.write(self.style.SUCCESS('All rows imported.'))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from reservation.occupancy import rebuild_occupancy
+
+
+class Command(BaseCommand):
+    help = 'Recompute the monthly occupancy rollup from the stored reservations'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--listing', type=int, action='append', dest='listing_ids',
+                            help='Only rebuild this listing, can be repeated')
+
+    def handle(self, *args, **options):
+        rows = rebuild_occupancy(options['listing_ids'], stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(f'{rows} occupancy rows written'))
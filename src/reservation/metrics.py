@@ -0,0 +1,204 @@
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.http import HttpResponse
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Per-request counters, contextvars follow the request into sync_to_async threads
+_current_request = ContextVar('reservation_request_metrics', default=None)
+
+
+class RequestMetrics:
+    __slots__ = ('queries', 'query_seconds', 'cache_hits', 'cache_misses')
+
+    def __init__(self):
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+
+class EndpointMetrics:
+    __slots__ = ('buckets', 'requests', 'seconds', 'queries', 'query_seconds', 'cache_hits', 'cache_misses')
+
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.requests = 0
+        self.seconds = 0.0
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+
+class MetricsRegistry:
+    """
+    In-process aggregates per resolved URL name, rendered in Prometheus text format
+    Each worker process exposes its own numbers, Prometheus sums them across targets.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+        self._shed = {}
+
+    def reset(self):
+        with self._lock:
+            self._endpoints = {}
+            self._shed = {}
+
+    def observe(self, view, seconds, request_metrics):
+        bucket = bisect_left(LATENCY_BUCKETS, seconds)
+        with self._lock:
+            endpoint = self._endpoints.get(view)
+            if endpoint is None:
+                endpoint = self._endpoints[view] = EndpointMetrics()
+            endpoint.buckets[bucket] += 1
+            endpoint.requests += 1
+            endpoint.seconds += seconds
+            endpoint.queries += request_metrics.queries
+            endpoint.query_seconds += request_metrics.query_seconds
+            endpoint.cache_hits += request_metrics.cache_hits
+            endpoint.cache_misses += request_metrics.cache_misses
+
+    def observe_shed(self, view, reason):
+        with self._lock:
+            self._shed[(view, reason)] = self._shed.get((view, reason), 0) + 1
+
+    def shed_snapshot(self):
+        with self._lock:
+            return dict(self._shed)
+
+    def snapshot(self):
+        with self._lock:
+            return {view: {slot: (list(getattr(endpoint, slot)) if slot == 'buckets' else getattr(endpoint, slot))
+                           for slot in EndpointMetrics.__slots__}
+                    for view, endpoint in self._endpoints.items()}
+
+    def render(self):
+        snapshot = self.snapshot()
+        lines = [
+            '# HELP reservation_http_request_duration_seconds Request latency per URL name.',
+            '# TYPE reservation_http_request_duration_seconds histogram',
+        ]
+        for view, endpoint in sorted(snapshot.items()):
+            label = f'view="{escape_label(view)}"'
+            cumulative = 0
+            for upper_bound, count in zip(LATENCY_BUCKETS + ('+Inf',), endpoint['buckets']):
+                cumulative += count
+                lines.append(f'reservation_http_request_duration_seconds_bucket{{{label},le="{upper_bound}"}} '
+                             f'{cumulative}')
+            lines.append(f'reservation_http_request_duration_seconds_sum{{{label}}} {endpoint["seconds"]}')
+            lines.append(f'reservation_http_request_duration_seconds_count{{{label}}} {endpoint["requests"]}')
+
+        for name, slot, help_text in (
+                ('reservation_db_queries_total', 'queries', 'SQL queries executed per URL name.'),
+                ('reservation_db_query_duration_seconds_total', 'query_seconds', 'Time spent in SQL per URL name.'),
+                ('reservation_cache_hits_total', 'cache_hits', 'Cache hits per URL name.'),
+                ('reservation_cache_misses_total', 'cache_misses', 'Cache misses per URL name.')):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} counter')
+            for view, endpoint in sorted(snapshot.items()):
+                lines.append(f'{name}{{view="{escape_label(view)}"}} {endpoint[slot]}')
+
+        lines.append('# HELP reservation_requests_shed_total Requests rejected with 429 per URL name and limit.')
+        lines.append('# TYPE reservation_requests_shed_total counter')
+        for (view, reason), count in sorted(self.shed_snapshot().items()):
+            lines.append(f'reservation_requests_shed_total{{view="{escape_label(view)}",reason="{reason}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+def escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = MetricsRegistry()
+
+
+def record_cache_event(hit):
+    request_metrics = _current_request.get()
+    if request_metrics is None:
+        return
+    if hit:
+        request_metrics.cache_hits += 1
+    else:
+        request_metrics.cache_misses += 1
+
+
+def _query_metrics_wrapper(execute, sql, params, many, context):
+    request_metrics = _current_request.get()
+    if request_metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        request_metrics.queries += 1
+        request_metrics.query_seconds += time.perf_counter() - started
+
+
+@receiver(connection_created)
+def install_query_metrics_wrapper(sender, connection, **kwargs):
+    # Installed once per connection, so queries run from sync_to_async threads are counted too
+    if _query_metrics_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_query_metrics_wrapper)
+
+
+def install_query_metrics_wrappers():
+    # Connections opened before the middleware was loaded never sent connection_created
+    for connection in connections.all(initialized_only=True):
+        install_query_metrics_wrapper(sender=None, connection=connection)
+
+
+def view_name(request):
+    resolver_match = getattr(request, 'resolver_match', None)
+    if resolver_match is None:
+        return 'unresolved'
+    return resolver_match.view_name or 'unnamed'
+
+
+class MetricsMiddleware:
+    """
+    Records latency, SQL and cache counters per resolved URL name
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        install_query_metrics_wrappers()
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        request_metrics = RequestMetrics()
+        token = _current_request.set(request_metrics)
+        started = time.perf_counter()
+        try:
+            return self.get_response(request)
+        finally:
+            registry.observe(view_name(request), time.perf_counter() - started, request_metrics)
+            _current_request.reset(token)
+
+    async def __acall__(self, request):
+        request_metrics = RequestMetrics()
+        token = _current_request.set(request_metrics)
+        started = time.perf_counter()
+        try:
+            return await self.get_response(request)
+        finally:
+            registry.observe(view_name(request), time.perf_counter() - started, request_metrics)
+            _current_request.reset(token)
+
+
+def metrics_view(request):
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
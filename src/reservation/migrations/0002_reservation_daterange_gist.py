@@ -0,0 +1,34 @@
+from django.db import migrations
+
+
+CREATE_DATERANGE_INDEX = """
+CREATE EXTENSION IF NOT EXISTS btree_gist;
+CREATE INDEX IF NOT EXISTS reservation_listing_daterange_gist
+    ON reservation_reservation USING gist (listing_id, daterange(start_date, end_date, '[]'));
+"""
+
+DROP_DATERANGE_INDEX = """
+DROP INDEX IF EXISTS reservation_listing_daterange_gist;
+"""
+
+
+def create_daterange_index(apps, schema_editor):
+    # The daterange GiST index only exists on Postgres, SQLite keeps the btree indexes from 0001
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(CREATE_DATERANGE_INDEX)
+
+
+def drop_daterange_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(DROP_DATERANGE_INDEX)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservation', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_daterange_index, drop_daterange_index),
+    ]
@@ -0,0 +1,66 @@
+from django.db import migrations
+
+
+# The constraint's own GiST index covers the (listing_id, daterange) lookups, so the index from 0002 is dropped
+ADD_NO_OVERLAP_CONSTRAINT = """
+ALTER TABLE reservation_reservation
+    ADD CONSTRAINT reservation_no_overlap
+    EXCLUDE USING gist (listing_id WITH =, daterange(start_date, end_date, '[]') WITH &&);
+DROP INDEX IF EXISTS reservation_listing_daterange_gist;
+"""
+
+# Bookings made before the listing lock could race into overlaps, the constraint can't be added over them
+OVERLAPPING_RESERVATIONS = """
+SELECT a.listing_id, a.id, b.id
+FROM reservation_reservation a
+JOIN reservation_reservation b
+    ON b.listing_id = a.listing_id AND b.id > a.id
+    AND daterange(b.start_date, b.end_date, '[]') && daterange(a.start_date, a.end_date, '[]')
+ORDER BY a.listing_id, a.id, b.id
+LIMIT %s
+"""
+
+MAX_REPORTED_OVERLAPS = 50
+
+DROP_NO_OVERLAP_CONSTRAINT = """
+CREATE INDEX IF NOT EXISTS reservation_listing_daterange_gist
+    ON reservation_reservation USING gist (listing_id, daterange(start_date, end_date, '[]'));
+ALTER TABLE reservation_reservation DROP CONSTRAINT IF EXISTS reservation_no_overlap;
+"""
+
+
+def check_no_overlaps(schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(OVERLAPPING_RESERVATIONS, [MAX_REPORTED_OVERLAPS + 1])
+        overlaps = cursor.fetchall()
+    if not overlaps:
+        return
+    pairs = '\n'.join(f'  listing {listing_id}: reservations {first} and {second}'
+                      for listing_id, first, second in overlaps[:MAX_REPORTED_OVERLAPS])
+    more = '\n  ...' if len(overlaps) > MAX_REPORTED_OVERLAPS else ''
+    raise RuntimeError(
+        'reservation_reservation already holds overlapping reservations, delete or move one of each pair '
+        f'and run migrate again:\n{pairs}{more}'
+    )
+
+
+def add_no_overlap_constraint(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        check_no_overlaps(schema_editor)
+        schema_editor.execute(ADD_NO_OVERLAP_CONSTRAINT)
+
+
+def drop_no_overlap_constraint(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(DROP_NO_OVERLAP_CONSTRAINT)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservation', '0002_reservation_daterange_gist'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_no_overlap_constraint, drop_no_overlap_constraint),
+    ]
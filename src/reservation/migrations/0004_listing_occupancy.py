@@ -0,0 +1,31 @@
+# Generated by Django 4.2.7 on 2026-10-18 08:58
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservation', '0003_reservation_no_overlap_constraint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ListingOccupancy',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(help_text='First day of the month')),
+                ('booked_nights', models.PositiveIntegerField(default=0)),
+                ('reservation_count', models.PositiveIntegerField(default=0)),
+                ('listing', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='occupancy', to='reservation.listing')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['month', 'listing'], name='listing_occupancy_month_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='listingoccupancy',
+            constraint=models.UniqueConstraint(fields=('listing', 'month'), name='listing_occupancy_listing_month_uniq'),
+        ),
+    ]
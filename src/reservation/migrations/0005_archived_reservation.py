@@ -0,0 +1,28 @@
+# Generated by Django 4.2.7 on 2026-10-18 09:08
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservation', '0004_listing_occupancy'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedReservation',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=100)),
+                ('start_date', models.DateField()),
+                ('end_date', models.DateField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('listing', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_reservations', to='reservation.listing')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['listing', 'start_date', 'end_date'], name='archived_listing_dates_idx'), models.Index(fields=['end_date'], name='archived_end_date_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,79 @@
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+
+
+# Must compile to the same expression as reservation.search.listing_search_vector,
+# otherwise Postgres won't use the index for the search query
+SEARCH_FIELDS = ('name', 'address', 'description')
+SEARCH_CONFIG = 'english'
+SEARCH_INDEX_NAME = 'listing_search_gin'
+
+CREATE_FTS_TABLE = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS reservation_listing_fts USING fts5(
+        name, address, description, content='reservation_listing', content_rowid='id',
+        tokenize='porter unicode61'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS reservation_listing_fts_insert AFTER INSERT ON reservation_listing BEGIN
+        INSERT INTO reservation_listing_fts(rowid, name, address, description)
+        VALUES (new.id, new.name, new.address, new.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS reservation_listing_fts_delete AFTER DELETE ON reservation_listing BEGIN
+        INSERT INTO reservation_listing_fts(reservation_listing_fts, rowid, name, address, description)
+        VALUES ('delete', old.id, old.name, old.address, old.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS reservation_listing_fts_update AFTER UPDATE ON reservation_listing BEGIN
+        INSERT INTO reservation_listing_fts(reservation_listing_fts, rowid, name, address, description)
+        VALUES ('delete', old.id, old.name, old.address, old.description);
+        INSERT INTO reservation_listing_fts(rowid, name, address, description)
+        VALUES (new.id, new.name, new.address, new.description);
+    END
+    """,
+    "INSERT INTO reservation_listing_fts(reservation_listing_fts) VALUES ('rebuild')",
+]
+
+DROP_FTS_TABLE = [
+    'DROP TRIGGER IF EXISTS reservation_listing_fts_insert',
+    'DROP TRIGGER IF EXISTS reservation_listing_fts_delete',
+    'DROP TRIGGER IF EXISTS reservation_listing_fts_update',
+    'DROP TABLE IF EXISTS reservation_listing_fts',
+]
+
+
+def search_index():
+    return GinIndex(SearchVector(*SEARCH_FIELDS, config=SEARCH_CONFIG), name=SEARCH_INDEX_NAME)
+
+
+def create_search_index(apps, schema_editor):
+    # GIN expression index on Postgres, an FTS5 table kept in sync by triggers on SQLite
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.add_index(apps.get_model('reservation', 'Listing'), search_index())
+    elif schema_editor.connection.vendor == 'sqlite':
+        for statement in CREATE_FTS_TABLE:
+            schema_editor.execute(statement)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.remove_index(apps.get_model('reservation', 'Listing'), search_index())
+    elif schema_editor.connection.vendor == 'sqlite':
+        for statement in DROP_FTS_TABLE:
+            schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservation', '0005_archived_reservation'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
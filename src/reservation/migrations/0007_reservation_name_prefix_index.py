@@ -0,0 +1,33 @@
+from django.db import migrations
+
+
+# Serves the admin's case-insensitive prefix search on the guest name, which Django
+# compiles to UPPER("name"::text) LIKE UPPER('term%'). text_pattern_ops makes LIKE usable
+# whatever the database collation is.
+CREATE_NAME_PREFIX_INDEX = """
+CREATE INDEX IF NOT EXISTS reservation_name_upper_idx
+    ON reservation_reservation (UPPER(name::text) text_pattern_ops);
+"""
+
+DROP_NAME_PREFIX_INDEX = 'DROP INDEX IF EXISTS reservation_name_upper_idx;'
+
+
+def create_name_prefix_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(CREATE_NAME_PREFIX_INDEX)
+
+
+def drop_name_prefix_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(DROP_NAME_PREFIX_INDEX)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservation', '0006_listing_search'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_name_prefix_index, drop_name_prefix_index),
+    ]
@@ -1,4 +1,5 @@
-from django.db import models
+from django.db import connections, models
+from django.db.models import Func, Value
 from django.contrib.auth.models import User
 from rest_framework.exceptions import ValidationError
 
@@ -13,12 +14,49 @@ class Listing(models.Model):
         return self.name
 
 
+class DateRangeOverlaps(Func):
+    """
+    Postgres `daterange(a, b, '[]') && daterange(c, d, '[]')` predicate
+    """
+    arity = 4
+    output_field = models.BooleanField()
+
+    def as_sql(self, compiler, connection, **extra_context):
+        sql_parts, params = [], []
+        for expression in self.get_source_expressions():
+            sql, expression_params = compiler.compile(expression)
+            sql_parts.append(sql)
+            params.extend(expression_params)
+        return "daterange(%s, %s, '[]') && daterange(%s, %s, '[]')" % tuple(sql_parts), params
+
+
+class ReservationQuerySet(models.QuerySet):
+    def overlapping(self, start_date, end_date):
+        """
+        Reservations whose [start_date, end_date] interval intersects the given one
+        On Postgres the predicate is written as a daterange overlap so that the
+        GiST index of the (listing_id, daterange(start_date, end_date, '[]')) exclusion constraint is used,
+        elsewhere it falls back to the plain `start <= end AND end >= start` form
+        """
+        if connections[self.db].vendor == 'postgresql':
+            return self.filter(DateRangeOverlaps('start_date', 'end_date', Value(start_date), Value(end_date)))
+        return self.filter(start_date__lte=end_date, end_date__gte=start_date)
+
+
 class Reservation(models.Model):
     listing = models.ForeignKey(Listing, related_name='reservations', on_delete=models.CASCADE)
     name = models.CharField(max_length=100)
     start_date = models.DateField()
     end_date = models.DateField()
 
+    objects = ReservationQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['listing', 'start_date', 'end_date'], name='reservation_listing_dates_idx'),
+            models.Index(fields=['start_date', 'end_date'], name='reservation_dates_idx'),
+        ]
+
     def __str__(self):
         return f"{self.listing.id} - {self.listing.name} - {self.name}"
 
@@ -30,4 +68,56 @@ class Reservation(models.Model):
     @property
     def duration(self):
         difference = self.end_date - self.start_date
-        return difference.days + 1
\ No newline at end of file
+        return difference.days + 1
+
+
+class ArchivedReservation(models.Model):
+    """
+    Reservation that ended before the archive cutoff, moved out of Reservation by archive_reservations
+    Keeps the original id, so availability checks only scan current and future stays while
+    reports and exports can still read the full history.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    listing = models.ForeignKey(Listing, related_name='archived_reservations', on_delete=models.CASCADE)
+    name = models.CharField(max_length=100)
+    start_date = models.DateField()
+    end_date = models.DateField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    objects = ReservationQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['listing', 'start_date', 'end_date'], name='archived_listing_dates_idx'),
+            models.Index(fields=['end_date'], name='archived_end_date_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.listing_id} - {self.name} (archived)"
+
+    @property
+    def duration(self):
+        return (self.end_date - self.start_date).days + 1
+
+
+class ListingOccupancy(models.Model):
+    """
+    Booked nights and reservations of a listing in one calendar month
+    Maintained incrementally from reservation changes (see reservation.occupancy),
+    so occupancy reports never scan Reservation.
+    """
+    listing = models.ForeignKey(Listing, related_name='occupancy', on_delete=models.CASCADE)
+    month = models.DateField(help_text='First day of the month')
+    booked_nights = models.PositiveIntegerField(default=0)
+    reservation_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['listing', 'month'], name='listing_occupancy_listing_month_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['month', 'listing'], name='listing_occupancy_month_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.listing_id} - {self.month:%Y-%m}"
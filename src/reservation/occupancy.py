@@ -0,0 +1,155 @@
+import calendar
+from collections import defaultdict
+from itertools import chain
+from datetime import date, datetime, timedelta
+
+from django.db import connection, transaction
+from django.db.models import ExpressionWrapper, F, FloatField
+from django.db.models.functions import Greatest
+from rest_framework.exceptions import ValidationError
+
+from .models import ArchivedReservation, Listing, ListingOccupancy, Reservation
+
+# Rows per INSERT ... ON CONFLICT statement, 4 parameters each keeps SQLite under its variable limit
+UPSERT_BATCH_SIZE = 200
+REBUILD_LISTINGS_PER_TRANSACTION = 500
+
+
+def month_start(day):
+    return day.replace(day=1)
+
+
+def next_month(month):
+    return (month.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def days_in_month(month):
+    return calendar.monthrange(month.year, month.month)[1]
+
+
+def nights_by_month(start_date, end_date):
+    """
+    Yields (first day of month, booked nights in that month) for an inclusive [start_date, end_date] stay
+    """
+    month = month_start(start_date)
+    while month <= end_date:
+        following = next_month(month)
+        first_night = max(start_date, month)
+        last_night = min(end_date, following - timedelta(days=1))
+        yield month, (last_night - first_night).days + 1
+        month = following
+
+
+def occupancy_deltas(reservations):
+    """
+    {(listing_id, month): [booked nights, reservation count]} for (listing_id, start_date, end_date) tuples
+    A stay crossing a month boundary counts as one reservation in every month it has nights in.
+    """
+    deltas = defaultdict(lambda: [0, 0])
+    for listing_id, start_date, end_date in reservations:
+        for month, nights in nights_by_month(start_date, end_date):
+            delta = deltas[(listing_id, month)]
+            delta[0] += nights
+            delta[1] += 1
+    return deltas
+
+
+def _upsert_sql(rows):
+    quote_name = connection.ops.quote_name
+    table = quote_name(ListingOccupancy._meta.db_table)
+    nights, count = quote_name('booked_nights'), quote_name('reservation_count')
+    values = ', '.join(['(%s, %s, %s, %s)'] * rows)
+    return (f'INSERT INTO {table} ({quote_name("listing_id")}, {quote_name("month")}, {nights}, {count}) '
+            f'VALUES {values} '
+            f'ON CONFLICT ({quote_name("listing_id")}, {quote_name("month")}) DO UPDATE SET '
+            f'{nights} = {table}.{nights} + excluded.{nights}, '
+            f'{count} = {table}.{count} + excluded.{count}')
+
+
+def add_reservations(reservations):
+    """
+    Add (listing_id, start_date, end_date) stays to the rollup
+    One INSERT ... ON CONFLICT DO UPDATE per UPSERT_BATCH_SIZE listing months, so concurrent bookings
+    of the same month add up instead of racing on a read-modify-write. Call it inside the transaction
+    that inserts the reservations.
+    """
+    month_field = ListingOccupancy._meta.get_field('month')
+    rows = [(listing_id, month_field.get_db_prep_value(month, connection), nights, count)
+            for (listing_id, month), (nights, count) in sorted(occupancy_deltas(reservations).items())]
+    with connection.cursor() as cursor:
+        for offset in range(0, len(rows), UPSERT_BATCH_SIZE):
+            batch = rows[offset:offset + UPSERT_BATCH_SIZE]
+            cursor.execute(_upsert_sql(len(batch)), [value for row in batch for value in row])
+
+
+def remove_reservations(reservations):
+    """
+    Subtract deleted stays, never below zero so a rollup that was never backfilled can't block deletes
+    """
+    for (listing_id, month), (nights, count) in sorted(occupancy_deltas(reservations).items()):
+        ListingOccupancy.objects.filter(listing_id=listing_id, month=month).update(
+            booked_nights=Greatest(F('booked_nights') - nights, 0),
+            reservation_count=Greatest(F('reservation_count') - count, 0))
+
+
+def rebuild_occupancy(listing_ids=None, stdout=None):
+    """
+    Recompute the rollup from Reservation and ArchivedReservation, for every listing or only listing_ids
+    Listings are locked and rebuilt REBUILD_LISTINGS_PER_TRANSACTION at a time, bookings of those
+    listings wait for their batch instead of being counted twice. Returns the number of rollup rows.
+    """
+    listings = Listing.objects.order_by('pk')
+    if listing_ids is not None:
+        listings = listings.filter(pk__in=listing_ids)
+    all_listing_ids = list(listings.values_list('pk', flat=True))
+
+    created = 0
+    for offset in range(0, len(all_listing_ids), REBUILD_LISTINGS_PER_TRANSACTION):
+        batch = all_listing_ids[offset:offset + REBUILD_LISTINGS_PER_TRANSACTION]
+        with transaction.atomic():
+            list(Listing.objects.select_for_update().filter(pk__in=batch).order_by('pk').values_list('pk', flat=True))
+            ListingOccupancy.objects.filter(listing_id__in=batch).delete()
+            stays = chain.from_iterable(
+                model.objects.filter(listing_id__in=batch)
+                .values_list('listing_id', 'start_date', 'end_date').iterator(chunk_size=2000)
+                for model in (Reservation, ArchivedReservation))
+            rows = [ListingOccupancy(listing_id=listing_id, month=month, booked_nights=nights, reservation_count=count)
+                    for (listing_id, month), (nights, count) in sorted(occupancy_deltas(stays).items())]
+            ListingOccupancy.objects.bulk_create(rows, batch_size=1000)
+        created += len(rows)
+        if stdout:
+            stdout.write(f'{offset + len(batch)} of {len(all_listing_ids)} listings rebuilt')
+    return created
+
+
+def occupancy_report_query(month):
+    """
+    Rollup rows of one month with the listing name and the occupancy rate in percent, nothing else is read
+    """
+    return (ListingOccupancy.objects.filter(month=month_start(month))
+            .annotate(occupancy_rate=ExpressionWrapper(F('booked_nights') * 100.0 / days_in_month(month),
+                                                       output_field=FloatField()))
+            .values('listing_id', 'listing__name', 'booked_nights', 'reservation_count', 'occupancy_rate')
+            .order_by('listing_id'))
+
+
+def parse_report_month(value):
+    """
+    First day of the YYYY-MM month, the current month when value is empty
+    """
+    if not value:
+        return month_start(date.today())
+    try:
+        return datetime.strptime(value, '%Y-%m').date()
+    except ValueError:
+        raise ValidationError('month must be in YYYY-MM format.')
+
+
+def occupancy_report_context(month, rows):
+    return {
+        'rows': rows,
+        'month': month,
+        'days': days_in_month(month),
+        'previous_month': month_start(month - timedelta(days=1)),
+        'next_month': next_month(month),
+    }
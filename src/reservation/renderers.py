@@ -0,0 +1,31 @@
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils import encoders
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, the stdlib path below produces the same bytes
+    orjson = None
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer that encodes with orjson when it is installed
+    Only the compact, non-ASCII-escaping form of DRF's output is produced by orjson,
+    which is byte for byte what JSONRenderer emits with the default settings;
+    indented (browsable API) or ASCII-escaped output goes through the stdlib encoder.
+    Dates and times are left to DRF's encoder, which trims microseconds and writes UTC as Z.
+    """
+    _default = staticmethod(encoders.JSONEncoder().default)
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None or not self.compact or self.ensure_ascii:
+            return super().render(data, accepted_media_type, renderer_context)
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            ret = orjson.dumps(data, default=self._default, option=orjson.OPT_PASSTHROUGH_DATETIME)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # Same strict javascript subset escaping as JSONRenderer
+        return ret.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
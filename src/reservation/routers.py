@@ -0,0 +1,223 @@
+import itertools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, InterfaceError, OperationalError, connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REPLICA_ROUTING = {
+    'STICKY_SECONDS': 5,
+    'EJECT_SECONDS': 30,
+    'STICKY_COOKIE': 'reservation_primary_until',
+    'READ_ONLY_VIEWS': [],
+}
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def replica_routing_settings():
+    return {**DEFAULT_REPLICA_ROUTING, **getattr(settings, 'REPLICA_ROUTING', {})}
+
+
+def read_replicas():
+    return list(getattr(settings, 'READ_REPLICAS', []))
+
+
+class RequestRouting:
+    __slots__ = ('use_replica', 'replica', 'wrote')
+
+    def __init__(self):
+        self.use_replica = False
+        # Picked once per request, so all its reads (count, page, prefetches) see one snapshot
+        self.replica = DEFAULT_DB_ALIAS
+        self.wrote = False
+
+
+# Routing decision of the current request, None outside requests (commands, shells) means primary only
+_current_routing = ContextVar('reservation_request_routing', default=None)
+_primary_reads = ContextVar('reservation_primary_reads', default=False)
+
+
+@contextmanager
+def primary_reads():
+    """
+    Send the reads inside to the primary, for data kept in a shared cache after the request
+    A lagging replica would otherwise refill a cache right after a booking invalidated it.
+    """
+    token = _primary_reads.set(True)
+    try:
+        yield
+    finally:
+        _primary_reads.reset(token)
+
+
+class ReplicaPool:
+    """
+    Round-robin over the configured replicas, skipping the ones ejected after a connection error
+    An ejected replica is tried again once EJECT_SECONDS have passed.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counter = itertools.count()
+        self._ejected_until = {}
+
+    def reset(self):
+        with self._lock:
+            self._counter = itertools.count()
+            self._ejected_until = {}
+
+    def eject(self, alias):
+        with self._lock:
+            self._ejected_until[alias] = time.monotonic() + replica_routing_settings()['EJECT_SECONDS']
+        logger.warning('Read replica %s ejected', alias)
+
+    def is_healthy(self, alias):
+        with self._lock:
+            ejected_until = self._ejected_until.get(alias)
+            if ejected_until is None:
+                return True
+            if ejected_until <= time.monotonic():
+                del self._ejected_until[alias]
+                return True
+            return False
+
+    def pick(self):
+        """
+        Alias of the next healthy replica that accepts a connection, the primary when there is none
+        """
+        replicas = read_replicas()
+        if not replicas:
+            return DEFAULT_DB_ALIAS
+        start = next(self._counter)
+        for offset in range(len(replicas)):
+            alias = replicas[(start + offset) % len(replicas)]
+            if not self.is_healthy(alias):
+                continue
+            try:
+                connections[alias].ensure_connection()
+            except (OperationalError, InterfaceError):
+                self.eject(alias)
+                continue
+            return alias
+        return DEFAULT_DB_ALIAS
+
+
+replica_pool = ReplicaPool()
+
+
+class ReplicaRouter:
+    """
+    Sends reads of read-only views to a replica and everything else to the primary
+    Writes, reads inside a transaction on the primary and reads after a write in the same
+    request always use the primary. All reads of a request go to the replica the middleware
+    picked for it, another one is only picked when that replica gets ejected meanwhile.
+    Migrations never run on the replicas, they get the schema from the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        routing = _current_routing.get()
+        if routing is None or not routing.use_replica or routing.wrote or _primary_reads.get():
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        if routing.replica != DEFAULT_DB_ALIAS and not replica_pool.is_healthy(routing.replica):
+            routing.replica = replica_pool.pick()
+        return routing.replica
+
+    def db_for_write(self, model, **hints):
+        routing = _current_routing.get()
+        if routing is not None:
+            routing.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        databases = {DEFAULT_DB_ALIAS, *read_replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in read_replicas():
+            return False
+        return None
+
+
+def _replica_health_wrapper(execute, sql, params, many, context):
+    try:
+        return execute(sql, params, many, context)
+    except (OperationalError, InterfaceError):
+        replica_pool.eject(context['connection'].alias)
+        raise
+
+
+@receiver(connection_created)
+def install_replica_health_wrapper(sender, connection, **kwargs):
+    if connection.alias in read_replicas() and _replica_health_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_replica_health_wrapper)
+
+
+def is_sticky(request, options):
+    try:
+        return float(request.COOKIES.get(options['STICKY_COOKIE'], 0)) > time.time()
+    except ValueError:
+        return False
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Lets ReplicaRouter use replicas for the safe requests of REPLICA_ROUTING['READ_ONLY_VIEWS']
+    A client that sent a write gets a cookie that keeps its reads on the primary for
+    STICKY_SECONDS, long enough to read its own booking before the replicas catch up.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = _current_routing.set(RequestRouting())
+        try:
+            return self.process_response(request, self.get_response(request))
+        finally:
+            _current_routing.reset(token)
+
+    async def __acall__(self, request):
+        token = _current_routing.set(RequestRouting())
+        try:
+            return self.process_response(request, await self.get_response(request))
+        finally:
+            _current_routing.reset(token)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        routing = _current_routing.get()
+        if routing is None or not read_replicas() or request.method not in SAFE_METHODS:
+            return None
+        options = replica_routing_settings()
+        routing.use_replica = (request.resolver_match.view_name in options['READ_ONLY_VIEWS']
+                               and not is_sticky(request, options))
+        if routing.use_replica:
+            routing.replica = replica_pool.pick()
+        return None
+
+    def process_response(self, request, response):
+        routing = _current_routing.get()
+        if request.method not in SAFE_METHODS or (routing is not None and routing.wrote):
+            options = replica_routing_settings()
+            response.set_cookie(options['STICKY_COOKIE'], str(time.time() + options['STICKY_SECONDS']),
+                                max_age=options['STICKY_SECONDS'], httponly=True, samesite='Lax')
+        return response
@@ -0,0 +1,90 @@
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connections
+from django.db.models import Q, Value
+from django.db.models.expressions import RawSQL
+from rest_framework.exceptions import ValidationError
+
+from .models import Listing
+from .utils import available_listings_in_date_range_query, parse_input_dates
+
+SEARCH_CONFIG = 'english'
+SEARCH_FIELDS = ('name', 'address', 'description')
+SEARCH_MAX_TERMS = 10
+LISTING_FTS_TABLE = 'reservation_listing_fts'
+
+
+def search_terms(query):
+    # Lowercase words of the query, punctuation never reaches the search syntax
+    return re.findall(r'\w+', (query or '').lower())[:SEARCH_MAX_TERMS]
+
+
+def parse_search_request(query, start_date=None, end_date=None):
+    """
+    Validated (terms, start_date, end_date) of a listing search, the dates are optional but come as a pair
+    """
+    terms = search_terms(query)
+    if not terms:
+        raise ValidationError('q is required.')
+    if start_date or end_date:
+        try:
+            start_date, end_date = parse_input_dates(start_date, end_date)
+        except ValueError:
+            raise ValidationError('Dates must be in YYYY-MM-DD format.')
+    return terms, start_date, end_date
+
+
+def listing_search_vector():
+    # Same expression as the listing_search_gin index of migration 0006
+    return SearchVector(*SEARCH_FIELDS, config=SEARCH_CONFIG)
+
+
+def _postgres_search(listings, terms):
+    # Every term must match, the last one as a prefix so results follow the user's typing
+    query = SearchQuery(' & '.join(terms[:-1] + [f'{terms[-1]}:*']), search_type='raw', config=SEARCH_CONFIG)
+    vector = listing_search_vector()
+    return listings.annotate(search=vector, rank=SearchRank(vector, query)).filter(search=query)
+
+
+def _fts5_search(listings, terms):
+    connection = connections[listings.db]
+    table = connection.ops.quote_name(LISTING_FTS_TABLE)
+    listing_id = f'{connection.ops.quote_name(Listing._meta.db_table)}.{connection.ops.quote_name("id")}'
+    match = ' '.join([f'"{term}"' for term in terms[:-1]] + [f'"{terms[-1]}"*'])
+    # The FTS5 index finds the matching ids, bm25 is only computed for those (lower is better)
+    return (listings.filter(pk__in=RawSQL(f'SELECT rowid FROM {table} WHERE {table} MATCH %s', (match,)))
+            .annotate(rank=RawSQL(f'SELECT -bm25({table}) FROM {table} WHERE {table} MATCH %s AND rowid = {listing_id}',
+                                  (match,))))
+
+
+def _icontains_search(listings, terms):
+    for term in terms:
+        listings = listings.filter(Q(name__icontains=term) | Q(address__icontains=term) |
+                                   Q(description__icontains=term))
+    return listings.annotate(rank=Value(0.0))
+
+
+def search_listings(listings, terms):
+    """
+    listings matching every term, annotated with a relevance `rank` (higher is better)
+    Postgres uses the GIN indexed search vector, SQLite the FTS5 table, other databases icontains.
+    """
+    vendor = connections[listings.db].vendor
+    if vendor == 'postgresql':
+        return _postgres_search(listings, terms)
+    if vendor == 'sqlite':
+        return _fts5_search(listings, terms)
+    return _icontains_search(listings, terms)
+
+
+def listing_search_query(terms, start_date=None, end_date=None):
+    """
+    Matching listings by relevance, only the ones free between start_date and end_date when given
+    The availability filter is a NOT EXISTS on the same query, so one query returns a page.
+    """
+    if start_date is not None:
+        listings = available_listings_in_date_range_query(start_date, end_date)
+    else:
+        listings = Listing.objects.all()
+    return search_listings(listings, terms).order_by('-rank', 'id')
@@ -19,3 +19,14 @@ class ReservationSerializer(serializers.ModelSerializer):
     class Meta:
         model = Reservation
         fields = ['listing', 'name', 'start_date', 'end_date']
+
+
+class BulkReservationItemSerializer(serializers.Serializer):
+    """
+    Same payload as ReservationSerializer, but the listing is kept as a plain id
+    so that a whole batch can be checked against the database in one query
+    """
+    listing = serializers.IntegerField()
+    name = serializers.CharField(max_length=100)
+    start_date = serializers.DateField()
+    end_date = serializers.DateField()
@@ -0,0 +1,89 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .availability import availability_index
+from .caching import availability_result_cache, listing_cache, listing_calendar_cache
+from .models import Listing, Reservation
+from .occupancy import add_reservations, rebuild_occupancy, remove_reservations
+
+
+@receiver(post_save, sender=Reservation)
+def update_availability_index_on_save(sender, instance, created, **kwargs):
+    if created:
+        transaction.on_commit(lambda: availability_index.add_reservation(instance.listing_id,
+                                                                         instance.start_date,
+                                                                         instance.end_date))
+    else:
+        # The previous dates are unknown here, so recompute the listing's bitmap
+        transaction.on_commit(lambda: availability_index.rebuild_listing(instance.listing_id))
+
+
+@receiver(post_delete, sender=Reservation)
+def update_availability_index_on_delete(sender, instance, **kwargs):
+    transaction.on_commit(lambda: availability_index.rebuild_listing(instance.listing_id))
+
+
+@receiver(post_save, sender=Listing)
+@receiver(post_delete, sender=Listing)
+def invalidate_listing_cache_on_listing_change(sender, instance, **kwargs):
+    # Deleting clears instance.pk before the commit callback runs
+    listing_id = instance.pk
+    transaction.on_commit(lambda: listing_cache.invalidate(listing_id))
+
+
+@receiver(post_save, sender=Reservation)
+@receiver(post_delete, sender=Reservation)
+def invalidate_listing_cache_on_reservation_change(sender, instance, **kwargs):
+    transaction.on_commit(lambda: listing_cache.invalidate(instance.listing_id))
+
+
+@receiver(post_save, sender=Reservation)
+def invalidate_availability_results_on_reservation_save(sender, instance, created, **kwargs):
+    if created:
+        start_date, end_date = instance.start_date, instance.end_date
+        transaction.on_commit(lambda: availability_result_cache.invalidate_range(start_date, end_date))
+    else:
+        # The previous dates are unknown here, so every cached range is dropped
+        transaction.on_commit(availability_result_cache.invalidate_all)
+
+
+@receiver(post_delete, sender=Reservation)
+def invalidate_availability_results_on_reservation_delete(sender, instance, **kwargs):
+    start_date, end_date = instance.start_date, instance.end_date
+    transaction.on_commit(lambda: availability_result_cache.invalidate_range(start_date, end_date))
+
+
+@receiver(post_save, sender=Listing)
+@receiver(post_delete, sender=Listing)
+def invalidate_availability_results_on_listing_change(sender, instance, **kwargs):
+    transaction.on_commit(availability_result_cache.invalidate_all)
+
+
+@receiver(post_save, sender=Reservation)
+def update_occupancy_on_reservation_save(sender, instance, created, **kwargs):
+    # Runs inside the saving transaction, so the rollup commits or rolls back with the reservation
+    if created:
+        add_reservations([(instance.listing_id, instance.start_date, instance.end_date)])
+    else:
+        # The previous dates are unknown here, so the listing's rollup is recomputed
+        rebuild_occupancy([instance.listing_id])
+
+
+@receiver(post_delete, sender=Reservation)
+def update_occupancy_on_reservation_delete(sender, instance, **kwargs):
+    remove_reservations([(instance.listing_id, instance.start_date, instance.end_date)])
+
+
+@receiver(post_save, sender=Reservation)
+@receiver(post_delete, sender=Reservation)
+def invalidate_calendar_on_reservation_change(sender, instance, **kwargs):
+    listing_id = instance.listing_id
+    transaction.on_commit(lambda: listing_calendar_cache.invalidate([listing_id]))
+
+
+@receiver(post_delete, sender=Listing)
+def invalidate_calendar_on_listing_delete(sender, instance, **kwargs):
+    # A later listing may reuse the id
+    listing_id = instance.pk
+    transaction.on_commit(lambda: listing_calendar_cache.invalidate([listing_id]))
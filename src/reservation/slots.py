@@ -0,0 +1,83 @@
+import heapq
+from datetime import date, datetime, timedelta
+from itertools import groupby
+from operator import itemgetter
+
+from django.db.models import FilteredRelation, Q
+from rest_framework.exceptions import ValidationError
+
+from .models import Listing
+from .utils import validate_date_range
+
+SLOT_MAX_NIGHTS = 365
+SLOT_DEFAULT_LIMIT = 10
+SLOT_MAX_LIMIT = 100
+
+
+def _positive_int(value, name, default, maximum):
+    if value in (None, ''):
+        if default is None:
+            raise ValidationError(f'{name} is required.')
+        return default
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise ValidationError(f'{name} must be an integer.')
+    if not 1 <= value <= maximum:
+        raise ValidationError(f'{name} must be between 1 and {maximum}.')
+    return value
+
+
+def parse_slot_request(nights, earliest, limit):
+    """
+    Validated (nights, earliest start date, limit) of a next available slot search
+    """
+    nights = _positive_int(nights, 'nights', None, SLOT_MAX_NIGHTS)
+    limit = _positive_int(limit, 'limit', SLOT_DEFAULT_LIMIT, SLOT_MAX_LIMIT)
+    if earliest:
+        try:
+            earliest = datetime.strptime(earliest, '%Y-%m-%d').date()
+        except ValueError:
+            raise ValidationError('earliest must be in YYYY-MM-DD format.')
+        validate_date_range(earliest, earliest)
+    else:
+        earliest = date.today()
+    return nights, earliest, limit
+
+
+def earliest_gap(intervals, earliest, nights):
+    """
+    First night of the earliest run of `nights` free nights starting on or after earliest
+    intervals are the listing's inclusive (start_date, end_date) stays sorted by start_date,
+    consumed in one pass and only as far as needed.
+    """
+    candidate = earliest
+    for start_date, end_date in intervals:
+        if (start_date - candidate).days >= nights:
+            break
+        if end_date >= candidate:
+            candidate = end_date + timedelta(days=1)
+    return candidate
+
+
+def next_available_slots(nights, earliest, listing_id=None, limit=SLOT_DEFAULT_LIMIT):
+    """
+    Earliest free stay of `nights` nights for one listing or the `limit` listings that are free soonest
+    One query streams every listing with its reservations ending on or after earliest,
+    ordered by listing and start date, and the gaps are merged on the fly.
+    """
+    listings = Listing.objects.all()
+    if listing_id is not None:
+        listings = listings.filter(pk=listing_id)
+    rows = (listings
+            .annotate(upcoming=FilteredRelation('reservations',
+                                                condition=Q(reservations__end_date__gte=earliest)))
+            .order_by('pk', 'upcoming__start_date')
+            .values_list('pk', 'upcoming__start_date', 'upcoming__end_date')
+            .iterator(chunk_size=2000))
+
+    slots = ((earliest_gap(((start_date, end_date) for _, start_date, end_date in group if start_date is not None),
+                           earliest, nights), listing_pk)
+             for listing_pk, group in groupby(rows, key=itemgetter(0)))
+    return [{'listing': listing_pk, 'start_date': start_date, 'end_date': start_date + timedelta(days=nights - 1)}
+            for start_date, listing_pk in heapq.nsmallest(limit, slots)]
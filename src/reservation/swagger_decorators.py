@@ -9,9 +9,32 @@ common_parameters = [
         format=openapi.FORMAT_DATE,
         description='Start date for availability search',
     ),
+    openapi.Parameter(
+        name='end_date',
+        in_=openapi.IN_QUERY,
+        type=openapi.TYPE_STRING,
+        format=openapi.FORMAT_DATE,
+        description='End date for availability search',
+    ),
     # Add other common parameters
 ]
 
+pagination_parameters = [
+    openapi.Parameter(
+        name='pagination',
+        in_=openapi.IN_QUERY,
+        type=openapi.TYPE_STRING,
+        enum=['page', 'cursor'],
+        description='Set to cursor for keyset pagination (next/previous links, no count)',
+    ),
+    openapi.Parameter(
+        name='cursor',
+        in_=openapi.IN_QUERY,
+        type=openapi.TYPE_STRING,
+        description='Opaque cursor taken from a previous next/previous link',
+    ),
+]
+
 # Define common responses
 common_responses = {
     400: 'Bad Request',
@@ -21,7 +44,7 @@ common_responses = {
 def available_listings_swagger_decorator(func):
     return swagger_auto_schema(
         method='get',
-        manual_parameters=common_parameters + [
+        manual_parameters=common_parameters + pagination_parameters + [
             # Additional parameters specific to this endpoint
         ],
         responses={
@@ -58,3 +81,228 @@ def add_reservation_swagger_decorator(func):
             **common_responses,
         },
     )(func)
+
+def bulk_add_reservation_swagger_decorator(func):
+    return swagger_auto_schema(
+        method='post',
+        request_body=openapi.Schema(
+            type=openapi.TYPE_ARRAY,
+            items=openapi.Items(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    'listing': openapi.Schema(type=openapi.TYPE_INTEGER),
+                    'name': openapi.Schema(type=openapi.TYPE_STRING),
+                    'start_date': openapi.Schema(type=openapi.TYPE_STRING, format=openapi.FORMAT_DATE),
+                    'end_date': openapi.Schema(type=openapi.TYPE_STRING, format=openapi.FORMAT_DATE),
+                },
+                required=['listing', 'name', 'start_date', 'end_date'],
+            ),
+        ),
+        responses={
+            200: openapi.Response(
+                description='Per-item results, in request order',
+                schema=openapi.Schema(
+                    type=openapi.TYPE_OBJECT,
+                    properties={
+                        'results': openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Items(type=openapi.TYPE_OBJECT)),
+                    },
+                ),
+            ),
+            **common_responses,
+        },
+    )(func)
+
+def export_reservations_swagger_decorator(func):
+    return swagger_auto_schema(
+        method='get',
+        manual_parameters=[
+            openapi.Parameter(
+                name='export_format',
+                in_=openapi.IN_QUERY,
+                type=openapi.TYPE_STRING,
+                enum=['csv', 'ndjson'],
+                description='Output format, csv by default',
+            ),
+            openapi.Parameter(
+                name='listing',
+                in_=openapi.IN_QUERY,
+                type=openapi.TYPE_INTEGER,
+                description='Only reservations of this listing',
+            ),
+            openapi.Parameter(
+                name='start_date',
+                in_=openapi.IN_QUERY,
+                type=openapi.TYPE_STRING,
+                format=openapi.FORMAT_DATE,
+                description='Only reservations overlapping start_date..end_date, past dates are allowed',
+            ),
+            openapi.Parameter(
+                name='end_date',
+                in_=openapi.IN_QUERY,
+                type=openapi.TYPE_STRING,
+                format=openapi.FORMAT_DATE,
+                description='End of the date range filter',
+            ),
+            openapi.Parameter(
+                name='history',
+                in_=openapi.IN_QUERY,
+                type=openapi.TYPE_BOOLEAN,
+                description='Also export archived reservations',
+            ),
+        ],
+        responses={
+            200: 'Streamed CSV or NDJSON file',
+            **common_responses,
+        },
+    )(func)
+
+calendar_parameters = [
+    openapi.Parameter(
+        name='start_date',
+        in_=openapi.IN_QUERY,
+        type=openapi.TYPE_STRING,
+        format=openapi.FORMAT_DATE,
+        description='First night of the calendar window',
+        required=True,
+    ),
+    openapi.Parameter(
+        name='end_date',
+        in_=openapi.IN_QUERY,
+        type=openapi.TYPE_STRING,
+        format=openapi.FORMAT_DATE,
+        description='Last night of the calendar window',
+        required=True,
+    ),
+    openapi.Parameter(
+        name='encoding',
+        in_=openapi.IN_QUERY,
+        type=openapi.TYPE_STRING,
+        enum=['rle', 'bitmask', 'packed'],
+        description='rle gives runs of free/booked nights (F3B5F22), bitmask one 0/1 character per night, '
+                    'packed the base64 little-endian bitset',
+    ),
+]
+
+def listing_calendar_swagger_decorator(func):
+    return swagger_auto_schema(
+        method='get',
+        manual_parameters=calendar_parameters,
+        responses={
+            200: 'Calendar of the listing',
+            404: 'Listing not found',
+            **common_responses,
+        },
+    )(func)
+
+def listings_calendar_swagger_decorator(func):
+    return swagger_auto_schema(
+        method='get',
+        manual_parameters=calendar_parameters + [
+            openapi.Parameter(
+                name='listings',
+                in_=openapi.IN_QUERY,
+                type=openapi.TYPE_STRING,
+                description='Comma separated listing ids',
+                required=True,
+            ),
+        ],
+        responses={
+            200: 'Calendars keyed by listing id',
+            404: 'Some listings not found',
+            **common_responses,
+        },
+    )(func)
+
+def next_available_slot_swagger_decorator(func):
+    return swagger_auto_schema(
+        method='get',
+        manual_parameters=[
+            openapi.Parameter(
+                name='nights',
+                in_=openapi.IN_QUERY,
+                type=openapi.TYPE_INTEGER,
+                description='Length of the stay in nights',
+                required=True,
+            ),
+            openapi.Parameter(
+                name='earliest',
+                in_=openapi.IN_QUERY,
+                type=openapi.TYPE_STRING,
+                format=openapi.FORMAT_DATE,
+                description='Earliest first night, today by default',
+            ),
+            openapi.Parameter(
+                name='listing',
+                in_=openapi.IN_QUERY,
+                type=openapi.TYPE_INTEGER,
+                description='Only search this listing, otherwise the listings free soonest are returned',
+            ),
+            openapi.Parameter(
+                name='limit',
+                in_=openapi.IN_QUERY,
+                type=openapi.TYPE_INTEGER,
+                description='Number of listings to return, 10 by default',
+            ),
+        ],
+        responses={
+            200: 'Earliest free stays, soonest first',
+            404: 'Listing not found',
+            **common_responses,
+        },
+    )(func)
+
+def availability_matrix_swagger_decorator(func):
+    return swagger_auto_schema(
+        method='get',
+        manual_parameters=calendar_parameters[:2] + [
+            openapi.Parameter(
+                name='listings',
+                in_=openapi.IN_QUERY,
+                type=openapi.TYPE_STRING,
+                description='Comma separated listing ids, a page of all listings when omitted',
+            ),
+            openapi.Parameter(
+                name='page',
+                in_=openapi.IN_QUERY,
+                type=openapi.TYPE_INTEGER,
+                description='Page of listings when listings is omitted',
+            ),
+        ],
+        responses={
+            200: 'One base64 little-endian bitset of booked nights per listing',
+            404: 'Some listings not found',
+            **common_responses,
+        },
+    )(func)
+
+def search_listings_swagger_decorator(func):
+    return swagger_auto_schema(
+        method='get',
+        manual_parameters=[
+            openapi.Parameter(
+                name='q',
+                in_=openapi.IN_QUERY,
+                type=openapi.TYPE_STRING,
+                description='Words to find in the listing name, address and description, the last one as a prefix',
+                required=True,
+            ),
+            openapi.Parameter(
+                name='start_date',
+                in_=openapi.IN_QUERY,
+                type=openapi.TYPE_STRING,
+                format=openapi.FORMAT_DATE,
+                description='Only listings free from start_date to end_date',
+            ),
+            openapi.Parameter(
+                name='end_date',
+                in_=openapi.IN_QUERY,
+                type=openapi.TYPE_STRING,
+                format=openapi.FORMAT_DATE,
+                description='End of the availability filter',
+            ),
+        ],
+        responses={
+            200: 'Matching listings, most relevant first',
+            **common_responses,
+        },
+    )(func)
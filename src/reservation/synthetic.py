@@ -0,0 +1,92 @@
+import random
+from datetime import date, timedelta
+
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from .availability import availability_index
+from .caching import availability_result_cache
+from .models import Listing, Reservation
+from .occupancy import add_reservations
+
+# Stay lengths in nights and how often they occur, short stays dominate
+STAY_LENGTHS = (1, 2, 3, 4, 5, 7, 10, 14)
+STAY_WEIGHTS = (10, 25, 22, 15, 10, 10, 5, 3)
+
+
+def _chunks(items, chunk_size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _listing_weights(rng, count):
+    # Zipf-like popularity so a few listings carry most of the reservations
+    return [1 / (rank + 1) ** 0.8 for rank in rng.sample(range(count), count)]
+
+
+def _reservations_for_listing(rng, listing_id, count, first_day):
+    """
+    Non-overlapping reservations walking forward from first_day with random gaps
+    """
+    day = first_day + timedelta(days=rng.randint(0, 30))
+    for index in range(count):
+        nights = rng.choices(STAY_LENGTHS, STAY_WEIGHTS)[0]
+        end_day = day + timedelta(days=nights - 1)
+        yield Reservation(listing_id=listing_id, name=f'Guest {listing_id}-{index}', start_date=day, end_date=end_day)
+        day = end_day + timedelta(days=1 + int(rng.expovariate(1 / 6)))
+
+
+def generate_dataset(users, listings, reservations, chunk_size=1000, seed=None, history_days=365, stdout=None):
+    """
+    Insert `users` users, `listings` listings and about `reservations` reservations with bulk_create
+    Reservations start up to history_days in the past and never overlap on a listing.
+    Returns the number of rows inserted per model.
+    """
+    rng = random.Random(seed)
+    run = rng.randrange(1 << 30)
+
+    created_users = 0
+    for chunk in _chunks((User(username=f'synthetic-{run}-{index}', password='!') for index in range(users)),
+                         chunk_size):
+        User.objects.bulk_create(chunk)
+        created_users += len(chunk)
+    owner_ids = list(User.objects.filter(username__startswith=f'synthetic-{run}-').values_list('id', flat=True))
+
+    listing_ids = []
+    for chunk in _chunks((Listing(owner_id=rng.choice(owner_ids), name=f'Listing {run}-{index}',
+                                  address=f'{rng.randint(1, 999)} Synthetic Street',
+                                  description='Synthetic listing ' * rng.randint(1, 20))
+                          for index in range(listings)), chunk_size):
+        listing_ids.extend(listing.pk for listing in Listing.objects.bulk_create(chunk))
+    if stdout:
+        stdout.write(f'{created_users} users and {len(listing_ids)} listings created')
+
+    per_listing = [0] * len(listing_ids)
+    if listing_ids:
+        for position in rng.choices(range(len(listing_ids)), _listing_weights(rng, len(listing_ids)), k=reservations):
+            per_listing[position] += 1
+
+    first_day = date.today() - timedelta(days=history_days)
+    created_reservations = 0
+    rows = (reservation
+            for listing_id, count in zip(listing_ids, per_listing)
+            for reservation in _reservations_for_listing(rng, listing_id, count, first_day))
+    for chunk in _chunks(rows, chunk_size):
+        with transaction.atomic():
+            Reservation.objects.bulk_create(chunk)
+            add_reservations([(reservation.listing_id, reservation.start_date, reservation.end_date)
+                              for reservation in chunk])
+        created_reservations += len(chunk)
+    if stdout:
+        stdout.write(f'{created_reservations} reservations created')
+
+    # bulk_create sends no signals, drop the availability index and every cached result
+    availability_index.reset()
+    availability_result_cache.invalidate_all()
+    return {'users': created_users, 'listings': len(listing_ids), 'reservations': created_reservations}
@@ -1,11 +1,52 @@
+import asyncio
+import base64
+import csv
+import gc
+import io
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+import weakref
+from concurrent.futures import Future
+from unittest import mock
+
+from django.conf import settings
 from django.contrib.auth.models import User
-from .utils import available_listings_in_date_range_query
-from rest_framework.test import APITestCase
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import OperationalError, connection, connections
+from django.db.models import Sum
+from django.test import AsyncClient, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from redis.exceptions import RedisError
+from .availability import availability_index
+from .caching import KEY_LOCK_STRIPES, availability_result_cache, listing_cache
+from .admission import LocalTokenBuckets, concurrency_limiter, rate_limiter
+from .archive import archive_reservations
+from .calendars import encode_packed, encode_rle
+from .ingestion import BookingTimeout, group_commit_writer
+from .log_handlers import JSONFormatter, QueueFileHandler, SamplingFilter
+from .metrics import registry
+from .occupancy import rebuild_occupancy
+from .management.commands.benchmark_endpoints import find_regressions
+from .renderers import FastJSONRenderer
+from .routers import ReplicaRouter, replica_pool
+from .slots import earliest_gap
+from .synthetic import generate_dataset
+from .utils import (available_listings_in_date_range_query, search_available_listings_query, LISTING_FAST_FIELDS,
+                    bulk_save_reservations, listing_fast_representation)
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APITestCase, APIClient
 from rest_framework import status
 from django.urls import reverse
-from .models import Listing, Reservation
+from .models import ArchivedReservation, Listing, ListingOccupancy, Reservation
 from .serializers import ListingSerializer
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
 
 
 class ShowAllListingsTestCase(APITestCase):
@@ -134,3 +175,1387 @@ class AddReservationTestCase(APITestCase):
         serializer = ReservationSerializer(reservation)
 
         self.assertEqual(response.data, serializer.data)
+
+
+class AvailableListingsOverlapTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.listing = Listing.objects.create(owner=self.user, name='Listing 1', address='Address 1',
+                                              description='Description 1')
+        self.start_date = datetime.now().date() + timedelta(days=10)
+        self.end_date = self.start_date + timedelta(days=4)
+        Reservation.objects.create(listing=self.listing, name='Guest', start_date=self.start_date,
+                                   end_date=self.end_date)
+
+    def assertAvailable(self, start_date, end_date, expected):
+        available = available_listings_in_date_range_query(start_date, end_date)
+        self.assertEqual(available.filter(pk=self.listing.pk).exists(), expected)
+
+    def test_overlapping_ranges_are_unavailable(self):
+        day = timedelta(days=1)
+        # Touching either boundary, covering, and contained ranges all overlap
+        self.assertAvailable(self.start_date - 3 * day, self.start_date, False)
+        self.assertAvailable(self.end_date, self.end_date + 3 * day, False)
+        self.assertAvailable(self.start_date - day, self.end_date + day, False)
+        self.assertAvailable(self.start_date + day, self.end_date - day, False)
+
+    def test_disjoint_ranges_are_available(self):
+        day = timedelta(days=1)
+        self.assertAvailable(self.start_date - 5 * day, self.start_date - day, True)
+        self.assertAvailable(self.end_date + day, self.end_date + 5 * day, True)
+
+
+@override_settings(AVAILABILITY_ENGINE={'ENABLED': True, 'HORIZON_DAYS': 60})
+class AvailabilityIndexTestCase(APITestCase):
+    def setUp(self):
+        availability_index.reset()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.listing_1 = Listing.objects.create(owner=self.user, name='Listing 1', address='Address 1',
+                                                description='Description 1')
+        self.listing_2 = Listing.objects.create(owner=self.user, name='Listing 2', address='Address 2',
+                                                description='Description 2')
+        self.start_date = datetime.now().date() + timedelta(days=5)
+        self.end_date = self.start_date + timedelta(days=3)
+        Reservation.objects.create(listing=self.listing_1, name='Guest', start_date=self.start_date,
+                                   end_date=self.end_date)
+
+    def tearDown(self):
+        availability_index.reset()
+
+    def test_index_matches_sql(self):
+        for offset in range(0, 12):
+            start_date = datetime.now().date() + timedelta(days=offset)
+            end_date = start_date + timedelta(days=2)
+            self.assertEqual(
+                set(search_available_listings_query(start_date, end_date).values_list('id', flat=True)),
+                set(available_listings_in_date_range_query(start_date, end_date).values_list('id', flat=True)),
+            )
+
+    def test_index_updated_on_reservation(self):
+        self.assertIn(self.listing_2, search_available_listings_query(self.start_date, self.end_date))
+
+        input_data = {
+            'listing': self.listing_2.id,
+            'name': 'Guest 2',
+            'start_date': str(self.start_date),
+            'end_date': str(self.end_date),
+        }
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('add-reservation'), data=input_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        self.assertNotIn(self.listing_2, search_available_listings_query(self.start_date, self.end_date))
+
+    def test_dates_outside_horizon_use_sql(self):
+        start_date = datetime.now().date() + timedelta(days=100)
+        self.assertFalse(availability_index.covers(start_date, start_date + timedelta(days=2)))
+        self.assertEqual(search_available_listings_query(start_date, start_date + timedelta(days=2)).count(), 2)
+
+    def test_bookings_during_a_build_are_kept(self):
+        scan = availability_index._scan
+
+        def scan_then_book(base_date, horizon_days):
+            bitmaps = scan(base_date, horizon_days)
+            # Committed after the scan read the table, its on_commit update arrives mid-build
+            availability_index.add_reservation(self.listing_2.id, self.start_date, self.end_date)
+            return bitmaps
+
+        with mock.patch.object(availability_index, '_scan', side_effect=scan_then_book):
+            availability_index.build()
+        self.assertNotIn(self.listing_2, search_available_listings_query(self.start_date, self.end_date))
+
+    def test_one_refresh_at_a_time(self):
+        availability_index.build()
+        availability_index._built_at -= 3600
+        # Another request holds the build, this one answers from the current bitmaps
+        with availability_index._build_lock, mock.patch.object(availability_index, '_scan') as scan:
+            self.assertEqual(list(search_available_listings_query(self.start_date, self.end_date)), [self.listing_2])
+        scan.assert_not_called()
+
+    @override_settings(AVAILABILITY_ENGINE={'ENABLED': True, 'HORIZON_DAYS': 60, 'MAX_EXCLUDED_LISTINGS': 0})
+    def test_many_booked_listings_use_sql(self):
+        available_listings = search_available_listings_query(self.start_date, self.end_date)
+        self.assertIn('EXISTS', str(available_listings.query))
+        self.assertEqual(list(available_listings), [self.listing_2])
+
+
+class ConcurrentAddReservationTestCase(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.listing = Listing.objects.create(owner=self.user, name='Listing 1', address='Address 1',
+                                              description='Description 1')
+
+    def hammer(self, url, payloads):
+        barrier = threading.Barrier(len(payloads))
+        status_codes = [None] * len(payloads)
+
+        def book(index, payload):
+            try:
+                client = APIClient()
+                barrier.wait()
+                status_codes[index] = client.post(url, data=payload, format='json').status_code
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=book, args=(index, payload)) for index, payload in enumerate(payloads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return status_codes
+
+    def test_exactly_one_winner_per_overlapping_range(self):
+        first_start_date = datetime.now().date() + timedelta(days=3)
+        second_start_date = first_start_date + timedelta(days=10)
+        for url_name in ('add-reservation', 'class-add-reservation'):
+            Reservation.objects.all().delete()
+            # Two disjoint groups of mutually overlapping ranges on the same listing
+            payloads = [{
+                'listing': self.listing.id,
+                'name': f'Guest {index}',
+                'start_date': str((first_start_date if index % 2 else second_start_date) + timedelta(days=index % 3)),
+                'end_date': str((first_start_date if index % 2 else second_start_date) + timedelta(days=index % 3 + 2)),
+            } for index in range(12)]
+
+            status_codes = self.hammer(reverse(url_name), payloads)
+
+            self.assertEqual(status_codes.count(status.HTTP_201_CREATED), 2)
+            self.assertEqual(status_codes.count(status.HTTP_404_NOT_FOUND), 10)
+            self.assertEqual(Reservation.objects.filter(listing=self.listing, start_date__lt=second_start_date).count(), 1)
+            self.assertEqual(Reservation.objects.filter(listing=self.listing, start_date__gte=second_start_date).count(), 1)
+
+
+class BulkAddReservationTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.listing_1 = Listing.objects.create(owner=self.user, name='Listing 1', address='Address 1',
+                                                description='Description 1')
+        self.listing_2 = Listing.objects.create(owner=self.user, name='Listing 2', address='Address 2',
+                                                description='Description 2')
+        self.start_date = datetime.now().date() + timedelta(days=5)
+        Reservation.objects.create(listing=self.listing_1, name='Guest', start_date=self.start_date,
+                                   end_date=self.start_date + timedelta(days=2))
+
+    def payload(self, listing_id, start_offset, nights, name='Bulk Guest'):
+        return {
+            'listing': listing_id,
+            'name': name,
+            'start_date': str(self.start_date + timedelta(days=start_offset)),
+            'end_date': str(self.start_date + timedelta(days=start_offset + nights)),
+        }
+
+    def test_bulk_add_reservation_per_item_results(self):
+        payloads = [
+            self.payload(self.listing_1.id, 1, 2),        # overlaps the stored reservation
+            self.payload(self.listing_1.id, 10, 2),       # accepted
+            self.payload(self.listing_1.id, 11, 2),       # overlaps the previous item of the batch
+            self.payload(self.listing_2.id, 0, 3),        # accepted
+            self.payload(self.listing_2.id + 100, 0, 3),  # unknown listing
+            self.payload(self.listing_2.id, 5, -2),       # start after end
+            {'listing': self.listing_2.id, 'start_date': 'invalid_date'},
+        ]
+        for url_name in ('bulk-add-reservation', 'class-bulk-add-reservation'):
+            Reservation.objects.exclude(name='Guest').delete()
+            response = self.client.post(reverse(url_name), data=payloads, format='json')
+
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual([result['status'] for result in response.data['results']], [
+                status.HTTP_404_NOT_FOUND, status.HTTP_201_CREATED, status.HTTP_404_NOT_FOUND,
+                status.HTTP_201_CREATED, status.HTTP_404_NOT_FOUND, status.HTTP_400_BAD_REQUEST,
+                status.HTTP_400_BAD_REQUEST,
+            ])
+            self.assertEqual(Reservation.objects.count(), 3)
+
+    def test_bulk_add_reservation_query_count_is_constant(self):
+        small_batch = [self.payload(self.listing_2.id, 3 * index, 1, name='Small') for index in range(2)]
+        large_batch = [self.payload(self.listing_1.id, 3 * index + 3, 1, name='Large') for index in range(50)]
+
+        with self.assertNumQueries(6):
+            self.client.post(reverse('bulk-add-reservation'), data=small_batch, format='json')
+        with self.assertNumQueries(6):
+            self.client.post(reverse('bulk-add-reservation'), data=large_batch, format='json')
+        self.assertEqual(Reservation.objects.filter(name='Large').count(), 50)
+
+
+class CursorPaginationTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        Listing.objects.bulk_create([
+            Listing(owner=self.user, name=f'Listing {index}', address=f'Address {index}',
+                    description=f'Description {index}')
+            for index in range(25)
+        ])
+
+    def walk(self, url, params):
+        ids = []
+        response = self.client.get(url, data=params)
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn('count', response.data)
+            ids.extend(listing['id'] for listing in response.data['results'])
+            if ids and len(ids) == 10:
+                # Rows inserted while paging must not shift the following pages
+                Listing.objects.create(owner=self.user, name='Late', address='Late', description='Late')
+            if not response.data['next']:
+                return ids
+            response = self.client.get(response.data['next'])
+
+    def test_cursor_pagination_walks_every_listing_once(self):
+        start_date = datetime.now().date()
+        date_params = {'start_date': str(start_date), 'end_date': str(start_date + timedelta(days=3))}
+        for url_name, params in (('listing-list', {}), ('class-listing-list', {}),
+                                 ('available-listing-list', date_params),
+                                 ('class-available-listing-list', date_params)):
+            ids = self.walk(reverse(url_name), {'pagination': 'cursor', **params})
+            self.assertEqual(ids, sorted(ids))
+            self.assertEqual(len(ids), len(set(ids)))
+            self.assertEqual(ids, list(Listing.objects.order_by('id').values_list('id', flat=True)))
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('listing-list'), data={'cursor': 'invalid'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class OverviewReportsQueryCountTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.start_date = datetime.now().date()
+
+    def create_listings(self, count):
+        for index in range(count):
+            listing = Listing.objects.create(owner=self.user, name=f'Listing {index}', address=f'Address {index}',
+                                             description=f'Description {index}')
+            Reservation.objects.bulk_create([
+                Reservation(listing=listing, name=f'Guest {night}', start_date=self.start_date + timedelta(days=night),
+                            end_date=self.start_date + timedelta(days=night))
+                for night in range(12)
+            ])
+
+    def test_report_query_count_does_not_grow_with_page_size(self):
+        for url_name in ('overview-reports', 'class-overview-reports'):
+            Listing.objects.all().delete()
+            self.create_listings(2)
+            with self.assertNumQueries(3):
+                response = self.client.get(reverse(url_name))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+            self.create_listings(8)
+            with self.assertNumQueries(3):
+                response = self.client.get(reverse(url_name))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertContains(response, 'Guest 9')
+            self.assertNotContains(response, 'Guest 10')
+            self.assertContains(response, 'Your records are more than 10 items', count=10)
+
+
+class ListingCacheTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        listing_cache.local.clear()
+        listing_cache.reset_stats()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.listing = Listing.objects.create(owner=self.user, name='Listing 1', address='Address 1',
+                                              description='Description 1')
+
+    def test_listing_details_hits_cache(self):
+        for url_name in ('listing-details', 'class-listing-details'):
+            listing_cache.local.clear()
+            cache.clear()
+            listing_cache.reset_stats()
+            url = reverse(url_name, args=[self.listing.id])
+            self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+            self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+            listing_cache.local.clear()
+            self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+            self.assertEqual(listing_cache.stats(), {'l1_hits': 1, 'l2_hits': 1, 'misses': 1})
+
+    def test_missing_listing_is_not_cached(self):
+        url = reverse('listing-details', args=[self.listing.id + 100])
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertIsNone(cache.get(listing_cache.make_key(self.listing.id + 100)))
+
+    def test_listing_and_reservation_changes_invalidate(self):
+        url = reverse('listing-details', args=[self.listing.id])
+        self.client.get(url)
+        self.assertIsNotNone(cache.get(listing_cache.make_key(self.listing.id)))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.listing.name = 'Renamed'
+            self.listing.save()
+        self.assertIsNone(cache.get(listing_cache.make_key(self.listing.id)))
+        self.assertContains(self.client.get(url), 'Renamed')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            start_date = datetime.now().date()
+            Reservation.objects.create(listing=self.listing, name='Guest', start_date=start_date, end_date=start_date)
+        self.assertIsNone(cache.get(listing_cache.make_key(self.listing.id)))
+
+    def test_concurrent_misses_load_once(self):
+        loads = []
+        barrier = threading.Barrier(8)
+
+        def loader():
+            loads.append(1)
+            time.sleep(0.1)
+            return self.listing
+
+        def read():
+            barrier.wait()
+            listing_cache.get_or_load(self.listing.id, loader)
+
+        threads = [threading.Thread(target=read) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(loads), 1)
+        self.assertEqual(listing_cache.stats()['misses'], 1)
+
+    def test_key_locks_do_not_grow(self):
+        for pk in range(200):
+            listing_cache.get_or_load(pk, lambda: self.listing)
+        self.assertEqual(len(listing_cache._key_locks), KEY_LOCK_STRIPES)
+
+        async def locks():
+            return {listing_cache._async_key_lock(listing_cache.make_key(pk)) for pk in range(200)}
+
+        loop = asyncio.new_event_loop()
+        self.assertEqual(len(loop.run_until_complete(locks())), KEY_LOCK_STRIPES)
+        self.assertIn(loop, listing_cache._async_key_locks)
+        loop.close()
+        loop_ref = weakref.ref(loop)
+        del loop
+        gc.collect()
+        self.assertIsNone(loop_ref())
+
+
+@override_settings(AVAILABILITY_RESULT_CACHE={'ENABLED': True})
+class AvailabilityResultCacheTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        availability_result_cache.reset_stats()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.listing = Listing.objects.create(owner=self.user, name='Listing 1', address='Address 1',
+                                              description='Description 1')
+        self.start_date = datetime.now().date() + timedelta(days=10)
+        self.end_date = self.start_date + timedelta(days=4)
+        self.params = {'start_date': str(self.start_date), 'end_date': str(self.end_date)}
+
+    def book(self, start_date, end_date):
+        with self.captureOnCommitCallbacks(execute=True):
+            Reservation.objects.create(listing=self.listing, name='Guest', start_date=start_date, end_date=end_date)
+
+    def test_repeated_search_is_served_from_cache(self):
+        for url_name in ('available-listing-list', 'class-available-listing-list'):
+            cache.clear()
+            url = reverse(url_name)
+            first = self.client.get(url, data=self.params)
+            with self.assertNumQueries(0):
+                second = self.client.get(url, data=self.params)
+            self.assertEqual(first.data, second.data)
+
+            # Another page of the same range is a separate entry
+            self.client.get(url, data={**self.params, 'pagination': 'cursor'})
+        self.assertEqual(availability_result_cache.stats(), {'hits': 2, 'misses': 4})
+
+    def test_only_overlapping_ranges_are_invalidated(self):
+        url = reverse('available-listing-list')
+        later_params = {'start_date': str(self.end_date + timedelta(days=5)),
+                        'end_date': str(self.end_date + timedelta(days=8))}
+        self.client.get(url, data=self.params)
+        self.client.get(url, data=later_params)
+
+        self.book(self.end_date, self.end_date + timedelta(days=1))
+
+        with self.assertNumQueries(0):
+            self.client.get(url, data=later_params)
+        response = self.client.get(url, data=self.params)
+        self.assertEqual(response.data['results'], [])
+        self.assertEqual(availability_result_cache.stats(), {'hits': 1, 'misses': 3})
+
+
+class FastListingSerializationTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='tëst "user"', password='testpassword')
+        Listing.objects.create(owner=self.user, name=None, address='Straße 1', description='Line\nbreak \u2028 "quoted"')
+        Listing.objects.create(owner=self.user, name='Listing 2', address='Address 2', description='')
+
+    def test_fast_path_is_byte_compatible(self):
+        listings = Listing.objects.select_related('owner').order_by('id')
+        expected = JSONRenderer().render(ListingSerializer(listings, many=True).data)
+        rows = listings.values(*LISTING_FAST_FIELDS)
+        self.assertEqual(FastJSONRenderer().render(listing_fast_representation(rows)), expected)
+
+        response = self.client.get(reverse('listing-list'))
+        self.assertIn(expected[1:-1], response.content)
+
+    def test_dates_and_times_match_drf(self):
+        moment = datetime(2024, 5, 1, 12, 30, 15, 123456, tzinfo=timezone.utc)
+        data = {'at': moment, 'local': moment.replace(tzinfo=None), 'day': moment.date(), 'time': moment.time(),
+                'price': Decimal('12.50'), 'id': uuid.UUID(int=1)}
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+
+
+class AsyncEndpointsTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        listing_cache.local.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.listings = [
+            Listing.objects.create(owner=self.user, name=f'Listing {index}', address=f'Address {index}',
+                                   description=f'Description {index}')
+            for index in range(12)
+        ]
+        self.start_date = datetime.now().date() + timedelta(days=2)
+        Reservation.objects.create(listing=self.listings[0], name='Guest', start_date=self.start_date,
+                                   end_date=self.start_date + timedelta(days=2))
+
+    async def test_async_listings_match_sync_listings(self):
+        client = AsyncClient()
+        for async_name, sync_name, params in (
+                ('async-listing-list', 'listing-list', {}),
+                ('async-available-listing-list', 'available-listing-list',
+                 {'start_date': str(self.start_date), 'end_date': str(self.start_date + timedelta(days=1))})):
+            for page in (1, 2):
+                async_response = await client.get(reverse(async_name), data={**params, 'page': page})
+                sync_response = await client.get(reverse(sync_name), data={**params, 'page': page})
+                self.assertEqual(async_response.status_code, status.HTTP_200_OK)
+                self.assertEqual(async_response.json()['results'], sync_response.json()['results'])
+                self.assertEqual(async_response.json()['count'], sync_response.json()['count'])
+
+        response = await client.get(reverse('async-listing-list'), data={'page': 5})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    async def test_async_listing_details(self):
+        client = AsyncClient()
+        response = await client.get(reverse('async-listing-details', args=[self.listings[0].id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['listing']['owner'], {'id': self.user.id, 'username': 'testuser'})
+        self.assertEqual(response.json()['reservations']['results'][0]['duration'], 3)
+
+        response = await client.get(reverse('async-listing-details', args=[self.listings[-1].id + 100]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    async def test_async_methods_match_sync_methods(self):
+        client = AsyncClient()
+        for async_name, sync_name in (('async-listing-list', 'class-listing-list'),
+                                      ('async-listing-details', 'class-listing-details')):
+            args = [self.listings[0].id] if async_name == 'async-listing-details' else []
+            for method in ('head', 'post'):
+                async_response = await getattr(client, method)(reverse(async_name, args=args))
+                sync_response = await getattr(client, method)(reverse(sync_name, args=args))
+                self.assertEqual(async_response.status_code, sync_response.status_code)
+
+    async def test_concurrent_slow_requests_share_the_event_loop(self):
+        delay = 0.2
+
+        async def slow_cache_get(*args, **kwargs):
+            await asyncio.sleep(delay)
+            return None
+
+        client = AsyncClient()
+        with mock.patch('reservation.caching.cache.aget', slow_cache_get):
+            started = time.monotonic()
+            responses = await asyncio.gather(*[
+                client.get(reverse('async-listing-details', args=[listing.id])) for listing in self.listings
+            ])
+            elapsed = time.monotonic() - started
+
+        self.assertTrue(all(response.status_code == status.HTTP_200_OK for response in responses))
+        # Each request waits on the slow cache twice, serial handling would take 2 * delay per request
+        self.assertLess(elapsed, 2 * delay * len(self.listings) / 3)
+
+
+class MetricsTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        listing_cache.local.clear()
+        registry.reset()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.listing = Listing.objects.create(owner=self.user, name='Listing 1', address='Address 1',
+                                              description='Description 1')
+        self.start_date = datetime.now().date() + timedelta(days=2)
+        self.dates = {'start_date': str(self.start_date), 'end_date': str(self.start_date + timedelta(days=2))}
+
+    def test_counters_after_driving_each_endpoint(self):
+        reservation = {'listing': self.listing.id, 'name': 'Guest', **self.dates}
+        later = {'start_date': str(self.start_date + timedelta(days=10)),
+                 'end_date': str(self.start_date + timedelta(days=12))}
+        requests = [
+            ('get', 'listing-list', [], {}),
+            ('get', 'available-listing-list', [], self.dates),
+            ('post', 'add-reservation', [], reservation),
+            ('post', 'bulk-add-reservation', [], [{**reservation, **later}]),
+            ('get', 'overview-reports', [], {}),
+            ('get', 'listing-details', [self.listing.id], {}),
+            ('get', 'class-listing-list', [], {}),
+            ('get', 'class-available-listing-list', [], self.dates),
+            ('post', 'class-add-reservation', [], reservation),
+            ('post', 'class-bulk-add-reservation', [], [reservation]),
+            ('get', 'class-overview-reports', [], {}),
+            ('get', 'class-listing-details', [self.listing.id], {}),
+        ]
+        for method, url_name, args, data in requests:
+            getattr(self.client, method)(reverse(url_name, args=args), data=data, format='json')
+        self.client.get(reverse('listing-details', args=[self.listing.id]))
+
+        snapshot = registry.snapshot()
+        for _, url_name, _, _ in requests:
+            self.assertGreaterEqual(snapshot[url_name]['requests'], 1, url_name)
+            self.assertGreater(snapshot[url_name]['queries'], 0, url_name)
+            self.assertEqual(sum(snapshot[url_name]['buckets']), snapshot[url_name]['requests'])
+        self.assertEqual(snapshot['listing-details']['requests'], 2)
+        self.assertEqual(snapshot['listing-details']['cache_misses'], 1)
+        self.assertEqual(snapshot['class-listing-details']['cache_hits'], 1)
+
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn(b'reservation_http_request_duration_seconds_count{view="listing-details"} 2', response.content)
+        self.assertIn(b'reservation_cache_misses_total{view="listing-details"} 1', response.content)
+
+    async def test_async_endpoint_queries_are_counted(self):
+        await AsyncClient().get(reverse('async-listing-list'))
+        snapshot = registry.snapshot()
+        self.assertEqual(snapshot['async-listing-list']['requests'], 1)
+        self.assertEqual(snapshot['async-listing-list']['queries'], 2)
+
+
+ADMISSION_TEST_LIMITS = {'GROUP': 'search', 'CLIENT_RATE': 0.001, 'CLIENT_BURST': 2,
+                         'GLOBAL_RATE': 0.001, 'GLOBAL_BURST': 3, 'MAX_CONCURRENT': 1}
+
+
+@override_settings(ADMISSION_CONTROL={'ENABLED': True, 'VIEWS': {
+    'available-listing-list': ADMISSION_TEST_LIMITS, 'class-available-listing-list': ADMISSION_TEST_LIMITS}})
+class AdmissionControlTestCase(APITestCase):
+    def setUp(self):
+        rate_limiter.reset()
+        registry.reset()
+        start_date = datetime.now().date() + timedelta(days=2)
+        self.dates = {'start_date': str(start_date), 'end_date': str(start_date + timedelta(days=2))}
+
+    def search(self, url_name='available-listing-list', address='10.0.0.1'):
+        return self.client.get(reverse(url_name), self.dates, REMOTE_ADDR=address)
+
+    def test_client_and_global_buckets(self):
+        self.assertEqual(self.search().status_code, status.HTTP_200_OK)
+        self.assertEqual(self.search('class-available-listing-list').status_code, status.HTTP_200_OK)
+        # Shed before the view runs, so the database is never touched
+        with self.assertNumQueries(0):
+            response = self.search()
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertGreaterEqual(int(response['Retry-After']), 1)
+
+        # Another client has its own bucket but shares the global one, which allows one more request
+        self.assertEqual(self.search(address='10.0.0.2').status_code, status.HTTP_200_OK)
+        self.assertEqual(self.search(address='10.0.0.3').status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(self.client.get(reverse('listing-list')).status_code, status.HTTP_200_OK)
+
+        self.assertEqual(registry.shed_snapshot(), {('available-listing-list', 'rate'): 2})
+        self.assertIn(b'reservation_requests_shed_total{view="available-listing-list",reason="rate"} 2',
+                      self.client.get(reverse('metrics')).content)
+
+    def test_spoofed_forwarded_addresses_share_a_bucket(self):
+        admission_control = {**settings.ADMISSION_CONTROL, 'CLIENT_IP_HEADER': 'HTTP_X_FORWARDED_FOR'}
+        with override_settings(ADMISSION_CONTROL=admission_control):
+            for spoofed in ('1.1.1.1', '2.2.2.2', '3.3.3.3'):
+                response = self.client.get(reverse('available-listing-list'), self.dates,
+                                           HTTP_X_FORWARDED_FOR=f'{spoofed}, 10.0.0.9', REMOTE_ADDR='192.168.0.1')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_concurrency_cap(self):
+        self.assertTrue(concurrency_limiter.try_acquire('search', 1))
+        try:
+            response = self.search()
+        finally:
+            concurrency_limiter.release('search')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(registry.shed_snapshot(), {('available-listing-list', 'concurrency'): 1})
+
+        self.assertEqual(self.search().status_code, status.HTTP_200_OK)
+        self.assertEqual(concurrency_limiter.in_flight('search'), 0)
+
+    def test_redis_errors_fall_back_to_local_buckets(self):
+        with mock.patch('reservation.admission.uses_redis', return_value=True), \
+                mock.patch('reservation.admission.get_redis_connection', side_effect=RedisError):
+            self.assertEqual(self.search().status_code, status.HTTP_200_OK)
+            self.assertEqual(self.search().status_code, status.HTTP_200_OK)
+            self.assertEqual(self.search().status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_local_buckets_refill(self):
+        buckets = LocalTokenBuckets()
+        limits = [('client', 2, 2), ('global', 10, 10)]
+        self.assertEqual(buckets.take(limits, now=100.0), 0)
+        self.assertEqual(buckets.take(limits, now=100.0), 0)
+        self.assertAlmostEqual(buckets.take(limits, now=100.0), 0.5)
+        # A rejected request doesn't use up the global bucket
+        self.assertEqual(buckets.take(limits, now=100.5), 0)
+
+
+class StructuredLoggingTestCase(APITestCase):
+    def make_record(self, name, level, duration=None):
+        record = logging.LogRecord(name, level, __file__, 1, 'query %s', ('SELECT 1',), None)
+        if duration is not None:
+            record.duration = duration
+            record.sql = 'SELECT 1'
+        return record
+
+    def test_sampling_keeps_slow_queries_and_info_records(self):
+        sampling = SamplingFilter(sample_rate=0, slow_query_seconds=0.5)
+        self.assertFalse(sampling.filter(self.make_record('django.db.backends', logging.DEBUG, duration=0.01)))
+        self.assertTrue(sampling.filter(self.make_record('django.db.backends', logging.DEBUG, duration=0.7)))
+        self.assertFalse(sampling.filter(self.make_record('reservation.utils', logging.DEBUG)))
+        self.assertTrue(sampling.filter(self.make_record('reservation.utils', logging.INFO)))
+
+    def test_queue_handler_writes_json_lines_off_thread(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'test.log')
+            handler = QueueFileHandler(path)
+            handler.setFormatter(JSONFormatter())
+            handler.handle(self.make_record('django.db.backends', logging.DEBUG, duration=0.7))
+            handler.handle(self.make_record('reservation.utils', logging.INFO))
+            handler.close()
+
+            with open(path) as log_file:
+                entries = [json.loads(line) for line in log_file]
+        self.assertEqual([entry['logger'] for entry in entries], ['django.db.backends', 'reservation.utils'])
+        self.assertEqual(entries[0]['duration'], 0.7)
+        self.assertEqual(entries[1]['message'], 'query SELECT 1')
+
+
+class SyntheticDataTestCase(APITestCase):
+    def test_generate_dataset_has_no_overlapping_reservations(self):
+        counts = generate_dataset(5, 20, 300, chunk_size=64, seed=1)
+
+        self.assertEqual(counts, {'users': 5, 'listings': 20, 'reservations': 300})
+        self.assertEqual(Reservation.objects.count(), 300)
+        for reservation in Reservation.objects.all():
+            self.assertLessEqual(reservation.start_date, reservation.end_date)
+            self.assertFalse(Reservation.objects.filter(listing_id=reservation.listing_id)
+                             .exclude(pk=reservation.pk)
+                             .overlapping(reservation.start_date, reservation.end_date).exists())
+
+    def test_find_regressions(self):
+        baseline = {'sizes': {'100': {'listing-list': {'p50_ms': 2, 'p95_ms': 10, 'queries': 2}}}}
+        faster = {'sizes': {'100': {'listing-list': {'p50_ms': 2, 'p95_ms': 11, 'queries': 2}}}}
+        slower = {'sizes': {'100': {'listing-list': {'p50_ms': 2, 'p95_ms': 13, 'queries': 3}}}}
+
+        self.assertEqual(find_regressions(faster, baseline, threshold=0.2), [])
+        self.assertEqual(len(find_regressions(slower, baseline, threshold=0.2)), 2)
+
+
+class ExportReservationsTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', password='testpassword')
+        self.listing_1 = Listing.objects.create(owner=self.user, name='Listing 1', address='Address 1',
+                                                description='Description 1')
+        self.listing_2 = Listing.objects.create(owner=self.user, name='Listing 2', address='Address 2',
+                                                description='Description 2')
+        self.today = datetime.now().date()
+        Reservation.objects.create(listing=self.listing_1, name='=Guest 1', start_date=self.today - timedelta(days=30),
+                                   end_date=self.today - timedelta(days=28))
+        Reservation.objects.create(listing=self.listing_1, name='Guest 2', start_date=self.today,
+                                   end_date=self.today + timedelta(days=2))
+        Reservation.objects.create(listing=self.listing_2, name='Guest 3', start_date=self.today,
+                                   end_date=self.today + timedelta(days=5))
+
+    def streamed(self, response):
+        return b''.join(response.streaming_content).decode()
+
+    def test_csv_export_streams_all_reservations_in_one_query(self):
+        for url_name in ('export-reservations', 'class-export-reservations'):
+            response = self.client.get(reverse(url_name))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertTrue(response.streaming)
+            with self.assertNumQueries(1):
+                rows = list(csv.reader(io.StringIO(self.streamed(response))))
+
+            self.assertEqual(rows[0], ['id', 'listing_id', 'listing_name', 'owner', 'name', 'start_date', 'end_date'])
+            self.assertEqual([row[4] for row in rows[1:]], ["'=Guest 1", 'Guest 2', 'Guest 3'])
+            self.assertEqual(rows[1][2:4], ['Listing 1', 'owner'])
+
+    def test_ndjson_export_filters(self):
+        response = self.client.get(reverse('export-reservations'), {
+            'export_format': 'ndjson', 'listing': self.listing_1.id,
+            'start_date': str(self.today - timedelta(days=29)), 'end_date': str(self.today - timedelta(days=1))})
+        entries = [json.loads(line) for line in self.streamed(response).splitlines()]
+
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0]['name'], '=Guest 1')
+        self.assertEqual(entries[0]['start_date'], str(self.today - timedelta(days=30)))
+
+    def test_invalid_export_parameters(self):
+        for params in ({'export_format': 'xml'}, {'listing': 'abc'}, {'start_date': str(self.today)},
+                       {'start_date': str(self.today), 'end_date': str(self.today - timedelta(days=1))}):
+            response = self.client.get(reverse('class-export-reservations'), params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_export_command(self):
+        output = io.StringIO()
+        call_command('export_reservations', '--format', 'ndjson', '--listing', str(self.listing_2.id), stdout=output)
+        self.assertEqual([json.loads(line)['name'] for line in output.getvalue().splitlines()], ['Guest 3'])
+
+
+class BulkImportTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='manager', password='testpassword')
+        self.stored = Listing.objects.create(owner=self.user, name='Stored', address='Address', description='Stored')
+        self.today = datetime.now().date()
+        Reservation.objects.create(listing=self.stored, name='Stored Guest', start_date=self.today,
+                                   end_date=self.today + timedelta(days=3))
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write(self, name, content):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w', newline='') as input_file:
+            input_file.write(content)
+        return path
+
+    def test_import_listings_and_reservations(self):
+        listings = self.write('listings.csv', 'id,owner,name,address,description\n'
+                                              '1000,manager,Imported,1 Main Street,Sea view\n'
+                                              '1001,nobody,Orphan,2 Main Street,No owner\n'
+                                              '1002,manager,No Address,,Missing address\n')
+        past = self.today - timedelta(days=400)
+        reservations = self.write('reservations.ndjson', '\n'.join([
+            json.dumps({'listing': 1000, 'name': 'Historic', 'start_date': str(past),
+                        'end_date': str(past + timedelta(days=2))}),
+            json.dumps({'listing': 1000, 'name': 'Overlap', 'start_date': str(past + timedelta(days=2)),
+                        'end_date': str(past + timedelta(days=4))}),
+            json.dumps({'listing': self.stored.id, 'name': 'Clash', 'start_date': str(self.today + timedelta(days=1)),
+                        'end_date': str(self.today + timedelta(days=5))}),
+            json.dumps({'listing': self.stored.id, 'name': 'Reversed', 'start_date': str(self.today),
+                        'end_date': str(self.today - timedelta(days=1))}),
+            json.dumps({'listing': 1001, 'name': 'No Listing', 'start_date': str(past), 'end_date': str(past)}),
+            'not json',
+            json.dumps({'listing': self.stored.id, 'name': 'Later', 'start_date': str(self.today + timedelta(days=4)),
+                        'end_date': str(self.today + timedelta(days=6))}),
+        ]) + '\n')
+        rejects = os.path.join(self.directory.name, 'rejects.csv')
+
+        call_command('import_data', '--listings', listings, '--reservations', reservations, '--rejects', rejects,
+                     '--chunk-size', '2', stdout=io.StringIO())
+
+        self.assertEqual(Listing.objects.get(pk=1000).name, 'Imported')
+        self.assertFalse(Listing.objects.filter(pk__in=[1001, 1002]).exists())
+        self.assertEqual(set(Reservation.objects.values_list('name', flat=True)), {'Stored Guest', 'Historic', 'Later'})
+        with open(rejects, newline='') as rejects_file:
+            rejected = sorted(csv.DictReader(rejects_file), key=lambda row: (row['kind'], int(row['line'])))
+        self.assertEqual([(row['kind'], row['line']) for row in rejected], [
+            ('listings', '3'), ('listings', '4'), ('reservations', '2'), ('reservations', '3'),
+            ('reservations', '4'), ('reservations', '5'), ('reservations', '6')])
+        self.assertEqual(rejected[2]['error'], 'Overlaps the reservation on line 1.')
+        self.assertEqual(rejected[3]['error'], 'Overlaps a stored reservation.')
+
+        # The sequence continues after the imported ids
+        self.assertGreater(Listing.objects.create(owner=self.user, address='A', description='D').pk, 1000)
+
+    def test_dry_run_writes_nothing(self):
+        listings = self.write('listings.csv', 'id,owner,name,address,description\n'
+                                              '2000,manager,Imported,1 Main Street,Sea view\n')
+        reservations = self.write('reservations.csv', 'listing,name,start_date,end_date\n'
+                                                      f'2000,Guest,{self.today},{self.today}\n')
+        output = io.StringIO()
+        call_command('import_data', '--listings', listings, '--reservations', reservations, '--dry-run',
+                     '--rejects', os.path.join(self.directory.name, 'rejects.csv'), stdout=output)
+
+        self.assertIn('reservations: 1 imported, 0 rejected', output.getvalue())
+        self.assertFalse(Listing.objects.filter(pk=2000).exists())
+
+
+class OccupancyRollupTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', password='testpassword')
+        self.listing = Listing.objects.create(owner=self.user, name='Listing 1', address='Address 1',
+                                              description='Description 1')
+        self.month = (datetime.now().date().replace(day=1) + timedelta(days=40)).replace(day=1)
+        self.next_month = (self.month + timedelta(days=40)).replace(day=1)
+
+    def rollup(self):
+        return {(row.month, row.booked_nights, row.reservation_count)
+                for row in ListingOccupancy.objects.filter(listing=self.listing)}
+
+    def test_rollup_follows_created_and_deleted_reservations(self):
+        # Last two nights of the month and the first night of the next one
+        start_date = self.next_month - timedelta(days=2)
+        response = self.client.post(reverse('add-reservation'), data={
+            'listing': self.listing.id, 'name': 'Guest', 'start_date': str(start_date),
+            'end_date': str(self.next_month)}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.client.post(reverse('bulk-add-reservation'), data=[{
+            'listing': self.listing.id, 'name': 'Bulk Guest', 'start_date': str(self.month),
+            'end_date': str(self.month + timedelta(days=4))}], format='json')
+        self.assertEqual(self.rollup(), {(self.month, 7, 2), (self.next_month, 1, 1)})
+
+        Reservation.objects.get(name='Bulk Guest').delete()
+        self.assertEqual(self.rollup(), {(self.month, 2, 1), (self.next_month, 1, 1)})
+
+        ListingOccupancy.objects.all().delete()
+        rebuild_occupancy()
+        self.assertEqual(self.rollup(), {(self.month, 2, 1), (self.next_month, 1, 1)})
+
+    def test_occupancy_report_reads_only_the_rollup(self):
+        Reservation.objects.create(listing=self.listing, name='Guest', start_date=self.month,
+                                   end_date=self.month + timedelta(days=9))
+        for url_name in ('occupancy-report', 'class-occupancy-report'):
+            with self.assertNumQueries(2):
+                response = self.client.get(reverse(url_name), {'month': self.month.strftime('%Y-%m')})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            row = response.context['rows'][0]
+            self.assertEqual((row['booked_nights'], row['reservation_count']), (10, 1))
+            self.assertContains(response, 'Listing 1')
+
+            response = self.client.get(reverse(url_name), {'month': 'June'})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(GROUP_COMMIT={'ENABLED': True, 'WRITERS': 2, 'MAX_BATCH': 50, 'MAX_WAIT_MS': 50, 'TIMEOUT': 10})
+class GroupCommitTestCase(TransactionTestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='owner', password='testpassword')
+        self.listing = Listing.objects.create(owner=self.user, name='Listing 1', address='Address 1',
+                                              description='Description 1')
+        self.today = datetime.now().date()
+
+    def tearDown(self):
+        group_commit_writer.stop()
+
+    def payload(self, first_day, nights=1, listing=None):
+        return {'listing': (listing or self.listing).id, 'name': 'Guest',
+                'start_date': str(self.today + timedelta(days=first_day)),
+                'end_date': str(self.today + timedelta(days=first_day + nights - 1))}
+
+    def test_responses_match_the_direct_path(self):
+        for url_name in ('add-reservation', 'class-add-reservation'):
+            Reservation.objects.all().delete()
+            responses = {}
+            for enabled in (True, False):
+                with override_settings(GROUP_COMMIT={'ENABLED': enabled}):
+                    created = self.client.post(reverse(url_name), self.payload(10 if enabled else 20, 3),
+                                               format='json')
+                    conflict = self.client.post(reverse(url_name), self.payload(11 if enabled else 21), format='json')
+                responses[enabled] = (created.status_code, conflict.status_code, conflict.data['error'][:30])
+                self.assertEqual(created.data, {'listing': self.listing.id, 'name': 'Guest',
+                                                'start_date': self.payload(10 if enabled else 20)['start_date'],
+                                                'end_date': self.payload(12 if enabled else 22)['start_date']})
+            self.assertEqual(responses[True], responses[False])
+            self.assertEqual(responses[True][:2], (status.HTTP_201_CREATED, status.HTTP_404_NOT_FOUND))
+        self.assertEqual(ListingOccupancy.objects.aggregate(nights=Sum('booked_nights'))['nights'], 6)
+
+    def test_queued_bookings_are_committed_in_batches_in_arrival_order(self):
+        other = Listing.objects.create(owner=self.user, name='Listing 2', address='Address 2',
+                                       description='Description 2')
+        payloads = [self.payload(day, 2) for day in range(1, 13)] + [self.payload(1, 1, other)]
+        # One writer, concurrent writers would trip over the locks of SQLite's shared in-memory test database
+        with override_settings(GROUP_COMMIT={'WRITERS': 1, 'MAX_WAIT_MS': 200}), \
+                mock.patch('reservation.ingestion.bulk_save_reservations', wraps=bulk_save_reservations) as save:
+            futures = [group_commit_writer.submit(payload) for payload in payloads]
+            results = [future.result(timeout=10) for future in futures]
+
+        # Every other booking overlaps the one before it on the same listing
+        self.assertEqual([result['status'] for result in results],
+                         [status.HTTP_201_CREATED, status.HTTP_404_NOT_FOUND] * 6 + [status.HTTP_201_CREATED])
+        self.assertEqual(Reservation.objects.count(), 7)
+        self.assertLess(save.call_count, len(payloads))
+
+    def test_cancelled_bookings_are_not_committed(self):
+        future = Future()
+        future.cancel()
+        group_commit_writer._commit([(self.payload(1), future)])
+        self.assertFalse(Reservation.objects.exists())
+
+    def test_bookings_abandoned_while_saving_are_rolled_back(self):
+        futures = [Future(), Future()]
+        batch = [(self.payload(1, 3), futures[0]), (self.payload(2, 1), futures[1])]
+
+        def save_and_time_out(payloads):
+            results = bulk_save_reservations(payloads)
+            if len(payloads) == 2:
+                self.assertTrue(group_commit_writer.abandon(futures[0]))
+            return results
+
+        with mock.patch('reservation.ingestion.bulk_save_reservations', side_effect=save_and_time_out):
+            group_commit_writer._commit(batch)
+
+        self.assertIsInstance(futures[0].exception(), BookingTimeout)
+        # Without the abandoned booking the second one no longer conflicts
+        self.assertEqual(futures[1].result()['status'], status.HTTP_201_CREATED)
+        self.assertEqual(list(Reservation.objects.values_list('start_date', flat=True)),
+                         [self.today + timedelta(days=2)])
+        self.assertEqual(ListingOccupancy.objects.aggregate(nights=Sum('booked_nights'))['nights'], 1)
+        self.assertFalse(group_commit_writer.abandon(futures[1]))
+
+    def test_sealed_bookings_are_not_abandoned(self):
+        future = Future()
+        self.assertEqual(group_commit_writer._seal([future]), set())
+        self.assertFalse(group_commit_writer.abandon(future))
+        group_commit_writer._sealed.discard(future)
+
+    def test_submit_during_stop(self):
+        stopping = threading.Event()
+
+        def stop_repeatedly():
+            while not stopping.is_set():
+                group_commit_writer.stop()
+
+        stopper = threading.Thread(target=stop_repeatedly)
+        stopper.start()
+        try:
+            futures = [group_commit_writer.submit(self.payload(day * 2)) for day in range(1, 21)]
+        finally:
+            stopping.set()
+            stopper.join()
+        self.assertEqual([future.result(timeout=10)['status'] for future in futures], [status.HTTP_201_CREATED] * 20)
+
+    def test_stuck_writer_times_out(self):
+        # A batch that never finishes, the future can no longer be cancelled
+        future = Future()
+        future.set_running_or_notify_cancel()
+        with override_settings(GROUP_COMMIT={'ENABLED': True, 'TIMEOUT': 0.05}), \
+                mock.patch.object(group_commit_writer, 'submit', return_value=future):
+            response = self.client.post(reverse('add-reservation'), self.payload(1), format='json')
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+
+
+class ReservationArchiveTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', password='testpassword')
+        self.listing = Listing.objects.create(owner=self.user, name='Listing 1', address='Address 1',
+                                              description='Description 1')
+        self.today = datetime.now().date()
+        self.old = Reservation.objects.create(listing=self.listing, name='Old Guest',
+                                              start_date=self.today - timedelta(days=90),
+                                              end_date=self.today - timedelta(days=88))
+        self.recent = Reservation.objects.create(listing=self.listing, name='Recent Guest',
+                                                 start_date=self.today - timedelta(days=3),
+                                                 end_date=self.today - timedelta(days=1))
+        Reservation.objects.create(listing=self.listing, name='Guest', start_date=self.today,
+                                   end_date=self.today + timedelta(days=2))
+        self.rollup = set(ListingOccupancy.objects.values_list('month', 'booked_nights', 'reservation_count'))
+
+    def test_archive_moves_only_ended_reservations(self):
+        output = io.StringIO()
+        call_command('archive_reservations', '--batch-size', '1', stdout=output)
+
+        self.assertEqual(list(Reservation.objects.order_by('id').values_list('name', flat=True)),
+                         ['Recent Guest', 'Guest'])
+        archived = ArchivedReservation.objects.get()
+        self.assertEqual((archived.id, archived.name, archived.duration), (self.old.id, 'Old Guest', 3))
+        self.assertIn('1 reservations archived', output.getvalue())
+
+        # The rollup keeps counting archived stays, also when it is rebuilt
+        self.assertEqual(set(ListingOccupancy.objects.values_list('month', 'booked_nights', 'reservation_count')),
+                         self.rollup)
+        ListingOccupancy.objects.all().delete()
+        rebuild_occupancy()
+        self.assertEqual(set(ListingOccupancy.objects.values_list('month', 'booked_nights', 'reservation_count')),
+                         self.rollup)
+
+        self.assertEqual(archive_reservations(before=self.today), 1)
+        with self.assertRaises(ValueError):
+            archive_reservations(before=self.today + timedelta(days=1))
+
+    def test_large_batches_delete_in_chunks(self):
+        with mock.patch.object(connection.features, 'max_query_params', 1):
+            self.assertEqual(archive_reservations(before=self.today, batch_size=10), 2)
+        self.assertEqual(Reservation.objects.get().name, 'Guest')
+        self.assertEqual(ArchivedReservation.objects.count(), 2)
+
+    def test_history_is_read_when_asked(self):
+        archive_reservations(before=self.today)
+
+        response = self.client.get(reverse('export-reservations'), {'export_format': 'ndjson'})
+        names = [json.loads(line)['name'] for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(names, ['Guest'])
+        response = self.client.get(reverse('class-export-reservations'), {'export_format': 'ndjson', 'history': 'true'})
+        names = [json.loads(line)['name'] for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(names, ['Old Guest', 'Recent Guest', 'Guest'])
+
+        for url_name in ('overview-reports', 'class-overview-reports'):
+            self.assertEqual(self.client.get(reverse(url_name)).context['listings'][0].reservation_count, 1)
+            response = self.client.get(reverse(url_name), {'history': '1'})
+            self.assertEqual(response.context['listings'][0].reservation_count, 3)
+
+        response = self.client.get(reverse('listing-calendar', args=[self.listing.id]), {
+            'start_date': str(self.today - timedelta(days=3)), 'end_date': str(self.today)})
+        self.assertEqual(response.data['calendar'], 'B4')
+
+
+class SearchListingsTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', password='testpassword')
+        self.beach = Listing.objects.create(owner=self.user, name='Beach House', address='Ocean Drive 1',
+                                            description='Quiet house by the beach with a garden')
+        self.flat = Listing.objects.create(owner=self.user, name='City Flat', address='Main Street 5',
+                                           description='Flat near the beach promenade')
+        self.cabin = Listing.objects.create(owner=self.user, name='Mountain Cabin', address='Forest Road 9',
+                                            description='Wooden cabin')
+        self.today = datetime.now().date()
+
+    def result_ids(self, url_name, params):
+        response = self.client.get(reverse(url_name), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [listing['id'] for listing in response.data['results']]
+
+    def test_search_ranks_matches(self):
+        for url_name in ('listing-search', 'class-listing-search'):
+            self.assertEqual(self.result_ids(url_name, {'q': 'beach'}), [self.beach.id, self.flat.id])
+            # The last word is matched as a prefix, the others need to match fully
+            self.assertEqual(self.result_ids(url_name, {'q': 'wooden cab'}), [self.cabin.id])
+            self.assertEqual(self.result_ids(url_name, {'q': 'houses'}), [self.beach.id])
+            self.assertEqual(self.result_ids(url_name, {'q': 'beach "cabin'}), [])
+
+    def test_search_follows_listing_changes(self):
+        self.cabin.description = 'Wooden cabin near a lake beach'
+        self.cabin.save()
+        self.flat.delete()
+        self.assertEqual(set(self.result_ids('listing-search', {'q': 'beach'})), {self.beach.id, self.cabin.id})
+
+    def test_search_with_availability_in_one_query(self):
+        Reservation.objects.create(listing=self.beach, name='Guest', start_date=self.today,
+                                   end_date=self.today + timedelta(days=3))
+        params = {'q': 'beach', 'start_date': str(self.today + timedelta(days=1)),
+                  'end_date': str(self.today + timedelta(days=2))}
+        # The page count and the page itself
+        with self.assertNumQueries(2):
+            self.assertEqual(self.result_ids('class-listing-search', params), [self.flat.id])
+
+    def test_invalid_search_parameters(self):
+        for params in ({}, {'q': '  "*'}, {'q': 'beach', 'start_date': str(self.today)},
+                       {'q': 'beach', 'start_date': 'today', 'end_date': 'tomorrow'}):
+            response = self.client.get(reverse('listing-search'), params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(ADMIN_PERFORMANCE={'INLINE_PAGE_SIZE': 5, 'INLINE_DAYS': 90})
+class AdminPerformanceTestCase(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username='admin', password='testpassword')
+        self.client.force_login(self.admin)
+        self.today = datetime.now().date()
+        self.listing = self.add_listing('Beach House')
+
+    def add_listing(self, name):
+        owner = User.objects.create_user(username=f'owner {name}', password='testpassword')
+        return Listing.objects.create(owner=owner, name=name, address='Address', description='Description')
+
+    def add_reservations(self, listing, count, first_day=None):
+        first_day = first_day or self.today
+        Reservation.objects.bulk_create([
+            Reservation(listing=listing, name=f'Guest {index}', start_date=first_day + timedelta(days=2 * index),
+                        end_date=first_day + timedelta(days=2 * index)) for index in range(count)])
+
+    def count_queries(self, url, params=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params or {})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(queries)
+
+    def test_changelists_run_a_constant_number_of_queries(self):
+        urls = [reverse('admin:reservation_reservation_changelist'), reverse('admin:reservation_listing_changelist')]
+        self.add_reservations(self.listing, 2)
+        for url in urls:
+            self.client.get(url)
+        baseline = [self.count_queries(url) for url in urls]
+
+        for index in range(10):
+            self.add_reservations(self.add_listing(f'Listing {index}'), 2)
+        self.assertEqual([self.count_queries(url) for url in urls], baseline)
+
+    def test_change_page_shows_one_page_of_recent_reservations(self):
+        url = reverse('admin:reservation_listing_change', args=[self.listing.id])
+        self.add_reservations(self.listing, 1, first_day=self.today - timedelta(days=200))
+        self.add_reservations(self.listing, 3)
+        # The first request also fills the content type cache
+        self.client.get(url)
+        baseline = self.count_queries(url)
+
+        self.add_reservations(self.listing, 9, first_day=self.today + timedelta(days=10))
+        self.assertEqual(self.count_queries(url), baseline)
+
+        response = self.client.get(url)
+        formset = response.context['inline_admin_formsets'][0].formset
+        self.assertEqual([form.instance.name for form in formset.initial_forms],
+                         ['Guest 0', 'Guest 1', 'Guest 2', 'Guest 0', 'Guest 1'])
+        self.assertContains(response, 'Next reservations')
+
+        response = self.client.get(url, {'reservations_page': 3})
+        self.assertEqual(len(response.context['inline_admin_formsets'][0].formset.initial_forms), 2)
+        self.assertNotContains(response, 'Next reservations')
+
+    def test_admin_search(self):
+        self.add_reservations(self.listing, 1)
+        self.add_reservations(self.add_listing('Mountain Cabin'), 1)
+        response = self.client.get(reverse('admin:reservation_listing_changelist'), {'q': 'beac'})
+        self.assertEqual(list(response.context['cl'].result_list), [self.listing])
+        response = self.client.get(reverse('admin:reservation_listing_changelist'), {'q': 'owner Mountain Cabin'})
+        self.assertEqual([listing.name for listing in response.context['cl'].result_list], ['Mountain Cabin'])
+
+        reservation = Reservation.objects.get(listing=self.listing)
+        for term in (str(reservation.id), 'owner Beach House'):
+            response = self.client.get(reverse('admin:reservation_reservation_changelist'), {'q': term})
+            self.assertEqual(list(response.context['cl'].result_list), [reservation])
+        response = self.client.get(reverse('admin:reservation_listing_changelist'), {'q': 'address'})
+        self.assertEqual(len(response.context['cl'].result_list), 2)
+
+        mountain = Reservation.objects.get(listing__name='Mountain Cabin')
+        mountain.name = 'Walker'
+        mountain.save()
+        for term, expected in (('guest', [reservation]), ('walk', [mountain]), ('mountain', [mountain]),
+                               ('alker', [])):
+            response = self.client.get(reverse('admin:reservation_reservation_changelist'), {'q': term})
+            self.assertEqual(list(response.context['cl'].result_list), expected)
+        response = self.client.get(reverse('admin:reservation_reservation_changelist'))
+        self.assertEqual(response.context['cl'].date_hierarchy, 'start_date')
+
+        response = self.client.get(reverse('admin:autocomplete'), {
+            'app_label': 'reservation', 'model_name': 'reservation', 'field_name': 'listing', 'term': 'beach'})
+        self.assertEqual([result['text'] for result in response.json()['results']], ['Beach House'])
+
+
+class ListingCalendarTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='owner', password='testpassword')
+        self.listing_1 = Listing.objects.create(owner=self.user, name='Listing 1', address='Address 1',
+                                                description='Description 1')
+        self.listing_2 = Listing.objects.create(owner=self.user, name='Listing 2', address='Address 2',
+                                                description='Description 2')
+        self.start_date = datetime.now().date() + timedelta(days=10)
+        self.end_date = self.start_date + timedelta(days=9)
+        # Starts before the window, then two touching stays that merge into one run
+        Reservation.objects.create(listing=self.listing_1, name='Guest 1', start_date=self.start_date - timedelta(days=3),
+                                   end_date=self.start_date + timedelta(days=1))
+        Reservation.objects.create(listing=self.listing_1, name='Guest 2', start_date=self.start_date + timedelta(days=5),
+                                   end_date=self.start_date + timedelta(days=6))
+        Reservation.objects.create(listing=self.listing_1, name='Guest 3', start_date=self.start_date + timedelta(days=7),
+                                   end_date=self.start_date + timedelta(days=7))
+
+    def window(self, **params):
+        return {'start_date': str(self.start_date), 'end_date': str(self.end_date), **params}
+
+    def test_listing_calendar(self):
+        for url_name in ('listing-calendar', 'class-listing-calendar'):
+            response = self.client.get(reverse(url_name, args=[self.listing_1.id]), self.window())
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.data['calendar'], 'B2F3B3F2')
+
+            response = self.client.get(reverse(url_name, args=[self.listing_1.id]), self.window(encoding='bitmask'))
+            self.assertEqual(response.data['calendar'], '1100011100')
+
+            response = self.client.get(reverse(url_name, args=[9999]), self.window())
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+            response = self.client.get(reverse(url_name, args=[self.listing_1.id]), self.window(encoding='hex'))
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_listings_calendar_is_one_query_and_cached(self):
+        listings = f'{self.listing_1.id},{self.listing_2.id}'
+        for url_name in ('listings-calendar', 'class-listings-calendar'):
+            cache.clear()
+            with self.assertNumQueries(1):
+                response = self.client.get(reverse(url_name), self.window(listings=listings))
+            self.assertEqual(response.data['calendars'], {str(self.listing_1.id): 'B2F3B3F2',
+                                                          str(self.listing_2.id): 'F10'})
+            with self.assertNumQueries(0):
+                self.client.get(reverse(url_name), self.window(listings=listings))
+
+            response = self.client.get(reverse(url_name), self.window(listings=f'{self.listing_1.id},9999'))
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_booking_invalidates_the_listing_calendar(self):
+        url = reverse('listing-calendar', args=[self.listing_2.id])
+        self.assertEqual(self.client.get(url, self.window()).data['calendar'], 'F10')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('add-reservation'), data={
+                'listing': self.listing_2.id, 'name': 'Guest', 'start_date': str(self.end_date),
+                'end_date': str(self.end_date + timedelta(days=2))}, format='json')
+        self.assertEqual(self.client.get(url, self.window()).data['calendar'], 'F9B1')
+
+    def test_encode_rle(self):
+        self.assertEqual(encode_rle(0b0110, 4), 'F1B2F1')
+        self.assertEqual(encode_rle(0, 0), '')
+
+
+class NextAvailableSlotTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', password='testpassword')
+        self.listing_1 = Listing.objects.create(owner=self.user, name='Listing 1', address='Address 1',
+                                                description='Description 1')
+        self.listing_2 = Listing.objects.create(owner=self.user, name='Listing 2', address='Address 2',
+                                                description='Description 2')
+        self.today = datetime.now().date()
+        # Listing 1 has a 2 night gap on days 4-5 and is free from day 10
+        for start, end in ((0, 3), (6, 9)):
+            Reservation.objects.create(listing=self.listing_1, name='Guest', start_date=self.today + timedelta(days=start),
+                                       end_date=self.today + timedelta(days=end))
+        # Listing 2 is free until day 2
+        Reservation.objects.create(listing=self.listing_2, name='Guest', start_date=self.today + timedelta(days=3),
+                                   end_date=self.today + timedelta(days=20))
+
+    def test_earliest_gap(self):
+        day = self.today
+        intervals = [(day, day + timedelta(days=3)), (day + timedelta(days=6), day + timedelta(days=9))]
+        self.assertEqual(earliest_gap(intervals, day, 2), day + timedelta(days=4))
+        self.assertEqual(earliest_gap(intervals, day, 3), day + timedelta(days=10))
+        self.assertEqual(earliest_gap(intervals, day + timedelta(days=5), 1), day + timedelta(days=5))
+        self.assertEqual(earliest_gap([], day, 30), day)
+
+    def test_next_available_slot_for_one_listing(self):
+        for url_name in ('next-available-slot', 'class-next-available-slot'):
+            response = self.client.get(reverse(url_name), {'nights': 2, 'listing': self.listing_1.id})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.data['results'], [{'listing': self.listing_1.id,
+                                                         'start_date': self.today + timedelta(days=4),
+                                                         'end_date': self.today + timedelta(days=5)}])
+
+            response = self.client.get(reverse(url_name), {'nights': 2, 'listing': 9999})
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+            response = self.client.get(reverse(url_name), {'nights': 0})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_next_available_slot_anywhere_in_one_query(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('next-available-slot'), {'nights': 3})
+        self.assertEqual([(slot['listing'], slot['start_date']) for slot in response.data['results']],
+                         [(self.listing_2.id, self.today), (self.listing_1.id, self.today + timedelta(days=10))])
+
+        response = self.client.get(reverse('class-next-available-slot'), {'nights': 3, 'limit': 1})
+        self.assertEqual(len(response.data['results']), 1)
+
+
+class AvailabilityMatrixTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='owner', password='testpassword')
+        self.listings = [Listing.objects.create(owner=self.user, name=f'Listing {index}', address='Address',
+                                                description='Description') for index in range(12)]
+        self.start_date = datetime.now().date() + timedelta(days=5)
+        self.end_date = self.start_date + timedelta(days=19)
+        Reservation.objects.create(listing=self.listings[0], name='Guest', start_date=self.start_date - timedelta(days=1),
+                                   end_date=self.start_date + timedelta(days=1))
+        Reservation.objects.create(listing=self.listings[0], name='Guest', start_date=self.end_date,
+                                   end_date=self.end_date + timedelta(days=3))
+
+    def booked_nights(self, bitset):
+        mask = int.from_bytes(base64.b64decode(bitset), 'little')
+        return [night for night in range(20) if mask >> night & 1]
+
+    def test_matrix_of_given_listings_in_one_query(self):
+        ids = f'{self.listings[0].id},{self.listings[1].id}'
+        for url_name in ('availability-matrix', 'class-availability-matrix'):
+            cache.clear()
+            with self.assertNumQueries(1):
+                response = self.client.get(reverse(url_name), {'listings': ids, 'start_date': str(self.start_date),
+                                                               'end_date': str(self.end_date)})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.data['nights'], 20)
+            rows = response.data['results']
+            self.assertEqual([row['id'] for row in rows], [self.listings[0].id, self.listings[1].id])
+            self.assertEqual(self.booked_nights(rows[0]['booked']), [0, 1, 19])
+            self.assertEqual(self.booked_nights(rows[1]['booked']), [])
+
+    def test_matrix_of_a_page_of_listings(self):
+        response = self.client.get(reverse('availability-matrix'), {
+            'page': 2, 'start_date': str(self.start_date), 'end_date': str(self.end_date)})
+        self.assertEqual(response.data['count'], 12)
+        self.assertEqual([row['id'] for row in response.data['results']], [self.listings[10].id, self.listings[11].id])
+
+    def test_matrix_window_is_limited(self):
+        response = self.client.get(reverse('class-availability-matrix'), {
+            'start_date': str(self.start_date), 'end_date': str(self.start_date + timedelta(days=90))})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_encode_packed(self):
+        self.assertEqual(base64.b64decode(encode_packed(0b1_0000_0001, 9)), bytes([1, 1]))
+
+
+@override_settings(READ_REPLICAS=['replica'])
+class ReplicaRoutingTestCase(TransactionTestCase):
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        replica_pool.reset()
+        self.client = APIClient()
+        # Nothing replicates in tests, so the two databases hold different listings
+        primary_owner = User.objects.create_user(username='primary', password='testpassword')
+        self.primary_listing = Listing.objects.create(owner=primary_owner, name='Primary', address='Address',
+                                                      description='Description')
+        replica_owner = User.objects.using('replica').create(username='replica')
+        Listing.objects.using('replica').create(owner=replica_owner, name='Replica', address='Address',
+                                                description='Description')
+
+    def tearDown(self):
+        # The router keeps flush off the replica like any other schema operation
+        User.objects.using('replica').all().delete()
+
+    def listing_names(self, url_name='listing-list'):
+        return [listing['name'] for listing in self.client.get(reverse(url_name)).data['results']]
+
+    def test_read_only_views_use_the_replica(self):
+        self.assertEqual(self.listing_names(), ['Replica'])
+        self.assertEqual(self.listing_names('class-listing-list'), ['Replica'])
+        with override_settings(READ_REPLICAS=[]):
+            self.assertEqual(self.listing_names(), ['Primary'])
+
+    def test_reads_after_a_write_stick_to_the_primary(self):
+        response = self.client.post(reverse('add-reservation'), data={
+            'listing': self.primary_listing.id, 'name': 'Guest', 'start_date': str(datetime.now().date()),
+            'end_date': str(datetime.now().date())}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.listing_names(), ['Primary'])
+
+        self.client.cookies.clear()
+        self.assertEqual(self.listing_names(), ['Replica'])
+
+    def test_shared_caches_are_filled_from_the_primary(self):
+        cache.clear()
+        listing_cache.local.clear()
+        availability_index.reset()
+        start_date = datetime.now().date() + timedelta(days=5)
+        Reservation.objects.create(listing=self.primary_listing, name='Guest', start_date=start_date,
+                                   end_date=start_date + timedelta(days=1))
+        dates = {'start_date': str(start_date), 'end_date': str(start_date + timedelta(days=1))}
+
+        response = self.client.get(reverse('class-listing-details', args=[self.primary_listing.id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(cache.get(listing_cache.make_key(self.primary_listing.id)).name, 'Primary')
+
+        with override_settings(AVAILABILITY_ENGINE={'ENABLED': True, 'HORIZON_DAYS': 60},
+                               AVAILABILITY_RESULT_CACHE={'ENABLED': True}):
+            # Only the primary's listing is booked, the replica would call its listing available
+            self.assertEqual(self.listing_names_for(dates), [])
+            self.assertEqual(availability_index.booked_listing_ids(start_date, start_date),
+                             [self.primary_listing.id])
+        availability_index.reset()
+
+    def listing_names_for(self, params):
+        response = self.client.get(reverse('available-listing-list'), params)
+        return [listing['name'] for listing in response.data['results']]
+
+    def test_unhealthy_replicas_are_ejected(self):
+        replica_pool.eject('replica')
+        self.assertEqual(self.listing_names(), ['Primary'])
+
+        replica_pool.reset()
+        with mock.patch.object(connections['replica'], 'ensure_connection', side_effect=OperationalError):
+            self.assertEqual(replica_pool.pick(), 'default')
+        self.assertFalse(replica_pool.is_healthy('replica'))
+
+    def test_round_robin_and_primary_outside_requests(self):
+        with override_settings(READ_REPLICAS=['replica', 'default']):
+            self.assertEqual([replica_pool.pick() for _ in range(3)], ['replica', 'default', 'replica'])
+        self.assertEqual(ReplicaRouter().db_for_read(Listing), 'default')
+
+    def test_one_replica_per_request(self):
+        with override_settings(READ_REPLICAS=['replica', 'default']), \
+                mock.patch.object(replica_pool, 'pick', wraps=replica_pool.pick) as pick:
+            for _ in range(2):
+                response = self.client.get(reverse('listing-list'))
+                # The count and the page come from the same database
+                self.assertEqual(response.data['count'], len(response.data['results']))
+        self.assertEqual(pick.call_count, 2)
+
+    def test_replicas_are_not_migrated(self):
+        self.assertFalse(ReplicaRouter().allow_migrate('replica', 'reservation', 'listing'))
+        self.assertIsNone(ReplicaRouter().allow_migrate('default', 'reservation', 'listing'))
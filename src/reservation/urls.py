@@ -1,21 +1,48 @@
 from django.urls import path
 
 from reservation.views.function_views import (show_all_listings, show_all_available_listings, add_reservation,
-                                              overview_reports, listing_details)
-from .views.class_views import (ShowAllListingsView, ShowAllAvailableListingsView, AddReservationView, OverviewReportsView,
-                                ListingDetailsView)
+                                              add_reservations_bulk, overview_reports, listing_details,
+                                              export_reservations, occupancy_report, listing_calendar,
+                                              listings_calendar, next_available_slot, availability_matrix,
+                                              search_listings)
+from .views import async_views
+from .views.class_views import (ShowAllListingsView, ShowAllAvailableListingsView, AddReservationView,
+                                BulkAddReservationView, OverviewReportsView, ListingDetailsView,
+                                ExportReservationsView, OccupancyReportView, ListingCalendarView,
+                                ListingsCalendarView, NextAvailableSlotView, AvailabilityMatrixView,
+                                SearchListingsView)
 
 urlpatterns = [
     # Function Views
     path('v1/listings/', show_all_listings, name='listing-list'),
     path('v1/available_listings/', show_all_available_listings, name='available-listing-list'),
+    path('v1/search/', search_listings, name='listing-search'),
     path('v1/add_reservation/', add_reservation, name='add-reservation'),
+    path('v1/add_reservations/', add_reservations_bulk, name='bulk-add-reservation'),
     path('v1/reports/', overview_reports, name='overview-reports'),
     path('v1/reports/<int:pk>/', listing_details, name='listing-details'),
+    path('v1/reports/occupancy/', occupancy_report, name='occupancy-report'),
+    path('v1/reports/<int:pk>/calendar/', listing_calendar, name='listing-calendar'),
+    path('v1/calendar/', listings_calendar, name='listings-calendar'),
+    path('v1/next_available/', next_available_slot, name='next-available-slot'),
+    path('v1/availability_matrix/', availability_matrix, name='availability-matrix'),
+    path('v1/exports/reservations/', export_reservations, name='export-reservations'),
     # Class-Base Views
     path('v2/listings/', ShowAllListingsView.as_view(), name='class-listing-list'),
     path('v2/available_listings/', ShowAllAvailableListingsView.as_view(), name='class-available-listing-list'),
+    path('v2/search/', SearchListingsView.as_view(), name='class-listing-search'),
     path('v2/add_reservation/', AddReservationView.as_view(), name='class-add-reservation'),
+    path('v2/add_reservations/', BulkAddReservationView.as_view(), name='class-bulk-add-reservation'),
     path('v2/reports/', OverviewReportsView.as_view(), name='class-overview-reports'),
-    path('v2/reports/', ListingDetailsView.as_view(), name='class-listing-details'),
+    path('v2/reports/<int:pk>/', ListingDetailsView.as_view(), name='class-listing-details'),
+    path('v2/reports/occupancy/', OccupancyReportView.as_view(), name='class-occupancy-report'),
+    path('v2/reports/<int:pk>/calendar/', ListingCalendarView.as_view(), name='class-listing-calendar'),
+    path('v2/calendar/', ListingsCalendarView.as_view(), name='class-listings-calendar'),
+    path('v2/next_available/', NextAvailableSlotView.as_view(), name='class-next-available-slot'),
+    path('v2/availability_matrix/', AvailabilityMatrixView.as_view(), name='class-availability-matrix'),
+    path('v2/exports/reservations/', ExportReservationsView.as_view(), name='class-export-reservations'),
+    # Async Views, served without a worker thread per request under ASGI
+    path('async/listings/', async_views.show_all_listings, name='async-listing-list'),
+    path('async/available_listings/', async_views.show_all_available_listings, name='async-available-listing-list'),
+    path('async/reports/<int:pk>/', async_views.listing_details, name='async-listing-details'),
 ]
@@ -1,42 +1,225 @@
 import logging
+import threading
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+from zlib import crc32
 
 from django.core.paginator import PageNotAnInteger, EmptyPage, Paginator
-from django.db.models import Q
+from django.db import IntegrityError, connection, transaction
+from django.shortcuts import get_object_or_404
+from django.db.models import Count, Exists, IntegerField, OuterRef, Prefetch, Subquery, Value
+from django.db.models.functions import Coalesce
 from datetime import datetime
 
 from rest_framework import status
 from rest_framework.exceptions import ValidationError
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import CursorPagination, PageNumberPagination
 from rest_framework.response import Response
 
-from .models import Listing
-from .serializers import ListingSerializer
+from .availability import availability_engine_settings, availability_index
+from .caching import availability_result_cache, listing_cache, listing_calendar_cache
+from .models import ArchivedReservation, Listing, Reservation
+from .occupancy import add_reservations
+from .serializers import ReservationSerializer, BulkReservationItemSerializer
 
 logger = logging.getLogger(__name__)
 
 def available_listings_in_date_range_query(start_date, end_date):
-    unavailable_listings = Listing.objects.filter(
-        Q(reservations__start_date__lte=start_date, reservations__end_date__gte=start_date) |
-        Q(reservations__start_date__lte=end_date, reservations__end_date__gte=end_date) |
-        Q(reservations__start_date__gte=start_date, reservations__end_date__lte=end_date)
-    )
-    logger.info('Select all reservations between start_date and end_date')
-
-    available_listings = Listing.objects.exclude(id__in=unavailable_listings.values_list('id', flat=True))
-    logger.info('Select all reservations not in unavailable_listings')
+    overlapping_reservations = Reservation.objects.filter(listing=OuterRef('pk')).overlapping(start_date, end_date)
+    logger.info('Select all listings without a reservation overlapping start_date and end_date')
 
+    available_listings = Listing.objects.filter(~Exists(overlapping_reservations))
     return available_listings
 
 
+def search_available_listings_query(start_date, end_date):
+    """
+    Available listings for the search endpoints
+    Served from the in-process availability index when it is enabled and the range
+    lies inside its horizon, otherwise from the SQL anti-join.
+    The booked ids become one query parameter each, so busy ranges with more than
+    MAX_EXCLUDED_LISTINGS of them use the anti-join as well.
+    Booking paths must keep using available_listings_in_date_range_query.
+    """
+    options = availability_engine_settings()
+    if options['ENABLED'] and availability_index.covers(start_date, end_date):
+        booked_listing_ids = availability_index.booked_listing_ids(start_date, end_date)
+        if len(booked_listing_ids) <= options['MAX_EXCLUDED_LISTINGS']:
+            return Listing.objects.exclude(pk__in=booked_listing_ids)
+        logger.info('%s booked listings in range, falling back to the SQL anti-join', len(booked_listing_ids))
+    return available_listings_in_date_range_query(start_date, end_date)
 
-def parse_input_dates(start_date, end_date):
-    if start_date is None or end_date is None:
-        raise ValidationError('Both start_date and end_date are required.')
 
-    start_date = datetime.strptime(start_date, '%Y-%m-%d').date()
-    end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
+def get_listing_or_404(pk):
+    # The owner is loaded with the listing so a cached Listing never needs another query
+    return get_object_or_404(Listing.objects.select_related('owner'), pk=pk)
+
+
+REPORT_RESERVATIONS_PER_LISTING = 10
+
+
+def listings_report_query(history=False):
+    """
+    Listings for the overview report, built in a constant number of queries per page
+    reservation_count is annotated and top_reservations is prefetched with a sliced
+    queryset, which Django turns into a ROW_NUMBER() window per listing.
+    With history, reservation_count also counts the archived reservations.
+    """
+    top_reservations = Reservation.objects.order_by('id')[:REPORT_RESERVATIONS_PER_LISTING]
+    reservation_count = Count('reservations')
+    if history:
+        archived_count = (ArchivedReservation.objects.filter(listing=OuterRef('pk')).order_by()
+                          .values('listing').annotate(count=Count('pk')).values('count'))
+        reservation_count += Coalesce(Subquery(archived_count, output_field=IntegerField()), Value(0))
+    return (Listing.objects.defer('description')
+            .annotate(reservation_count=reservation_count)
+            .prefetch_related(Prefetch('reservations', queryset=top_reservations, to_attr='top_reservations'))
+            .order_by('id'))
+
+
+class ListingNotAvailable(Exception):
+    pass
+
+
+# SQLite has no row locks, there a striped in-process lock per listing stands in for SELECT ... FOR UPDATE.
+# Reentrant, so a caller can hold them across an outer transaction around bulk_save_reservations.
+_listing_lock_stripes = [threading.RLock() for _ in range(64)]
+
+
+def _listing_process_lock(listing_id):
+    return _listing_lock_stripes[crc32(str(listing_id).encode()) % len(_listing_lock_stripes)]
+
+
+def _listing_process_locks(listing_ids):
+    # Always acquired in stripe order so that two batches can't deadlock each other
+    stripes = {crc32(str(listing_id).encode()) % len(_listing_lock_stripes) for listing_id in listing_ids}
+    return [_listing_lock_stripes[stripe] for stripe in sorted(stripes)]
+
+
+@contextmanager
+def listing_locks(listing_ids):
+    """
+    Hold the in-process locks of listing_ids on backends without SELECT ... FOR UPDATE, a no-op elsewhere
+    """
+    with ExitStack() as stack:
+        if not connection.features.has_select_for_update:
+            for lock in _listing_process_locks(listing_ids):
+                stack.enter_context(lock)
+        yield
+
+
+def save_reservation_with_listing_lock(serializer):
+    """
+    Check availability and insert the reservation while holding a lock on its listing only
+    Bookings on different listings run in parallel, two overlapping bookings on the
+    same listing are serialized and the second one raises ListingNotAvailable.
+    On Postgres the exclusion constraint on (listing_id, daterange) is the last line of defence.
+    """
+    listing = serializer.validated_data['listing']
+    start_date = serializer.validated_data['start_date']
+    end_date = serializer.validated_data['end_date']
+
+    if connection.features.has_select_for_update:
+        return _save_reservation_locked(serializer, listing, start_date, end_date)
+    with _listing_process_lock(listing.pk):
+        return _save_reservation_locked(serializer, listing, start_date, end_date)
+
+
+def _save_reservation_locked(serializer, listing, start_date, end_date):
+    try:
+        with transaction.atomic():
+            Listing.objects.select_for_update().filter(pk=listing.pk).values_list('pk', flat=True).get()
+            if Reservation.objects.filter(listing=listing).overlapping(start_date, end_date).exists():
+                raise ListingNotAvailable()
+            return serializer.save()
+    except IntegrityError:
+        logger.info('Listing id: %s, Reservation rejected by overlap constraint.', listing.pk)
+        raise ListingNotAvailable()
+
 
-    if start_date < datetime.today().date() or end_date < datetime.today().date():
+BULK_RESERVATION_MAX_ITEMS = 1000
+
+
+def bulk_save_reservations(payloads):
+    """
+    Validate and insert a batch of reservation payloads with a constant number of queries
+    All listings of the batch are locked with one SELECT ... FOR UPDATE, conflicts against
+    stored reservations are fetched with one range query, conflicts inside the batch are
+    resolved in payload order and the accepted rows are inserted with one bulk_create.
+    Returns one result dict per payload, in payload order.
+    """
+    results = [None] * len(payloads)
+    candidates = []
+    for index, payload in enumerate(payloads):
+        item = BulkReservationItemSerializer(data=payload)
+        if not item.is_valid():
+            results[index] = {'index': index, 'status': status.HTTP_400_BAD_REQUEST, 'errors': item.errors}
+            continue
+        data = item.validated_data
+        try:
+            validate_date_range(data['start_date'], data['end_date'])
+        except ValidationError as e:
+            results[index] = {'index': index, 'status': status.HTTP_400_BAD_REQUEST, 'errors': {'error': e.detail}}
+            continue
+        candidates.append((index, data))
+
+    listing_ids = sorted({data['listing'] for _, data in candidates})
+    with listing_locks(listing_ids):
+        with transaction.atomic():
+            existing_listing_ids = set(Listing.objects.select_for_update().filter(pk__in=listing_ids)
+                                       .order_by('pk').values_list('pk', flat=True))
+            booked = defaultdict(list)
+            if candidates and existing_listing_ids:
+                min_start_date = min(data['start_date'] for _, data in candidates)
+                max_end_date = max(data['end_date'] for _, data in candidates)
+                stored = (Reservation.objects.filter(listing_id__in=existing_listing_ids)
+                          .overlapping(min_start_date, max_end_date)
+                          .values_list('listing_id', 'start_date', 'end_date'))
+                for listing_id, start_date, end_date in stored:
+                    booked[listing_id].append((start_date, end_date))
+
+            accepted = []
+            for index, data in candidates:
+                listing_id, start_date, end_date = data['listing'], data['start_date'], data['end_date']
+                if listing_id not in existing_listing_ids:
+                    results[index] = {'index': index, 'status': status.HTTP_404_NOT_FOUND,
+                                      'errors': {'detail': 'Not found.'}}
+                elif any(booked_start <= end_date and booked_end >= start_date
+                         for booked_start, booked_end in booked[listing_id]):
+                    results[index] = {'index': index, 'status': status.HTTP_404_NOT_FOUND,
+                                      'errors': {'error': f'Listing not available for reservation until {end_date}.'}}
+                else:
+                    booked[listing_id].append((start_date, end_date))
+                    accepted.append((index, Reservation(listing_id=listing_id, name=data['name'],
+                                                        start_date=start_date, end_date=end_date)))
+
+            Reservation.objects.bulk_create([reservation for _, reservation in accepted])
+            add_reservations([(reservation.listing_id, reservation.start_date, reservation.end_date)
+                              for _, reservation in accepted])
+
+            def after_commit():
+                # bulk_create sends no post_save, so the availability index and caches are updated here
+                for _, reservation in accepted:
+                    availability_index.add_reservation(reservation.listing_id, reservation.start_date,
+                                                       reservation.end_date)
+                accepted_listing_ids = {reservation.listing_id for _, reservation in accepted}
+                for listing_id in accepted_listing_ids:
+                    listing_cache.invalidate(listing_id)
+                listing_calendar_cache.invalidate(accepted_listing_ids)
+                for _, reservation in accepted:
+                    availability_result_cache.invalidate_range(reservation.start_date, reservation.end_date)
+
+            transaction.on_commit(after_commit)
+
+    for index, reservation in accepted:
+        results[index] = {'index': index, 'status': status.HTTP_201_CREATED,
+                          'reservation': ReservationSerializer(reservation).data}
+    logger.info('Bulk reservation: %s of %s reservations added.', len(accepted), len(payloads))
+    return results
+
+
+def validate_date_range(start_date, end_date, allow_past=False):
+    if not allow_past and (start_date < datetime.today().date() or end_date < datetime.today().date()):
         raise ValidationError('The selected day must not be a past date.')
 
     if start_date > end_date:
@@ -44,15 +227,57 @@ def parse_input_dates(start_date, end_date):
     return start_date, end_date
 
 
-def listing_serializers_paginate_response(request, queryset):
-    paginator = PageNumberPagination()
+def parse_input_dates(start_date, end_date, allow_past=False):
+    if start_date is None or end_date is None:
+        raise ValidationError('Both start_date and end_date are required.')
+
+    start_date = datetime.strptime(start_date, '%Y-%m-%d').date()
+    end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
+    return validate_date_range(start_date, end_date, allow_past=allow_past)
+
+
+class ListingCursorPagination(CursorPagination):
+    """
+    Keyset pagination on the listing id, no COUNT(*) and no OFFSET scan,
+    so every page costs the same and concurrent inserts never shift a page
+    """
+    ordering = 'id'
+
+
+def is_cursor_pagination_requested(request):
+    return request.query_params.get('pagination') == 'cursor' or 'cursor' in request.query_params
+
+
+LISTING_FAST_FIELDS = ('id', 'name', 'address', 'description', 'owner_id', 'owner__username')
+
+
+def listing_fast_representation(rows):
+    """
+    Read-only equivalent of ListingSerializer(many=True).data built from values() rows
+    Keys and their order match ListingSerializer so the rendered JSON is identical
+    """
+    return [
+        {
+            'id': row['id'],
+            'name': row['name'],
+            'address': row['address'],
+            'description': row['description'],
+            'owner': {'id': row['owner_id'], 'username': row['owner__username']},
+        }
+        for row in rows
+    ]
+
+
+def listing_serializers_paginate_response(request, queryset, allow_cursor=True):
+    # Cursor pages follow id order, querysets ordered otherwise (search relevance) are paged by number
+    use_cursor = allow_cursor and is_cursor_pagination_requested(request)
+    paginator = ListingCursorPagination() if use_cursor else PageNumberPagination()
     try:
-        paginated_listings = paginator.paginate_queryset(queryset, request)
+        paginated_listings = paginator.paginate_queryset(queryset.values(*LISTING_FAST_FIELDS), request)
     except Exception as e:
-        logger.info(f' Page Number is Invalid. {str(e)}')
+        logger.info('Page Number is Invalid. %s', e)
         return Response({'error': 'Invalid page number.'}, status=status.HTTP_400_BAD_REQUEST)
-    serializer = ListingSerializer(paginated_listings, many=True)
-    return paginator.get_paginated_response(serializer.data)
+    return paginator.get_paginated_response(listing_fast_representation(paginated_listings))
 
 
 def listing_paginated_items(request, queryset):
@@ -0,0 +1,153 @@
+import logging
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import Http404, HttpResponse, HttpResponseNotAllowed
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+from reservation.caching import listing_cache
+from reservation.models import Listing, Reservation
+from reservation.renderers import FastJSONRenderer
+from reservation.utils import (parse_input_dates, search_available_listings_query, LISTING_FAST_FIELDS,
+                               listing_fast_representation)
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = settings.REST_FRAMEWORK['PAGE_SIZE']
+# The v2 class views answer HEAD like GET as well
+READ_METHODS = ['GET', 'HEAD']
+
+
+def json_response(data, status_code=status.HTTP_200_OK):
+    return HttpResponse(FastJSONRenderer().render(data), status=status_code, content_type='application/json')
+
+
+def get_page_number(request):
+    page = int(request.GET.get('page', 1))
+    if page < 1:
+        raise ValueError(page)
+    return page
+
+
+class InvalidPage(Exception):
+    pass
+
+
+async def paginated_data(request, queryset, represent):
+    """
+    Page number pagination with the same response shape as PageNumberPagination,
+    counted and fetched with the async ORM
+    """
+    try:
+        page = get_page_number(request)
+    except ValueError:
+        raise InvalidPage()
+
+    count = await queryset.acount()
+    offset = (page - 1) * PAGE_SIZE
+    if page > 1 and offset >= count:
+        raise InvalidPage()
+
+    rows = [row async for row in queryset[offset:offset + PAGE_SIZE].aiterator()]
+
+    url = request.build_absolute_uri()
+    next_url = replace_query_param(url, 'page', page + 1) if offset + PAGE_SIZE < count else None
+    if page == 1:
+        previous_url = None
+    elif page == 2:
+        previous_url = remove_query_param(url, 'page')
+    else:
+        previous_url = replace_query_param(url, 'page', page - 1)
+
+    return {'count': count, 'next': next_url, 'previous': previous_url, 'results': represent(rows)}
+
+
+async def paginated_response(request, queryset, represent):
+    try:
+        return json_response(await paginated_data(request, queryset, represent))
+    except InvalidPage:
+        return json_response({'error': 'Invalid page number.'}, status.HTTP_400_BAD_REQUEST)
+
+
+async def show_all_listings(request):
+    """
+    Show All Listings List
+    """
+    if request.method not in READ_METHODS:
+        return HttpResponseNotAllowed(READ_METHODS)
+
+    listings = Listing.objects.order_by('id').values(*LISTING_FAST_FIELDS)
+    return await paginated_response(request, listings, listing_fast_representation)
+
+
+async def show_all_available_listings(request):
+    """
+    Show Available Listings Between Two Ranges of Date
+    start_date and end_date sets as a query parameters
+    """
+    if request.method not in READ_METHODS:
+        return HttpResponseNotAllowed(READ_METHODS)
+
+    try:
+        start_date, end_date = parse_input_dates(request.GET.get('start_date'), request.GET.get('end_date'))
+    except ValidationError as e:
+        return json_response({"error": e.detail}, status.HTTP_400_BAD_REQUEST)
+    except Exception:
+        return json_response({"error": "Invalid date range"}, status.HTTP_400_BAD_REQUEST)
+
+    # Building the queryset may read the in-process availability index, which loads from the database
+    listings = await sync_to_async(search_available_listings_query)(start_date, end_date)
+    listings = listings.order_by('id').values(*LISTING_FAST_FIELDS)
+    response = await paginated_response(request, listings, listing_fast_representation)
+    logger.info('async show_all_available_listings executed successfully')
+    return response
+
+
+def reservation_representation(reservations):
+    return [
+        {
+            'name': reservation['name'],
+            'start_date': reservation['start_date'],
+            'end_date': reservation['end_date'],
+            'duration': (reservation['end_date'] - reservation['start_date']).days + 1,
+        }
+        for reservation in reservations
+    ]
+
+
+async def listing_details(request, pk):
+    """
+    Listing with its paginated reservations, as JSON
+    """
+    if request.method not in READ_METHODS:
+        return HttpResponseNotAllowed(READ_METHODS)
+
+    async def load_listing():
+        try:
+            return await Listing.objects.select_related('owner').aget(pk=pk)
+        except Listing.DoesNotExist:
+            raise Http404('No Listing matches the given query.')
+
+    try:
+        listing = await listing_cache.aget_or_load(pk, load_listing)
+    except Http404 as e:
+        return json_response({'detail': str(e)}, status.HTTP_404_NOT_FOUND)
+
+    if not Listing.owner.is_cached(listing):
+        listing = await Listing.objects.select_related('owner').aget(pk=pk)
+
+    reservations = (Reservation.objects.filter(listing_id=pk).order_by('id')
+                    .values('name', 'start_date', 'end_date'))
+    try:
+        reservations_page = await paginated_data(request, reservations, reservation_representation)
+    except InvalidPage:
+        return json_response({'error': 'Invalid page number.'}, status.HTTP_400_BAD_REQUEST)
+
+    owner = listing.owner
+    listing_data = listing_fast_representation([{
+        'id': listing.id, 'name': listing.name, 'address': listing.address, 'description': listing.description,
+        'owner_id': owner.id, 'owner__username': owner.username,
+    }])[0]
+    logger.info('Listing: %s, async details fetch successfully.', pk)
+    return json_response({'listing': listing_data, 'reservations': reservations_page})
@@ -1,14 +1,24 @@
 import logging
-from django.core.cache import cache
 from django.shortcuts import render
 from rest_framework import status
 from rest_framework.exceptions import ValidationError
 from rest_framework.generics import ListAPIView, CreateAPIView, get_object_or_404
 from rest_framework.response import Response
+from reservation.archive import is_history_requested
+from reservation.caching import availability_result_cache, listing_cache
+from reservation.calendars import (listing_calendars, parse_calendar_window, parse_listing_ids,
+                                   availability_matrix_response)
+from reservation.exports import EXPORT_FORMATS, parse_export_filters, reservation_export_response
+from reservation.ingestion import book_reservation
 from reservation.models import Listing
+from reservation.occupancy import occupancy_report_context, occupancy_report_query, parse_report_month
+from reservation.search import listing_search_query, parse_search_request
 from reservation.serializers import ReservationSerializer, ListingSerializer
-from reservation.utils import (parse_input_dates, available_listings_in_date_range_query,
-                               listing_serializers_paginate_response, listing_paginated_items)
+from reservation.slots import next_available_slots, parse_slot_request
+from reservation.utils import (parse_input_dates, ListingNotAvailable,
+                               bulk_save_reservations, BULK_RESERVATION_MAX_ITEMS,
+                               listing_serializers_paginate_response, listing_paginated_items,
+                               listings_report_query, get_listing_or_404, search_available_listings_query)
 
 logger = logging.getLogger(__name__)
 
@@ -31,19 +41,28 @@ class ShowAllAvailableListingsView(ListAPIView):
     """
     serializer_class = ListingSerializer
 
+    def get_date_range(self):
+        return parse_input_dates(self.request.query_params.get('start_date'),
+                                 self.request.query_params.get('end_date'))
+
     def get_queryset(self):
         try:
-            start_date, end_date = parse_input_dates(self.request.query_params.get('start_date'),
-                                                     self.request.query_params.get('end_date'))
+            start_date, end_date = self.get_date_range()
         except ValidationError as e:
             return Response({"error": e.detail}, status=status.HTTP_400_BAD_REQUEST)
         except Exception:
             return Response({"error": "Invalid date range"}, status=status.HTTP_400_BAD_REQUEST)
 
-        return available_listings_in_date_range_query(start_date, end_date)
+        return search_available_listings_query(start_date, end_date)
 
     def list(self, request, *args, **kwargs):
-        response = listing_serializers_paginate_response(request, self.get_queryset())
+        queryset = self.get_queryset()
+        if isinstance(queryset, Response):
+            return queryset
+
+        start_date, end_date = self.get_date_range()
+        response = availability_result_cache.get_or_compute(
+            request, start_date, end_date, lambda: listing_serializers_paginate_response(request, queryset))
         logger.info('ShowAllAvailableListingsView executed successfully')
         return response
 
@@ -68,25 +87,46 @@ class AddReservationView(CreateAPIView):
         except Exception:
             return Response({"error": "Invalid date range"}, status=status.HTTP_400_BAD_REQUEST)
 
-        available_listings = available_listings_in_date_range_query(start_date, end_date)
-        if listing.id not in available_listings.values_list('id', flat=True):
+        serializer = self.get_serializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            reservation = book_reservation(serializer)
+        except ListingNotAvailable:
             logger.info('Failed to Reservation')
             return Response({'error': f'Listing not available for reservation until {end_date}.'},
                             status=status.HTTP_404_NOT_FOUND)
 
-        serializer = self.get_serializer(data=request.data)
-        if serializer.is_valid():
-            serializer.save()
-            cache.delete(listing_id)
-            logger.info('Reserved successfully')
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-        else:
-            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        logger.info('Reserved successfully')
+        return Response(reservation, status=status.HTTP_201_CREATED)
+
+class BulkAddReservationView(CreateAPIView):
+    """
+    Add a batch of listing reservations
+    Request body is a list of add reservation payloads, every item gets its own status in the response
+    """
+    serializer_class = ReservationSerializer
+
+    def create(self, request, *args, **kwargs):
+        payloads = request.data
+        if not isinstance(payloads, list) or not payloads:
+            return Response({'error': 'A non-empty list of reservations is required.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if len(payloads) > BULK_RESERVATION_MAX_ITEMS:
+            return Response({'error': f'At most {BULK_RESERVATION_MAX_ITEMS} reservations per request.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        results = bulk_save_reservations(payloads)
+        logger.info('BulkAddReservationView executed successfully')
+        return Response({'results': results}, status=status.HTTP_200_OK)
 
 class OverviewReportsView(ListAPIView):
-    queryset = Listing.objects.all()
     serializer_class = ListingSerializer
 
+    def get_queryset(self):
+        return listings_report_query(history=is_history_requested(self.request))
+
     def list(self, request, *args, **kwargs):
         paginated_listings = listing_paginated_items(request, self.get_queryset())
         logger.info('OverviewReportsView executed successfully')
@@ -97,13 +137,7 @@ class ListingDetailsView(ListAPIView):
 
     def get(self, request, *args, **kwargs):
         pk = self.kwargs.get('pk')
-        if cache.get(pk):
-            listing = cache.get(pk)
-            logger.info('Load data from cache')
-        else:
-            listing = get_object_or_404(Listing, pk=pk)
-            cache.set(pk, listing)
-            logger.info('Load data from db')
+        listing = listing_cache.get_or_load(pk, lambda: get_listing_or_404(pk))
 
         reservations = listing.reservations.all()
         paginated_reservations = listing_paginated_items(request, reservations)
@@ -115,3 +149,147 @@ class ListingDetailsView(ListAPIView):
 
         logger.info('ListingDetailsView executed successfully')
         return render(request, 'pages/listing_details.html', context)
+
+class OccupancyReportView(ListAPIView):
+    """
+    Booked nights, reservations and occupancy rate per listing for one month
+    Read from the occupancy rollup only, month (YYYY-MM) is a query parameter
+    """
+    serializer_class = ListingSerializer
+
+    def list(self, request, *args, **kwargs):
+        try:
+            month = parse_report_month(request.query_params.get('month'))
+        except ValidationError as e:
+            return Response({"error": e.detail}, status=status.HTTP_400_BAD_REQUEST)
+
+        rows = listing_paginated_items(request, occupancy_report_query(month))
+        logger.info('OccupancyReportView executed successfully')
+        return render(request, 'pages/occupancy_report.html', occupancy_report_context(month, rows))
+
+class ExportReservationsView(ListAPIView):
+    """
+    Stream all reservations as CSV or NDJSON
+    listing, start_date and end_date filters, export_format (csv or ndjson) and history are query parameters
+    """
+    serializer_class = ReservationSerializer
+
+    def get(self, request, *args, **kwargs):
+        export_format = request.query_params.get('export_format', 'csv')
+        if export_format not in EXPORT_FORMATS:
+            return Response({'error': f'export_format must be one of {", ".join(EXPORT_FORMATS)}.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            filters = parse_export_filters(request.query_params.get('listing'),
+                                           request.query_params.get('start_date'),
+                                           request.query_params.get('end_date'))
+        except ValidationError as e:
+            return Response({"error": e.detail}, status=status.HTTP_400_BAD_REQUEST)
+
+        logger.info('ExportReservationsView exporting as %s', export_format)
+        return reservation_export_response(export_format, filters, history=is_history_requested(request))
+
+class ListingCalendarView(ListAPIView):
+    """
+    Booked and free nights of a listing between start_date and end_date
+    encoding is rle (F3B5F22, the default) or bitmask (1 for a booked night)
+    """
+    serializer_class = ListingSerializer
+
+    def get_window(self):
+        return parse_calendar_window(self.request.query_params.get('start_date'),
+                                     self.request.query_params.get('end_date'),
+                                     self.request.query_params.get('encoding'))
+
+    def get(self, request, *args, **kwargs):
+        pk = self.kwargs.get('pk')
+        try:
+            start_date, end_date, encoding = self.get_window()
+        except ValidationError as e:
+            return Response({"error": e.detail}, status=status.HTTP_400_BAD_REQUEST)
+
+        calendars = listing_calendars([pk], start_date, end_date, encoding)
+        if pk not in calendars:
+            return Response({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+        logger.info('ListingCalendarView executed successfully')
+        return Response({'listing': pk, 'start_date': start_date, 'end_date': end_date, 'encoding': encoding,
+                         'calendar': calendars[pk]})
+
+class ListingsCalendarView(ListingCalendarView):
+    """
+    Calendars of several listings, listings is a comma separated list of ids
+    """
+
+    def get(self, request, *args, **kwargs):
+        try:
+            listing_ids = parse_listing_ids(request.query_params.get('listings'))
+            start_date, end_date, encoding = self.get_window()
+        except ValidationError as e:
+            return Response({"error": e.detail}, status=status.HTTP_400_BAD_REQUEST)
+
+        calendars = listing_calendars(listing_ids, start_date, end_date, encoding)
+        missing = [listing_id for listing_id in listing_ids if listing_id not in calendars]
+        if missing:
+            return Response({'error': f'Listings not found: {", ".join(map(str, missing))}.'},
+                            status=status.HTTP_404_NOT_FOUND)
+        logger.info('ListingsCalendarView executed successfully')
+        return Response({'start_date': start_date, 'end_date': end_date, 'encoding': encoding,
+                         'calendars': {str(listing_id): calendar for listing_id, calendar in calendars.items()}})
+
+class NextAvailableSlotView(ListAPIView):
+    """
+    Earliest free stay of the given number of nights
+    For one listing when listing is set, otherwise for the limit listings that are free soonest
+    """
+    serializer_class = ListingSerializer
+
+    def get(self, request, *args, **kwargs):
+        try:
+            nights, earliest, limit = parse_slot_request(request.query_params.get('nights'),
+                                                         request.query_params.get('earliest'),
+                                                         request.query_params.get('limit'))
+            listing_id = request.query_params.get('listing')
+            listing_id = int(listing_id) if listing_id else None
+        except ValidationError as e:
+            return Response({"error": e.detail}, status=status.HTTP_400_BAD_REQUEST)
+        except ValueError:
+            return Response({"error": "listing must be an integer."}, status=status.HTTP_400_BAD_REQUEST)
+
+        slots = next_available_slots(nights, earliest, listing_id, limit)
+        if listing_id is not None and not slots:
+            return Response({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+        logger.info('NextAvailableSlotView executed successfully')
+        return Response({'nights': nights, 'earliest': earliest, 'results': slots})
+
+class AvailabilityMatrixView(ListAPIView):
+    """
+    Listings x nights availability grid between start_date and end_date (at most 90 nights)
+    Every listing gets a base64 little-endian bitset, bit i is set when night i is booked
+    """
+    serializer_class = ListingSerializer
+
+    def get(self, request, *args, **kwargs):
+        response = availability_matrix_response(request)
+        logger.info('AvailabilityMatrixView executed successfully')
+        return response
+
+class SearchListingsView(ListAPIView):
+    """
+    Full-text search over listing name, address and description, most relevant first
+    q holds the words, start_date and end_date optionally keep only the listings free in that range
+    """
+    serializer_class = ListingSerializer
+
+    def list(self, request, *args, **kwargs):
+        try:
+            terms, start_date, end_date = parse_search_request(request.query_params.get('q'),
+                                                               request.query_params.get('start_date'),
+                                                               request.query_params.get('end_date'))
+        except ValidationError as e:
+            return Response({"error": e.detail}, status=status.HTTP_400_BAD_REQUEST)
+
+        response = listing_serializers_paginate_response(request, listing_search_query(terms, start_date, end_date),
+                                                         allow_cursor=False)
+        logger.info('SearchListingsView executed successfully')
+        return response
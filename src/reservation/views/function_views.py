@@ -1,6 +1,5 @@
 import logging
 
-from django.core.cache import cache
 from django.shortcuts import render
 from drf_yasg.utils import swagger_auto_schema
 from rest_framework import status
@@ -9,11 +8,26 @@ from rest_framework.exceptions import ValidationError
 from rest_framework.generics import get_object_or_404
 from rest_framework.renderers import TemplateHTMLRenderer
 from rest_framework.response import Response
+from reservation.archive import is_history_requested
+from reservation.caching import availability_result_cache, listing_cache
+from reservation.calendars import (listing_calendars, parse_calendar_window, parse_listing_ids,
+                                   availability_matrix_response)
+from reservation.exports import EXPORT_FORMATS, parse_export_filters, reservation_export_response
+from reservation.ingestion import book_reservation
 from reservation.models import Listing
+from reservation.occupancy import occupancy_report_context, occupancy_report_query, parse_report_month
+from reservation.search import listing_search_query, parse_search_request
 from reservation.serializers import ReservationSerializer
-from reservation.swagger_decorators import available_listings_swagger_decorator, add_reservation_swagger_decorator
-from reservation.utils import (parse_input_dates, available_listings_in_date_range_query,
-                               listing_serializers_paginate_response, listing_paginated_items)
+from reservation.slots import next_available_slots, parse_slot_request
+from reservation.swagger_decorators import (available_listings_swagger_decorator, add_reservation_swagger_decorator,
+                                           bulk_add_reservation_swagger_decorator, export_reservations_swagger_decorator,
+                                           listing_calendar_swagger_decorator, listings_calendar_swagger_decorator,
+                                           next_available_slot_swagger_decorator, availability_matrix_swagger_decorator,
+                                           search_listings_swagger_decorator)
+from reservation.utils import (parse_input_dates, ListingNotAvailable,
+                               bulk_save_reservations, BULK_RESERVATION_MAX_ITEMS,
+                               listing_serializers_paginate_response, listing_paginated_items,
+                               listings_report_query, get_listing_or_404, search_available_listings_query)
 
 logger = logging.getLogger(__name__)
 
@@ -42,8 +56,9 @@ def show_all_available_listings(request):
     except Exception:
         return Response({"error": "Invalid date range"}, status=status.HTTP_400_BAD_REQUEST)
 
-    listings_queries = available_listings_in_date_range_query(start_date, end_date)
-    response = listing_serializers_paginate_response(request, listings_queries)
+    response = availability_result_cache.get_or_compute(
+        request, start_date, end_date,
+        lambda: listing_serializers_paginate_response(request, search_available_listings_query(start_date, end_date)))
     logger.info('show_all_available_listings executed successfully')
     return response
 
@@ -68,25 +83,42 @@ def add_reservation(request):
     except Exception:
         return Response({"error": "Invalid date range"}, status=status.HTTP_400_BAD_REQUEST)
 
-    available_listings = available_listings_in_date_range_query(start_date, end_date)
-    if not listing.id in available_listings.values_list('id', flat=True):
+    serializer = ReservationSerializer(data=request.data)
+    if not serializer.is_valid():
+        logger.info('Listing id: %s, Failed to add new reservation.', listing_id)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        reservation = book_reservation(serializer)
+    except ListingNotAvailable:
         return Response({'error': f'Listing not available for reservation until {end_date}.'},
                         status=status.HTTP_404_NOT_FOUND)
 
-    serializer = ReservationSerializer(data=request.data)
-    if serializer.is_valid():
-        instance = serializer.save()
-        cache.delete(listing_id)
-        logger.info(f'Listing id: {listing_id}, Added new reservation.')
-
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
-    else:
-        logger.info(f'Listing id: {listing_id}, Failed to add new reservation.')
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    logger.info('Listing id: %s, Added new reservation.', listing_id)
+    return Response(reservation, status=status.HTTP_201_CREATED)
+
+
+@bulk_add_reservation_swagger_decorator
+@api_view(['POST'])
+def add_reservations_bulk(request):
+    """
+    Add a batch of listing reservations
+    Request body is a list of add_reservation payloads, every item gets its own status in the response
+    """
+    payloads = request.data
+    if not isinstance(payloads, list) or not payloads:
+        return Response({'error': 'A non-empty list of reservations is required.'},
+                        status=status.HTTP_400_BAD_REQUEST)
+    if len(payloads) > BULK_RESERVATION_MAX_ITEMS:
+        return Response({'error': f'At most {BULK_RESERVATION_MAX_ITEMS} reservations per request.'},
+                        status=status.HTTP_400_BAD_REQUEST)
+
+    results = bulk_save_reservations(payloads)
+    return Response({'results': results}, status=status.HTTP_200_OK)
 
 @api_view(['GET'])
 def overview_reports(request):
-    listings = Listing.objects.all()
+    listings = listings_report_query(history=is_history_requested(request))
     paginated_listings = listing_paginated_items(request, listings)
     logger.info('Report fetch successfully.')
     return render(request, 'pages/listings_report.html', {"listings": paginated_listings})
@@ -94,11 +126,7 @@ def overview_reports(request):
 
 @api_view(['GET'])
 def listing_details(request, pk):
-    if cache.get(pk):
-        listing = cache.get(pk)
-    else:
-        listing = get_object_or_404(Listing, pk=pk)
-        cache.set(pk, listing)
+    listing = listing_cache.get_or_load(pk, lambda: get_listing_or_404(pk))
 
     reservations = listing.reservations.all()
     paginated_reservations = listing_paginated_items(request, reservations)
@@ -108,5 +136,144 @@ def listing_details(request, pk):
         'reservations_page': paginated_reservations,
     }
 
-    logger.info(f'Listing: {pk}, Report fetch successfully.')
+    logger.info('Listing: %s, Report fetch successfully.', pk)
     return render(request, 'pages/listing_details.html', context)
+
+
+@api_view(['GET'])
+def occupancy_report(request):
+    """
+    Booked nights, reservations and occupancy rate per listing for one month
+    Read from the occupancy rollup only, month (YYYY-MM) is a query parameter
+    """
+    try:
+        month = parse_report_month(request.query_params.get('month'))
+    except ValidationError as e:
+        return Response({"error": e.detail}, status=status.HTTP_400_BAD_REQUEST)
+
+    rows = listing_paginated_items(request, occupancy_report_query(month))
+    logger.info('Occupancy report for %s fetch successfully.', month)
+    return render(request, 'pages/occupancy_report.html', occupancy_report_context(month, rows))
+
+
+@export_reservations_swagger_decorator
+@api_view(['GET'])
+def export_reservations(request):
+    """
+    Stream all reservations as CSV or NDJSON
+    listing, start_date and end_date filters, export_format (csv or ndjson) and history are query parameters
+    """
+    export_format = request.query_params.get('export_format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return Response({'error': f'export_format must be one of {", ".join(EXPORT_FORMATS)}.'},
+                        status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        filters = parse_export_filters(request.query_params.get('listing'), request.query_params.get('start_date'),
+                                       request.query_params.get('end_date'))
+    except ValidationError as e:
+        return Response({"error": e.detail}, status=status.HTTP_400_BAD_REQUEST)
+
+    logger.info('Exporting reservations as %s.', export_format)
+    return reservation_export_response(export_format, filters, history=is_history_requested(request))
+
+
+@listing_calendar_swagger_decorator
+@api_view(['GET'])
+def listing_calendar(request, pk):
+    """
+    Booked and free nights of a listing between start_date and end_date
+    encoding is rle (F3B5F22, the default) or bitmask (1 for a booked night)
+    """
+    try:
+        start_date, end_date, encoding = parse_calendar_window(request.query_params.get('start_date'),
+                                                               request.query_params.get('end_date'),
+                                                               request.query_params.get('encoding'))
+    except ValidationError as e:
+        return Response({"error": e.detail}, status=status.HTTP_400_BAD_REQUEST)
+
+    calendars = listing_calendars([pk], start_date, end_date, encoding)
+    if pk not in calendars:
+        return Response({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+    return Response({'listing': pk, 'start_date': start_date, 'end_date': end_date, 'encoding': encoding,
+                     'calendar': calendars[pk]})
+
+
+@listings_calendar_swagger_decorator
+@api_view(['GET'])
+def listings_calendar(request):
+    """
+    Calendars of several listings, listings is a comma separated list of ids
+    """
+    try:
+        listing_ids = parse_listing_ids(request.query_params.get('listings'))
+        start_date, end_date, encoding = parse_calendar_window(request.query_params.get('start_date'),
+                                                               request.query_params.get('end_date'),
+                                                               request.query_params.get('encoding'))
+    except ValidationError as e:
+        return Response({"error": e.detail}, status=status.HTTP_400_BAD_REQUEST)
+
+    calendars = listing_calendars(listing_ids, start_date, end_date, encoding)
+    missing = [listing_id for listing_id in listing_ids if listing_id not in calendars]
+    if missing:
+        return Response({'error': f'Listings not found: {", ".join(map(str, missing))}.'},
+                        status=status.HTTP_404_NOT_FOUND)
+    return Response({'start_date': start_date, 'end_date': end_date, 'encoding': encoding,
+                     'calendars': {str(listing_id): calendar for listing_id, calendar in calendars.items()}})
+
+
+@next_available_slot_swagger_decorator
+@api_view(['GET'])
+def next_available_slot(request):
+    """
+    Earliest free stay of the given number of nights
+    For one listing when listing is set, otherwise for the limit listings that are free soonest
+    """
+    try:
+        nights, earliest, limit = parse_slot_request(request.query_params.get('nights'),
+                                                     request.query_params.get('earliest'),
+                                                     request.query_params.get('limit'))
+        listing_id = request.query_params.get('listing')
+        listing_id = int(listing_id) if listing_id else None
+    except ValidationError as e:
+        return Response({"error": e.detail}, status=status.HTTP_400_BAD_REQUEST)
+    except ValueError:
+        return Response({"error": "listing must be an integer."}, status=status.HTTP_400_BAD_REQUEST)
+
+    slots = next_available_slots(nights, earliest, listing_id, limit)
+    if listing_id is not None and not slots:
+        return Response({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+    logger.info('next_available_slot executed successfully')
+    return Response({'nights': nights, 'earliest': earliest, 'results': slots})
+
+
+@availability_matrix_swagger_decorator
+@api_view(['GET'])
+def availability_matrix(request):
+    """
+    Listings x nights availability grid between start_date and end_date (at most 90 nights)
+    Every listing gets a base64 little-endian bitset, bit i is set when night i is booked
+    """
+    response = availability_matrix_response(request)
+    logger.info('availability_matrix executed successfully')
+    return response
+
+
+@search_listings_swagger_decorator
+@api_view(['GET'])
+def search_listings(request):
+    """
+    Full-text search over listing name, address and description, most relevant first
+    q holds the words, start_date and end_date optionally keep only the listings free in that range
+    """
+    try:
+        terms, start_date, end_date = parse_search_request(request.query_params.get('q'),
+                                                           request.query_params.get('start_date'),
+                                                           request.query_params.get('end_date'))
+    except ValidationError as e:
+        return Response({"error": e.detail}, status=status.HTTP_400_BAD_REQUEST)
+
+    response = listing_serializers_paginate_response(request, listing_search_query(terms, start_date, end_date),
+                                                     allow_cursor=False)
+    logger.info('search_listings executed successfully')
+    return response
@@ -1,4 +1,5 @@
 import os
+import sys
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -30,6 +31,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'reservation.metrics.MetricsMiddleware',
+    'reservation.admission.AdmissionControlMiddleware',
+    'reservation.routers.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -73,10 +77,62 @@ DATABASES = {
     }
 }
 
+# The test suite (and local development with DB_ENGINE=sqlite) runs on SQLite,
+# the Postgres-only overlap indexes are skipped by the migrations there.
+TESTING = len(sys.argv) > 1 and sys.argv[1] == 'test'
+
+if TESTING or os.environ.get('DB_ENGINE') == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+        }
+    }
+
+# Read replicas: comma separated hosts with the primary's database, user and password.
+# Only views listed in REPLICA_ROUTING['READ_ONLY_VIEWS'] read from them.
+DATABASE_REPLICA_HOSTS = [host for host in os.environ.get('DATABASE_REPLICA_HOSTS', '').split(',') if host]
+READ_REPLICAS = []
+if DATABASES['default']['ENGINE'] == 'django.db.backends.postgresql':
+    for index, host in enumerate(DATABASE_REPLICA_HOSTS, start=1):
+        DATABASES[f'replica_{index}'] = {**DATABASES['default'], 'HOST': host, 'TEST': {'MIRROR': 'default'}}
+        READ_REPLICAS.append(f'replica_{index}')
+
+if TESTING:
+    # A second SQLite database the routing tests enable as a replica with override_settings
+    DATABASES['replica'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db_replica.sqlite3',
+    }
+
+DATABASE_ROUTERS = ['reservation.routers.ReplicaRouter']
+
+REPLICA_ROUTING = {
+    # Reads of a client that just wrote stay on the primary for this long
+    'STICKY_SECONDS': 5,
+    # A replica that failed to connect or query is skipped for this long
+    'EJECT_SECONDS': 30,
+    'STICKY_COOKIE': 'reservation_primary_until',
+    'READ_ONLY_VIEWS': [
+        'listing-list', 'class-listing-list', 'async-listing-list',
+        'available-listing-list', 'class-available-listing-list', 'async-available-listing-list',
+        'listing-search', 'class-listing-search',
+        'overview-reports', 'class-overview-reports', 'occupancy-report', 'class-occupancy-report',
+        'listing-details', 'class-listing-details', 'async-listing-details',
+        'listing-calendar', 'class-listing-calendar', 'listings-calendar', 'class-listings-calendar',
+        'next-available-slot', 'class-next-available-slot', 'availability-matrix', 'class-availability-matrix',
+        'export-reservations', 'class-export-reservations',
+    ],
+}
+
 # Django Rest framework Configuration
 REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.LimitOffsetPagination',
-    'PAGE_SIZE': 10
+    'PAGE_SIZE': 10,
+    'DEFAULT_RENDERER_CLASSES': [
+        'reservation.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
 }
 
 # Password validation
@@ -108,41 +164,188 @@ CACHES = {
     }
 }
 
+# Listing objects are cached in a short-lived per-process LRU in front of the cache above,
+# bump VERSION whenever the cached Listing shape changes
+LISTING_CACHE = {
+    'VERSION': 1,
+    'TIMEOUT': 300,
+    'L1_MAX_ENTRIES': 1024,
+    'L1_TIMEOUT': 5,
+    'LOCK_TIMEOUT': 5,
+}
+
+# Paginated availability search responses, a new reservation only evicts the ranges it overlaps
+AVAILABILITY_RESULT_CACHE = {
+    'ENABLED': not TESTING,
+    'TIMEOUT': 60,
+    'MAX_RANGE_DAYS': 90,
+}
+
+# Booked-night bitmasks behind the calendar endpoints, dropped per listing when its reservations change
+LISTING_CALENDAR_CACHE = {
+    'TIMEOUT': 300,
+}
+
+# Reservations that ended more than KEEP_DAYS ago are moved to ArchivedReservation by the
+# archive_reservations command, run it daily from cron
+RESERVATION_ARCHIVE = {
+    'KEEP_DAYS': 30,
+    'BATCH_SIZE': 900,
+}
+
+# Admin changelists show the Postgres planner's row estimate instead of COUNT(*) above this many rows,
+# the listing page only shows reservations that ended in the last INLINE_DAYS days or later
+ADMIN_PERFORMANCE = {
+    'ESTIMATED_COUNT_THRESHOLD': 100000,
+    'INLINE_DAYS': 90,
+    'INLINE_PAGE_SIZE': 20,
+}
+
+# Token buckets (tokens per second, bucket size) per client address and for everyone, plus a cap
+# on in-flight requests per process. Views of one GROUP share their limits, excess requests get 429.
+_SEARCH_LIMITS = {'GROUP': 'search', 'CLIENT_RATE': 5, 'CLIENT_BURST': 20,
+                  'GLOBAL_RATE': 200, 'GLOBAL_BURST': 400, 'MAX_CONCURRENT': 32}
+_BOOKING_LIMITS = {'GROUP': 'booking', 'CLIENT_RATE': 1, 'CLIENT_BURST': 5,
+                   'GLOBAL_RATE': 100, 'GLOBAL_BURST': 200, 'MAX_CONCURRENT': 16}
+ADMISSION_CONTROL = {
+    'ENABLED': not TESTING,
+    'KEY_PREFIX': 'reservation:admission',
+    # e.g. HTTP_X_FORWARDED_FOR when running behind a proxy that sets it
+    'CLIENT_IP_HEADER': os.environ.get('CLIENT_IP_HEADER') or None,
+    'TRUSTED_PROXY_COUNT': int(os.environ.get('TRUSTED_PROXY_COUNT', '1')),
+    'VIEWS': {
+        **{name: _SEARCH_LIMITS for name in (
+            'available-listing-list', 'class-available-listing-list', 'async-available-listing-list',
+            'listing-search', 'class-listing-search')},
+        **{name: _BOOKING_LIMITS for name in (
+            'add-reservation', 'class-add-reservation', 'bulk-add-reservation', 'class-bulk-add-reservation')},
+    },
+}
+
+# Local SQLite runs (tests, DB_ENGINE=sqlite) don't have Redis either
+if TESTING or os.environ.get('DB_ENGINE') == 'sqlite':
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
+
+# In-process availability index for the search endpoints, each process keeps its own
+# bitmaps, bookings from other processes are picked up after REFRESH_SECONDS
+AVAILABILITY_ENGINE = {
+    'ENABLED': os.environ.get('AVAILABILITY_ENGINE', '0') == '1',
+    'HORIZON_DAYS': 365,
+    'REFRESH_SECONDS': 300,
+    'MAX_EXCLUDED_LISTINGS': 500,
+}
+
+# Group commit: add_reservation bookings are queued to WRITERS threads (partitioned by listing id)
+# that commit up to MAX_BATCH of them per transaction, waiting at most MAX_WAIT_MS to fill a batch
+GROUP_COMMIT = {
+    'ENABLED': os.environ.get('GROUP_COMMIT', '0') == '1',
+    'WRITERS': int(os.environ.get('GROUP_COMMIT_WRITERS', '4')),
+    'MAX_BATCH': 100,
+    'MAX_WAIT_MS': 5,
+    # Seconds a request waits for its batch before answering 503
+    'TIMEOUT': 10,
+}
+
 # Logging Configuration
-LOGGING = {
-    'version': 1,
-    'disable_existing_loggers': False,
-    'formatters': {
-        'verbose': {
-            'format': '{asctime} : {levelname} : {filename} : {funcName} : {message}',
-            'style': '{',
+# LOG_MODE=queue (default) writes JSON lines from a background thread and samples SQL/DEBUG
+# records, LOG_MODE=file keeps the synchronous text log of every statement
+LOG_MODE = os.environ.get('LOG_MODE', 'queue')
+LOG_SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE', '0.01'))
+LOG_SLOW_QUERY_SECONDS = float(os.environ.get('LOG_SLOW_QUERY_SECONDS', '0.2'))
+LOG_FILE = os.environ.get('LOG_FILE', str(BASE_DIR / 'django.log'))
+
+if LOG_MODE == 'file':
+    LOGGING = {
+        'version': 1,
+        'disable_existing_loggers': False,
+        'formatters': {
+            'verbose': {
+                'format': '{asctime} : {levelname} : {filename} : {funcName} : {message}',
+                'style': '{',
+            },
         },
-    },
-    'handlers': {
-        'file': {
-            'level': 'DEBUG',
-            'class': 'logging.FileHandler',
-            'filename': 'django.log',
-            'formatter': 'verbose',
+        'handlers': {
+            'file': {
+                'level': 'DEBUG',
+                'class': 'logging.FileHandler',
+                'filename': LOG_FILE,
+                'formatter': 'verbose',
+            },
         },
-    },
-    'loggers': {
-        'django.db.backends': {
+        'loggers': {
+            'django.db.backends': {
+                'handlers': ['file'],
+                'level': 'DEBUG',
+                'propagate': False,
+            },
+            'reservations': {
+                'handlers': ['file'],
+                'level': 'DEBUG',
+                'propagate': True,
+            },
+        },
+        'root': {
             'handlers': ['file'],
             'level': 'DEBUG',
-            'propagate': False,
         },
-        'reservations': {
-            'handlers': ['file'],
+    }
+else:
+    LOGGING = {
+        'version': 1,
+        'disable_existing_loggers': False,
+        'formatters': {
+            'json': {
+                '()': 'reservation.log_handlers.JSONFormatter',
+            },
+        },
+        'filters': {
+            'sampling': {
+                '()': 'reservation.log_handlers.SamplingFilter',
+                'sample_rate': LOG_SAMPLE_RATE,
+                'slow_query_seconds': LOG_SLOW_QUERY_SECONDS,
+            },
+        },
+        'handlers': {
+            'queue': {
+                'level': 'DEBUG',
+                'class': 'reservation.log_handlers.QueueFileHandler',
+                'filename': LOG_FILE,
+                'formatter': 'json',
+                'filters': ['sampling'],
+            },
+        },
+        'loggers': {
+            'django.db.backends': {
+                'handlers': ['queue'],
+                'level': 'DEBUG',
+                'propagate': False,
+            },
+        },
+        'root': {
+            'handlers': ['queue'],
             'level': 'DEBUG',
-            'propagate': True,
         },
-    },
-    'root': {
-        'handlers': ['file'],
-        'level': 'DEBUG',
-    },
-}
+    }
+
+if TESTING:
+    # Test runs don't write the log file, records still reach handlers the tests attach
+    LOGGING = {
+        'version': 1,
+        'disable_existing_loggers': False,
+        'handlers': {
+            'null': {
+                'class': 'logging.NullHandler',
+            },
+        },
+        'root': {
+            'handlers': ['null'],
+            'level': 'DEBUG',
+        },
+    }
 
 # Internationalization
 # https://docs.djangoproject.com/en/4.2/topics/i18n/